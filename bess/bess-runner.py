@@ -30,6 +30,11 @@ import sys
 import time
 from pathlib import Path
 
+tipsy_lib = Path(__file__).resolve().parent.parent / 'lib'
+sys.path.append(str(tipsy_lib))
+from conf_tables import load_conf
+from run_time import iter_run_time
+
 
 class BessUpdater(object):
     def __init__(self, conf):
@@ -63,7 +68,7 @@ class BessUpdater(object):
         tasks = ['_'.join(e) for e in itertools.product(actions, targets)]
         table_actions = ('mod_table', 'mod_l3_table', 'mod_group_table')
         while self._running:
-            for task in self.conf.run_time:
+            for task in iter_run_time(self.conf, lambda d: ObjectView(**d)):
                 if not self._running:
                     return
                 if task.action == 'handover':
@@ -388,7 +393,7 @@ if __name__ == '__main__':
 
     try:
         def conv_fn(d): return ObjectView(**d)
-        pl_config = json.load(args.pl_conf, object_hook=conv_fn)
+        pl_config = load_conf(args.pl_conf, object_hook=conv_fn)
         bm_config = json.load(args.bm_conf, object_hook=conv_fn)
     except:
         raise
@@ -399,8 +404,8 @@ if __name__ == '__main__':
                       'daemon', 'start', '--',
                       'run', 'file',
                       pipeline_bess,
-                      'pl_config=\"%s\",bm_config=\"%s\"' %
-                      (args.pl_conf.name, args.bm_conf.name)]
+                      'pl_config=\"%s\",bm_config=\"%s\",tipsy_lib=\"%s\"' %
+                      (args.pl_conf.name, args.bm_conf.name, tipsy_lib)]
     ret_val = call_cmd(bess_start_cmd)
     try:
         url = 'http://localhost:9000/configured'
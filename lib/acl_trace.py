@@ -0,0 +1,123 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Header traces matching a set of ACL rules, in the style of the
+ClassBench trace_generator.
+
+The trace consists of scale * len(rules) headers.  Each header matches
+a random rule and is repeated a Pareto(a, b) distributed number of times
+in a row, as in ClassBench:
+
+  copies = ceil(b / (1 - U)^(1/a)), or 1 if b is 0
+
+The header of a packet is a function of the position of the packet, so
+any range of the trace can be generated independently (and vectorized
+with NumPy).
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from gen_pcap_base import derive_seed, hash_uniform
+    from pkt_template import ip2int
+except ImportError:
+    from .gen_pcap_base import derive_seed, hash_uniform
+    from .pkt_template import ip2int
+
+__all__ = ["AclTrace"]
+
+# Cap on the copies of a header, the tail of the Pareto is unbounded
+MAX_COPIES = 1 << 16
+
+
+def parse_prefix(prefix):
+    "Return (address, mask) of 'a.b.c.d/len' as integers"
+    addr, _, plen = prefix.partition('/')
+    plen = int(plen or 32)
+    mask = (0xffffffff << (32 - plen)) & 0xffffffff
+    return ip2int(addr) & mask, mask
+
+
+class AclTrace(object):
+    def __init__(self, rules, seed, pareto_a, pareto_b, scale):
+        if np is None:
+            raise ImportError('the fw traffic generator requires NumPy')
+        if not rules:
+            raise ValueError('no ACL rules to generate the trace from')
+        self.seed = seed
+        net, mask = zip(*[parse_prefix(r.src_ip) for r in rules])
+        self.src_net = np.array(net, dtype=np.uint64)
+        self.src_mask = np.array(mask, dtype=np.uint64)
+        net, mask = zip(*[parse_prefix(r.dst_ip) for r in rules])
+        self.dst_net = np.array(net, dtype=np.uint64)
+        self.dst_mask = np.array(mask, dtype=np.uint64)
+        self.sport = np.array([r.src_port for r in rules], dtype=np.int64)
+        self.dport = np.array([r.dst_port for r in rules], dtype=np.int64)
+        self.proto = np.array([getattr(r, 'ipproto', 0) for r in rules],
+                              dtype=np.int64)
+
+        header_num = max(1, int(round(scale * len(rules))))
+        self.ends = np.cumsum(self.get_copies(header_num, pareto_a, pareto_b))
+
+    def __len__(self):
+        return int(self.ends[-1])
+
+    def get_copies(self, header_num, a, b):
+        if b == 0:
+            return np.ones(header_num, dtype=np.int64)
+        u = self.uniform('copies', np.arange(header_num))
+        with np.errstate(over='ignore', divide='ignore'):
+            x = np.ceil(b / (1 - u) ** (1.0 / a))
+        return np.clip(x, 1, MAX_COPIES).astype(np.int64)
+
+    def uniform(self, field, idxs):
+        return hash_uniform(derive_seed(self.seed, 'acl', field), idxs)
+
+    def random_int(self, field, idxs, low, high):
+        "Random integers in [low, high)"
+        u = self.uniform(field, idxs)
+        return low + (u * (high - low)).astype(np.int64)
+
+    def headers(self, start, stop):
+        """Return the headers of the packets in range(start, stop) as the
+        arrays (src, dst, sport, dport, proto)."""
+        pos = np.arange(start, stop, dtype=np.int64)
+        hdr = np.searchsorted(self.ends, pos, side='right')
+        rule = self.random_int('rule', hdr, 0, len(self.proto))
+
+        def addr(field, net, mask):
+            rnd = self.random_int(field, hdr, 0, 1 << 32).astype(np.uint64)
+            return net[rule] | (rnd & ~mask[rule] & np.uint64(0xffffffff))
+
+        def port(field, ports):
+            p = ports[rule]
+            any_port = p == 0
+            p[any_port] = self.random_int(field, hdr[any_port], 1024, 65536)
+            return p
+
+        src = addr('src', self.src_net, self.src_mask)
+        dst = addr('dst', self.dst_net, self.dst_mask)
+        sport = port('sport', self.sport)
+        dport = port('dport', self.dport)
+        proto = self.proto[rule]
+        any_proto = proto == 0
+        proto[any_proto] = np.where(
+            self.uniform('proto', hdr[any_proto]) < 0.5, 6, 17)
+        return src, dst, sport, dport, proto
@@ -0,0 +1,293 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Arrival processes setting the pcap timestamps of generated traces.
+
+  - constant: the packets are 1/rate apart
+  - poisson: exponential inter-arrival times with mean 1/rate
+  - onoff: bursts of a geometric number of packets sent at rate/duty,
+    separated by exponential idle periods, so that the mean rate is rate
+  - mmpp: Markov-modulated Poisson process.  The states follow each
+    other in a cycle, a state lasts a geometric number of packets.  The
+    rates of the states are scaled so that the mean rate is rate.
+  - cdf: inter-arrival times drawn from an empirical distribution: a
+    CDF file with 'gap[us] cumulative-probability' lines or a pcap or
+    pcapng whose inter-arrival times are taken
+
+The random inter-arrival time before a packet only depends on its
+position in the trace (see gen_pcap_base.hash_uniform).  The arrival
+time of the first packet of a job (and the state of the mmpp) is the
+'carry' of the preceding jobs: the main process walks through the jobs
+once with next_carry, the workers compute the times of their own job
+with times.
+"""
+
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from pcap_analyzer import Capture
+except ImportError:
+    try:
+        from .pcap_analyzer import Capture
+    except ImportError:
+        # without NumPy
+        Capture = None
+
+__all__ = ["get_arrival", "ARRIVALS"]
+
+
+def exponential(u, mean):
+    return -np.log1p(-u) * mean
+
+
+def geometric(u, mean):
+    "Return geometric random integers (>= 1) of `mean` for uniform `u`"
+    mean = np.asarray(mean, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        scale = np.where(mean > 1, 1 / np.log1p(-1 / np.maximum(mean, 1.5)),
+                         0)
+    return 1 + np.floor(np.log1p(-u) * scale).astype(np.int64)
+
+
+def parse_states(spec):
+    "Parse the 'rate-factor:mean-packets' pairs of the mmpp states"
+    states = []
+    for item in spec.split(','):
+        factor, _, pkts = item.partition(':')
+        states.append((float(factor), float(pkts or 1)))
+    if not states or any(f <= 0 or n < 1 for f, n in states):
+        raise ValueError('invalid mmpp states: %s' % spec)
+    return states
+
+
+def parse_gap_cdf(fname):
+    "Return the gaps [us] and the cumulative probabilities of a CDF file"
+    gaps, probs = [], []
+    with open(fname) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            gap, prob = float(line[0]), float(line[1])
+            if probs and (prob < probs[-1] or gap < gaps[-1]):
+                raise ValueError('%s: CDF is not monotonic at gap %s' %
+                                 (fname, line[0]))
+            gaps.append(gap)
+            probs.append(prob)
+    if not probs or probs[-1] <= 0:
+        raise ValueError('empty inter-arrival distribution: %s' % fname)
+    probs = np.array(probs) / probs[-1]
+    # The probability below the first gap is 0
+    return (np.concatenate([[gaps[0]], gaps]),
+            np.concatenate([[0.0], probs]))
+
+
+def capture_gaps(fname):
+    "Return the sorted inter-arrival times [us] of a pcap or pcapng"
+    cap = Capture(fname)
+    try:
+        ts = [batch[0] for batch in cap.batches()]
+    finally:
+        cap.close()
+    ts = np.concatenate(ts) if ts else np.zeros(0, dtype=np.int64)
+    if len(ts) < 2:
+        raise ValueError('%s: at least two packets are needed' % fname)
+    return np.sort(np.maximum(np.diff(ts), 0)) / 1000.0
+
+
+def is_capture(fname):
+    with open(fname, 'rb') as f:
+        magic = f.read(4)
+    return magic in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4',
+                     b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d',
+                     b'\x0a\x0d\x0d\x0a')
+
+
+class Arrival(object):
+    """Base of the arrival processes.  `uniform(stream, pos)` returns
+    the uniform random numbers of the positions `pos` in a stream (an
+    integer); subclasses draw the inter-arrival time before each
+    packet in `gaps`."""
+
+    def __init__(self, args, uniform):
+        if args.arrival_rate <= 0:
+            raise ValueError('arrival-rate must be positive')
+        self.gap = 1e6 / args.arrival_rate
+        self.uniform = uniform
+
+    def start(self):
+        "Return the carry of the first job"
+        return 0.0
+
+    def gaps(self, pos, num, carry):
+        """Return the inter-arrival times [us] before the `num` packets
+        starting at position `pos` and the carry after them"""
+        raise NotImplementedError
+
+    def times(self, pos, num, carry):
+        """Return the arrival times [us] of the `num` packets starting at
+        position `pos` and the carry of the next job.  The carry is the
+        arrival time of the packet before `pos` (and the state of the
+        process)."""
+        t0, state = carry if isinstance(carry, tuple) else (carry, None)
+        gaps, state = self.gaps(pos, num, state)
+        if pos == 0 and num:
+            gaps[0] = 0.0
+        times = t0 + np.cumsum(gaps)
+        t1 = float(times[-1]) if num else t0
+        return times, t1 if state is None else (t1, state)
+
+    def next_carry(self, pos, num, carry):
+        return self.times(pos, num, carry)[1]
+
+    def timestamps(self, pos, num, carry):
+        "Return the pcap timestamps [us] of a job"
+        return np.floor(self.times(pos, num, carry)[0]).astype(np.int64)
+
+
+class ArrivalConstant(Arrival):
+    def times(self, pos, num, carry):
+        # Without accumulating errors: 1us apart by default
+        return np.arange(pos, pos + num) * self.gap, carry
+
+    def next_carry(self, pos, num, carry):
+        return carry
+
+
+class ArrivalPoisson(Arrival):
+    def gaps(self, pos, num, carry):
+        u = self.uniform(0, np.arange(pos, pos + num))
+        return exponential(u, self.gap), carry
+
+
+class ArrivalOnOff(Arrival):
+    def __init__(self, args, uniform):
+        super(ArrivalOnOff, self).__init__(args, uniform)
+        duty = args.arrival_duty_cycle
+        if not 0 < duty <= 1:
+            raise ValueError('arrival-duty-cycle must be in (0, 1]')
+        self.burst_len = float(args.arrival_burst_len)
+        # Packets of a burst are sent at the peak rate, rate/duty
+        self.burst_gap = self.gap * duty
+        self.off = self.burst_len * self.burst_gap * (1 - duty) / duty
+
+    def gaps(self, pos, num, carry):
+        idx = np.arange(pos, pos + num)
+        gaps = np.full(num, self.burst_gap)
+        if self.off > 0:
+            first = self.uniform(0, idx) < 1 / self.burst_len
+            u = self.uniform(1, idx[first])
+            gaps[first] += exponential(u, self.off)
+        return gaps, carry
+
+
+class ArrivalMmpp(Arrival):
+    def __init__(self, args, uniform):
+        super(ArrivalMmpp, self).__init__(args, uniform)
+        states = parse_states(args.arrival_states)
+        factors = np.array([f for f, _ in states])
+        self.run_len = np.array([n for _, n in states])
+        # Mean rate = all packets / time of a cycle of the states
+        scale = (self.run_len / factors).sum() / self.run_len.sum()
+        self.state_gap = self.gap / (factors * scale)
+
+    def start(self):
+        # Time, the current run and its remaining packets
+        return (0.0, (0, self.get_run_len(0)))
+
+    def get_run_len(self, run):
+        state = run % len(self.run_len)
+        return int(geometric(self.uniform(0, [run]), self.run_len[state])[0])
+
+    def get_runs(self, run, left, num):
+        """Return the state of the `num` packets starting with the
+        `left` remaining packets of `run` and the position after them"""
+        state_num = len(self.run_len)
+        lens = [np.array([left], dtype=np.int64)]
+        total = left
+        k = run + 1
+        chunk = int(num / self.run_len.mean()) + 16
+        while total < num:
+            runs = np.arange(k, k + chunk)
+            lens.append(geometric(self.uniform(0, runs),
+                                  self.run_len[runs % state_num]))
+            total += int(lens[-1].sum())
+            k += chunk
+        lens = np.concatenate(lens)
+        ends = np.cumsum(lens)
+        last = int(np.searchsorted(ends, num, side='left'))
+        states = np.repeat((run + np.arange(last + 1)) % state_num,
+                           lens[:last + 1])[:num]
+        left = int(ends[last] - num)
+        if left == 0:
+            # The next job starts with a new run
+            last += 1
+            left = self.get_run_len(run + last)
+        return states, (run + last, left)
+
+    def gaps(self, pos, num, carry):
+        run, left = carry
+        states, carry = self.get_runs(run, left, num)
+        u = self.uniform(1, np.arange(pos, pos + num))
+        return exponential(u, self.state_gap[states]), carry
+
+
+class ArrivalCdf(Arrival):
+    def __init__(self, args, uniform):
+        self.uniform = uniform
+        fname = args.arrival_cdf
+        if not os.path.exists(fname):
+            raise ValueError('arrival-cdf: no such file: %s' % fname)
+        if is_capture(fname):
+            if Capture is None:
+                raise ImportError('trace-derived arrivals require NumPy')
+            self.sorted_gaps = capture_gaps(fname)
+            self.cdf = None
+        else:
+            self.cdf_gaps, self.cdf = parse_gap_cdf(fname)
+
+    def gaps(self, pos, num, carry):
+        u = self.uniform(0, np.arange(pos, pos + num))
+        if self.cdf is None:
+            n = len(self.sorted_gaps)
+            return self.sorted_gaps[(u * n).astype(np.int64)], carry
+        return np.interp(u, self.cdf, self.cdf_gaps), carry
+
+
+ARRIVALS = {
+    'constant': ArrivalConstant,
+    'poisson': ArrivalPoisson,
+    'onoff': ArrivalOnOff,
+    'mmpp': ArrivalMmpp,
+    'cdf': ArrivalCdf,
+}
+
+
+def get_arrival(args, uniform):
+    """Return the arrival process configured in `args`, or None for the
+    default (constant 1 Mpps, the packet at position p is sent at p us)"""
+    name = args.arrival
+    if name == 'constant' and args.arrival_rate == 1000000:
+        return None
+    if np is None:
+        raise ImportError('arrival processes require NumPy')
+    return ARRIVALS[name](args, uniform)
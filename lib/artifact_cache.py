@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Content-addressed cache of generated files (pipeline.json,
+traffic.pcap).
+
+The cache key is the hash of the canonical form of the input JSON
+files, of the size and mtime of the files they refer to (replay-file,
+arrival-cdf, a pkt-size-dist CDF) and of the sources of the
+generators.  A cached file is
+hard-linked into the measurement directory (copied if the cache is on
+another file system).  The least recently used files are removed when
+the cache grows larger than its size limit.
+
+Files the command may create besides its output (e.g., the downlink
+pcap of bidir-split) are given as extra outputs.  Those created are
+cached with the output, under the same key, the others are removed
+from the measurement directory when the output is fetched.
+
+Usage (see per-dir-makefile.in):
+  artifact_cache.py --key traffic.json pipeline.json --output traffic.pcap \\
+                    --extra-output traffic-dl.pcap \\
+                    -- gen_pcap.py --json traffic.json ...
+  artifact_cache.py --ref-files traffic.json
+"""
+
+import argparse
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+__all__ = ["get_key", "get_version", "get_entry", "get_extra_entry", "fetch",
+           "store", "remove_outputs", "is_volatile", "get_ref_files",
+           "cached_run"]
+
+tipsy_dir = Path(__file__).resolve().parent.parent
+
+# Options of traffic.json naming input files of the generator
+REF_FILE_KEYS = ('replay-file', 'arrival-cdf', 'pkt-size-dist')
+
+
+def parse_size(size):
+    "Parse sizes like 512M or 20G"
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def get_version():
+    """Return a digest of the generator sources, so that the cache is
+    invalidated when TIPSY is updated."""
+    h = hashlib.sha256()
+    files = (list(tipsy_dir.glob('lib/*.py')) +
+             list(tipsy_dir.glob('module/*/Gen*.py')) +
+             list(tipsy_dir.glob('schema/*.json')))
+    for f in sorted(files):
+        h.update(str(f.relative_to(tipsy_dir)).encode())
+        h.update(f.read_bytes())
+    return h.hexdigest()
+
+
+def canonical(fname):
+    "Return the JSON content of `fname` independent of its formatting"
+    with open(fname) as f:
+        data = json.load(f)
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def get_ref_files(fname):
+    """Return the existing files the JSON config `fname` refers to (see
+    REF_FILE_KEYS), relative paths are relative to the config, which
+    is in the directory the generator runs in"""
+    with open(fname) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        return []
+    files = []
+    for name in REF_FILE_KEYS:
+        value = data.get(name)
+        if not value or not isinstance(value, str):
+            continue
+        ref = Path(fname).parent / value
+        # pkt-size-dist may be an IMIX profile or a list of sizes
+        if ref.is_file():
+            files.append(ref)
+    return files
+
+
+def get_key(output, key_files, version=None):
+    h = hashlib.sha256()
+    h.update((version or get_version()).encode())
+    h.update(Path(output).name.encode())
+    for fname in key_files:
+        h.update(b'\0')
+        h.update(canonical(fname).encode())
+        # Hashing a multi-GB capture would take long, a file updated
+        # in place changes its size or mtime
+        for ref in get_ref_files(fname):
+            st = ref.stat()
+            h.update(('\0%s:%d:%d' % (ref.name, st.st_size,
+                                       st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+
+def is_volatile(key_files):
+    "Time-seeded traffic (random-seed: 0) is not reproducible"
+    for fname in key_files:
+        with open(fname) as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data.get('random-seed', 1) == 0:
+            return True
+    return False
+
+
+def link_or_copy(src, dst):
+    tmp = '%s.tmp%d' % (dst, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def evict(cache_dir, max_size):
+    """Remove the least recently used entries until the cache fits.  The
+    files of an entry (see get_extra_entry) are removed together."""
+    entries = {}
+    for f in cache_dir.iterdir():
+        if f.is_file() and '.tmp' not in f.name:
+            st = f.stat()
+            key = f.name.split('.', 1)[0]
+            mtime, size, files = entries.get(key, (0, 0, []))
+            entries[key] = (max(mtime, st.st_mtime), size + st.st_size,
+                            files + [f])
+    total = sum(e[1] for e in entries.values())
+    for _, size, files in sorted(entries.values()):
+        if total <= max_size:
+            break
+        for f in files:
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def get_entry(cache_dir, output, key_files, version=None):
+    "Return the path of the cache entry of `output`"
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    suffix = Path(output).suffix
+    return cache_dir / (get_key(output, key_files, version) + suffix)
+
+
+def get_extra_entry(entry, extra):
+    "Return the path of the extra output `extra` in the cache entry `entry`"
+    return entry.with_name('%s.%s' % (entry.name.split('.', 1)[0],
+                                      Path(extra).name))
+
+
+def remove_outputs(outputs):
+    "Remove old outputs, which may be links to cache entries"
+    for output in outputs:
+        if os.path.lexists(str(output)):
+            os.unlink(str(output))
+
+
+def fetch(entry, output, extra=()):
+    """Link the cache entry to `output` and its `extra` outputs, return
+    False if it is not cached.  The extra outputs not in the entry are
+    removed."""
+    if not entry.exists():
+        return False
+    for f in extra:
+        extra_entry = get_extra_entry(entry, f)
+        if extra_entry.exists():
+            os.utime(str(extra_entry))
+            link_or_copy(str(extra_entry), str(f))
+        else:
+            remove_outputs([f])
+    # The mtime is the LRU timestamp, and it also makes the output
+    # newer than its prerequisites for make.
+    os.utime(str(entry))
+    link_or_copy(str(entry), output)
+    return True
+
+
+def store(output, entry, max_size, extra=()):
+    """Add the generated `output` and those of the `extra` outputs that
+    were created to the cache"""
+    # The output comes last: an entry is complete if the output exists
+    for f in extra:
+        if os.path.exists(str(f)):
+            link_or_copy(str(f), str(get_extra_entry(entry, f)))
+    link_or_copy(output, str(entry))
+    evict(entry.parent, max_size)
+
+
+def cached_run(cmd, output, key_files, cache_dir, max_size, extra=()):
+    """Create `output` (and possibly the `extra` outputs) by running
+    `cmd`, unless it is in the cache.  Return True on a cache hit."""
+    # The old outputs may be links to a cache entry: do not overwrite
+    # them.  Extra outputs of an earlier run would be stale.
+    remove_outputs([output] + list(extra))
+    if not cache_dir or is_volatile(key_files):
+        subprocess.check_call(cmd)
+        return False
+    entry = get_entry(cache_dir, output, key_files)
+    if fetch(entry, output, extra):
+        return True
+    subprocess.check_call(cmd)
+    store(output, entry, max_size, extra)
+    return False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run a generator command, unless its output is cached')
+    parser.add_argument('--cache-dir', '-d', type=str,
+                        default=os.path.expanduser('~/.cache/tipsy'),
+                        help='Cache directory. Empty string disables caching')
+    parser.add_argument('--max-size', '-s', type=parse_size, default='20G',
+                        help='Size limit of the cache, e.g., 500M, 20G')
+    parser.add_argument('--key', '-k', type=str, nargs='+',
+                        help='JSON input files the output depends on')
+    parser.add_argument('--output', '-o', type=str,
+                        help='File created by the command')
+    parser.add_argument('--extra-output', '-x', type=str, nargs='+',
+                        default=[],
+                        help='Files the command may create besides the output')
+    parser.add_argument('--ref-files', '-r', type=str, metavar='JSON',
+                        help='Print the files JSON refers to and exit')
+    parser.add_argument('cmd', nargs=argparse.REMAINDER,
+                        help='Generator command (after --)')
+    args = parser.parse_args()
+    if args.ref_files:
+        return args
+    if not args.key or not args.output:
+        parser.error('--key and --output are required')
+    if args.cmd and args.cmd[0] == '--':
+        args.cmd = args.cmd[1:]
+    if not args.cmd:
+        parser.error('missing command')
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.ref_files:
+        for ref in get_ref_files(args.ref_files):
+            print(ref)
+        sys.exit(0)
+    try:
+        hit = cached_run(args.cmd, args.output, args.key,
+                         args.cache_dir, args.max_size, args.extra_output)
+    except subprocess.CalledProcessError as e:
+        sys.exit(e.returncode)
+    if hit:
+        print('%s: taken from cache %s' % (args.output, args.cache_dir))
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Time and memory of TIPSY's own offline steps as the tables grow.
+
+  - gen_conf: GenConf create_conf and the JSON dump of pipeline.json
+  - validate: load, validate_data and dump of the generated pipeline.json
+    (the tables by the item schemas of schema/conf-tables.json)
+  - gen_pcap: packets/s (in total and per worker) for each --thread
+  - plot: plot.run_in_cwd over a synthetic results set
+
+The benchmarks but plot are run for each pipeline and table size (plot
+for a results set of --results rows).  The size sets the number of
+users (mgw, vmgw, bng), servers and L3 table entries (mgw, vmgw, bng,
+l3fwd) and L2 table entries (l2fwd); the bng NAT table has --user-conn
+entries per user.  Times are the best of
+--repeat runs.  The peak memory of gen_conf and validate is the peak of
+the Python allocations (tracemalloc, in a separate run), that of
+gen_pcap is the maximum RSS of the generator process.
+
+The results are written as JSON, along with a digest of the sources
+(see artifact_cache.get_version).  With --compare, the times are
+compared to an earlier result file, and the exit code is 1 if any of
+them is slower than --threshold times the earlier one.
+
+Usage:
+  benchmark.py --size 1000,100000 --pipeline mgw,bng -o bench.json
+  benchmark.py --size 1000,100000 --compare bench.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    from artifact_cache import get_version
+    from gen_conf import dump_conf, gen_conf
+except ImportError:
+    from .artifact_cache import get_version
+    from .gen_conf import dump_conf, gen_conf
+
+__all__ = ["run_benchmarks", "compare"]
+
+lib_dir = Path(__file__).resolve().parent
+
+BENCHMARKS = ['gen_conf', 'validate', 'gen_pcap', 'plot']
+
+
+def get_pipeline_args(name, size, user_conn):
+    "Return the gen_conf arguments of pipeline `name` of table `size`"
+    l3 = {'server': size}
+    users = {'user': size}
+    if name in ('mgw', 'vmgw'):
+        args = dict(users, **l3)
+    elif name == 'bng':
+        args = dict(users, **l3)
+        args['user-conn'] = user_conn
+    elif name == 'l3fwd':
+        args = {'upstream-l3-table-size': size,
+                'downstream-l3-table-size': size}
+    elif name == 'l2fwd':
+        args = {'upstream-table-size': size,
+                'downstream-table-size': size}
+    else:
+        raise ValueError('no benchmark for pipeline %s' % name)
+    args['name'] = name
+    return args
+
+
+def best_time(fn, repeat):
+    "Return the result of `fn` and the best wall-clock time of `repeat` runs"
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        ret = fn()
+        times.append(time.perf_counter() - start)
+    return ret, min(times)
+
+
+def peak_memory(fn):
+    "Return the peak of the Python allocations [byte] while running `fn`"
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_gen_conf(ctx, pl_args):
+    conf, t_conf = best_time(lambda: gen_conf(pl_args), ctx.repeat)
+
+    def dump():
+        with ctx.conf_file.open('w') as f:
+            dump_conf(conf, f)
+    _, t_dump = best_time(dump, ctx.repeat)
+    res = {'create_conf': t_conf, 'dump': t_dump, 'time': t_conf + t_dump,
+           'file_size': ctx.conf_file.stat().st_size}
+    if ctx.memory:
+        res['peakmem'] = peak_memory(lambda: gen_conf(pl_args))
+    return res
+
+
+def bench_validate(ctx, pl_args):
+    """Time the steps of 'validate.py -s schema/pipeline-NAME.json
+    pipeline.json': load, validate_data, dump"""
+    # validate.py is a module of the lib package, as in tipsy
+    if str(lib_dir.parent) not in sys.path:
+        sys.path.append(str(lib_dir.parent))
+    from lib import validate
+    fname = Path(validate.schema_dir) / ('pipeline-%s.json' % pl_args['name'])
+    with fname.open() as f:
+        schema = json.load(f)
+
+    def load():
+        with ctx.conf_file.open() as f:
+            return json.load(f)
+    data, t_load = best_time(load, ctx.repeat)
+    # The schema describes the pipeline arguments, some of which are
+    # replaced by the generated tables (e.g., 'cpe').  The entries of
+    # the tables are validated by their item schemas.
+    with (Path(validate.schema_dir) / 'conf-tables.json').open() as f:
+        tables = json.load(f)['tables']
+    schema.pop('additionalProperties', None)
+    for key, value in data.items():
+        if isinstance(value, (list, dict)):
+            schema['properties'].pop(key, None)
+            if key in tables:
+                schema['properties'][key] = tables[key]
+    _, t_validate = best_time(lambda: validate.validate_data(data, schema),
+                              ctx.repeat)
+    _, t_dump = best_time(lambda: json.dumps(data, sort_keys=True, indent=4),
+                          ctx.repeat)
+    res = {'load': t_load, 'validate': t_validate, 'dump': t_dump,
+           'time': t_load + t_validate + t_dump}
+    if ctx.memory:
+        res['peakmem'] = peak_memory(
+            lambda: validate.validate_data(load(), schema))
+    return res
+
+
+def run_gen_pcap(ctx, thread):
+    "Run gen_pcap.py, return its wall-clock time and maximum RSS [byte]"
+    cmd = [str(lib_dir / 'gen_pcap.py'),
+           '--conf', str(ctx.conf_file), '--output', str(ctx.pcap_file),
+           '--thread', str(thread), '--pkt-num', str(ctx.pkt_num),
+           '--random-seed', '1']
+    if ctx.traffic:
+        cmd += ['--json', ctx.traffic]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return elapsed, usage.ru_maxrss * 1024
+
+
+def bench_gen_pcap(ctx):
+    res = {}
+    for thread in ctx.threads:
+        runs = [run_gen_pcap(ctx, thread) for _ in range(ctx.repeat)]
+        elapsed = min(t for t, _ in runs)
+        res[str(thread)] = {
+            'time': elapsed,
+            'pps': ctx.pkt_num / elapsed,
+            'pps_per_worker': ctx.pkt_num / elapsed / thread,
+            'maxrss': max(m for _, m in runs),
+        }
+    # Time of the first thread count, for --compare
+    res['time'] = res[str(ctx.threads[0])]['time']
+    return res
+
+
+def write_results_set(ctx):
+    """Write a measurements/result.json of `ctx.results` rows and a
+    plot.json, return the directory of the plot"""
+    root = ctx.tmp / 'plot'
+    (root / 'measurements').mkdir(parents=True)
+    plot_dir = root / 'plots' / '001'
+    plot_dir.mkdir(parents=True)
+    rows = [{'pipeline': {'name': 'mgw', 'core': 1 + i % 8},
+             'traffic': {'pkt-size': 64 << (i % 5)},
+             'out': {'throughput': float(i % 1000) * 1000}}
+            for i in range(ctx.results)]
+    with (root / 'measurements' / 'result.json').open('w') as f:
+        json.dump(rows, f)
+    plot_conf = {'type': 'simple', 'x-axis': 'pipeline.core',
+                 'y-axis': 'out.throughput', 'group-by': 'traffic.pkt-size',
+                 'filter': {}, 'aggregate': [], 'title': 'benchmark',
+                 'axis-type': 'normal'}
+    with (plot_dir / 'plot.json').open('w') as f:
+        json.dump(plot_conf, f)
+    return plot_dir
+
+
+def bench_plot(ctx):
+    import plot
+    plot_dir = write_results_set(ctx)
+    cwd = os.getcwd()
+    os.chdir(str(plot_dir))
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        _, t_plot = best_time(plot.run_in_cwd, ctx.repeat)
+        res = {'time': t_plot}
+        if ctx.memory:
+            res['peakmem'] = peak_memory(plot.run_in_cwd)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+        os.chdir(cwd)
+    return res
+
+
+def run_bench(results, bench, params, fn, *args):
+    print('%s %s' % (bench, json.dumps(params, sort_keys=True)),
+          file=sys.stderr)
+    try:
+        res = fn(*args)
+    except ImportError as e:
+        res = {'skipped': str(e)}
+    results.append({'benchmark': bench, 'params': params, 'results': res})
+
+
+def run_benchmarks(args):
+    "Run the benchmarks, return the results as a list of dicts"
+    ctx = argparse.Namespace(**vars(args))
+    ctx.tmp = Path(tempfile.mkdtemp(prefix='tipsy-bench-'))
+    ctx.conf_file = ctx.tmp / 'pipeline.json'
+    ctx.pcap_file = ctx.tmp / 'traffic.pcap'
+    results = []
+    table_benchs = [b for b in args.bench if b != 'plot']
+    try:
+        for name in args.pipeline if table_benchs else []:
+            for size in args.size:
+                pl_args = get_pipeline_args(name, size, args.user_conn)
+                # The pipeline.json of the other benchmarks
+                run_bench(results, 'gen_conf', pl_args, bench_gen_conf,
+                          ctx, pl_args)
+                if 'gen_conf' not in args.bench:
+                    results.pop()
+                if 'validate' in args.bench:
+                    run_bench(results, 'validate', pl_args, bench_validate,
+                              ctx, pl_args)
+                if 'gen_pcap' in args.bench:
+                    params = dict(pl_args, **{'pkt-num': args.pkt_num})
+                    run_bench(results, 'gen_pcap', params, bench_gen_pcap,
+                              ctx)
+        if 'plot' in args.bench:
+            run_bench(results, 'plot', {'rows': args.results}, bench_plot,
+                      ctx)
+    finally:
+        shutil.rmtree(str(ctx.tmp))
+    return results
+
+
+def get_key(result):
+    return json.dumps([result['benchmark'], result['params']], sort_keys=True)
+
+
+def compare(old, new, threshold):
+    """Return the benchmarks of `new` whose time is more than `threshold`
+    times the time of the same benchmark in `old`"""
+    old_times = {get_key(r): r['results'].get('time')
+                 for r in old['benchmarks']}
+    regressions = []
+    for r in new['benchmarks']:
+        before = old_times.get(get_key(r))
+        after = r['results'].get('time')
+        if before and after and after > threshold * before:
+            regressions.append({'benchmark': r['benchmark'],
+                                'params': r['params'],
+                                'before': before, 'after': after,
+                                'ratio': after / before})
+    return regressions
+
+
+def int_list(s):
+    return [int(x) for x in s.split(',')]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+    parser.add_argument('--bench', '-b', type=lambda s: s.split(','),
+                        default=BENCHMARKS,
+                        help='Comma separated benchmarks (%s)'
+                        % ','.join(BENCHMARKS))
+    parser.add_argument('--pipeline', '-p', type=lambda s: s.split(','),
+                        default=['mgw', 'bng', 'l3fwd'],
+                        help='Comma separated pipelines '
+                        '(mgw, vmgw, bng, l3fwd, l2fwd)')
+    parser.add_argument('--size', '-s', type=int_list,
+                        default=[1000, 10000, 100000],
+                        help='Comma separated table sizes')
+    parser.add_argument('--user-conn', type=int, default=4,
+                        help='bng: NAT entries per user')
+    parser.add_argument('--pkt-num', '-n', type=int, default=100000,
+                        help='gen_pcap: number of packets')
+    parser.add_argument('--thread', '-t', dest='threads', type=int_list,
+                        default=[1, 2, 4],
+                        help='gen_pcap: comma separated thread counts')
+    parser.add_argument('--traffic', type=str,
+                        help='gen_pcap: traffic.json of further settings')
+    parser.add_argument('--results', type=int, default=10000,
+                        help='plot: number of rows in the results set')
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='Number of runs, the best time is taken')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip the peak memory runs')
+    parser.add_argument('--compare', '-c', type=argparse.FileType('r'),
+                        help='Earlier results to compare the times to')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown reported as a regression')
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        default='-', help='Output JSON file')
+    args = parser.parse_args()
+    unknown = set(args.bench) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    out = {
+        'version': get_version(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks': run_benchmarks(args),
+    }
+    regressions = []
+    if args.compare:
+        regressions = compare(json.load(args.compare), out,
+                              args.threshold)
+        out['regressions'] = regressions
+    json.dump(out, args.output, indent=4, sort_keys=True)
+    args.output.write('\n')
+    for r in regressions:
+        print('regression: %s %s: %.3fs -> %.3fs (%.2fx)' %
+              (r['benchmark'], json.dumps(r['params'], sort_keys=True),
+               r['before'], r['after'], r['ratio']), file=sys.stderr)
+    sys.exit(1 if regressions else 0)
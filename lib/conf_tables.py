@@ -0,0 +1,253 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Columnar sidecar of the large tables of a pipeline config.
+
+With 'gen_conf.py --sidecar', the tables of pipeline.json are written
+into pipeline.cols as binary columns, and pipeline.json refers to them:
+
+  "users": {"$sidecar": "pipeline.cols", "table": "users", "size": 1000}
+
+load_conf replaces the references with TableViews.  The sidecar is
+memory-mapped, so opening it takes no time regardless of its size, and
+processes loading the same sidecar share its pages.  A TableView is a
+list of the entries (built on access, with the object_hook of the
+config), its columns are available as NumPy arrays without copies.
+Entries can be replaced, but the columns are those of the sidecar.
+
+The sidecar starts with MAGIC, the length of a JSON header and the
+header.  The header lists the tables with their size and columns: name,
+kind ('ip', 'mac', 'int' or 'const'), and the dtype and the file offset
+of the column, or the value of a const column.  Columns are aligned to
+ALIGN bytes.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ["load_conf", "loads_conf", "write_sidecar", "TableView",
+           "format_ip", "format_mac", "sidecar_name"]
+
+MAGIC = b'TIPSYCOL'
+HDR_LEN = struct.Struct('<Q')
+ALIGN = 64
+DTYPES = {'ip': '<u4', 'mac': '<u8', 'int': '<i8'}
+REF_KEY = '$sidecar'
+
+
+def format_ip(addr):
+    return '%d.%d.%d.%d' % (addr >> 24, addr >> 16 & 255, addr >> 8 & 255,
+                            addr & 255)
+
+
+def format_mac(addr):
+    return ':'.join('%02x' % (addr >> s & 255) for s in range(40, -8, -8))
+
+
+FORMATS = {'ip': format_ip, 'mac': format_mac, 'int': int}
+
+
+def sidecar_name(conf_fname):
+    "Return the name of the sidecar of a config, e.g., pipeline.cols"
+    return os.path.splitext(conf_fname)[0] + '.cols'
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_sidecar(fname, tables):
+    """Write the tables (a dict of name -> gen_conf_base.Table) into the
+    sidecar `fname`.  Return the references to put into the config
+    instead of the tables."""
+    if np is None:
+        raise ImportError('the columnar sidecar requires NumPy')
+    header = {'tables': {}}
+    offset = 0
+    for name in sorted(tables):
+        table = tables[name]
+        columns = []
+        for col_name, kind, fn in table.columns:
+            if kind == 'const':
+                columns.append({'name': col_name, 'kind': kind, 'value': fn})
+                continue
+            dtype = np.dtype(DTYPES[kind])
+            columns.append({'name': col_name, 'kind': kind,
+                            'dtype': dtype.str, 'offset': offset})
+            offset = align(offset + table.size * dtype.itemsize)
+        header['tables'][name] = {'size': table.size, 'columns': columns}
+    text = json.dumps(header, sort_keys=True).encode('utf-8')
+    data_start = align(len(MAGIC) + HDR_LEN.size + len(text))
+    with open(fname, 'wb') as f:
+        f.write(MAGIC + HDR_LEN.pack(len(text)) + text)
+        for name in sorted(tables):
+            table = tables[name]
+            for col in header['tables'][name]['columns']:
+                if col['kind'] == 'const':
+                    continue
+                f.seek(data_start + col['offset'])
+                for start, stop in table.iter_chunks():
+                    values = table.values(col['name'], start, stop)
+                    f.write(np.asarray(values).astype(col['dtype']).tobytes())
+        f.truncate(data_start + offset)
+    base = os.path.basename(fname)
+    return {name: {REF_KEY: base, 'table': name, 'size': tables[name].size}
+            for name in tables}
+
+
+class Sidecar(object):
+    "A memory-mapped sidecar file"
+
+    def __init__(self, fname):
+        if np is None:
+            raise ImportError('the columnar sidecar requires NumPy')
+        with open(fname, 'rb') as f:
+            self.mem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mem[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s: not a TIPSY sidecar' % fname)
+        hdr_len, = HDR_LEN.unpack_from(self.mem, len(MAGIC))
+        start = len(MAGIC) + HDR_LEN.size
+        header = json.loads(self.mem[start:start + hdr_len].decode('utf-8'))
+        self.tables = header['tables']
+        self.data_start = align(start + hdr_len)
+
+    def column(self, table, col):
+        "Return the values of a column as a read-only NumPy array"
+        size = self.tables[table]['size']
+        if col['kind'] == 'const':
+            return np.broadcast_to(np.asarray(col['value']), (size,))
+        return np.frombuffer(self.mem, dtype=col['dtype'], count=size,
+                             offset=self.data_start + col['offset'])
+
+
+class TableView(object):
+    """A table of a sidecar.  Entries are dicts passed through
+    `object_hook`, as json.load would return them.  The sidecar is
+    read-only, the entries replaced by the SUT (e.g., a handover of a
+    user) are kept in memory."""
+
+    chunk = 65536
+
+    def __init__(self, sidecar, name, object_hook=None):
+        self.sidecar = sidecar
+        self.name = name
+        self.object_hook = object_hook
+        desc = sidecar.tables[name]
+        self.size = desc['size']
+        self.columns = desc['columns']
+        self.replaced = {}
+
+    def __len__(self):
+        return self.size
+
+    def column(self, name):
+        """Return the column `name` as a NumPy array: IPs and MACs as
+        integers"""
+        for col in self.columns:
+            if col['name'] == name:
+                return self.sidecar.column(self.name, col)
+        raise KeyError(name)
+
+    def rows(self, start, stop):
+        "Return the entries from `start` to `stop` as a list"
+        names = []
+        cols = []
+        for col in self.columns:
+            names.append(col['name'])
+            if col['kind'] == 'const':
+                cols.append([col['value']] * (stop - start))
+                continue
+            values = self.sidecar.column(self.name, col)[start:stop].tolist()
+            if col['kind'] != 'int':
+                values = [FORMATS[col['kind']](v) for v in values]
+            cols.append(values)
+        entries = [dict(zip(names, row)) for row in zip(*cols)]
+        if not cols:
+            entries = [{} for _ in range(start, stop)]
+        if self.object_hook is not None:
+            entries = [self.object_hook(e) for e in entries]
+        for idx in self.replaced:
+            if start <= idx < stop:
+                entries[idx - start] = self.replaced[idx]
+        return entries
+
+    def __iter__(self):
+        for start in range(0, self.size, self.chunk):
+            for entry in self.rows(start, min(start + self.chunk, self.size)):
+                yield entry
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.size)
+            if step == 1:
+                return self.rows(start, max(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError('table index out of range')
+        return self.rows(idx, idx + 1)[0]
+
+    def __setitem__(self, idx, entry):
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError('table index out of range')
+        self.replaced[idx] = entry
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return '<TableView %s: %d entries>' % (self.name, self.size)
+
+
+def loads_conf(text, base_dir='.', object_hook=None):
+    """Parse a config like json.loads(text, object_hook=object_hook), but
+    replace the references to sidecars (relative to `base_dir`) with
+    TableViews"""
+    sidecars = {}
+
+    def hook(obj):
+        if REF_KEY in obj:
+            fname = os.path.join(base_dir, obj[REF_KEY])
+            if fname not in sidecars:
+                sidecars[fname] = Sidecar(fname)
+            return TableView(sidecars[fname], obj['table'], object_hook)
+        if object_hook is not None:
+            return object_hook(obj)
+        return obj
+
+    return json.loads(text, object_hook=hook)
+
+
+def load_conf(f, object_hook=None):
+    """Load the config in the file `f` (a file name or a file object),
+    see loads_conf"""
+    if not hasattr(f, 'read'):
+        with open(str(f)) as infile:
+            return load_conf(infile, object_hook)
+    name = getattr(f, 'name', None)
+    base_dir = os.path.dirname(os.path.abspath(name)) if name else '.'
+    return loads_conf(f.read(), base_dir, object_hook)
@@ -25,13 +25,15 @@ from pathlib import Path
 try:
   import args_from_schema
   import find_mod
-  from gen_conf_base import GenConf, byte_seq
+  from conf_tables import sidecar_name, write_sidecar
+  from gen_conf_base import GenConf, Table, byte_seq_int, run_time_range
 except ImportError:
   from . import args_from_schema
   from . import find_mod
-  from .gen_conf_base import GenConf, byte_seq
+  from .conf_tables import sidecar_name, write_sidecar
+  from .gen_conf_base import GenConf, Table, byte_seq_int, run_time_range
 
-__all__ = ["gen_conf"]
+__all__ = ["gen_conf", "dump_conf", "move_to_sidecar"]
 
 def gen_conf (args):
   parser = argparse.ArgumentParser()
@@ -43,6 +45,34 @@ def gen_conf (args):
   conf = pl_class(args).create_conf()
   return conf
 
+def dump_conf (conf, f, indent=4):
+  """Write `conf` as json.dump(conf, f, indent=indent, sort_keys=True)
+  would, but the Tables in the top level are streamed chunk by chunk"""
+  def default (obj):
+    # Tables in nested objects
+    return list(obj)
+
+  f.write('{')
+  for i, key in enumerate(sorted(conf)):
+    f.write('%s\n%s%s: ' % (',' if i else '', ' ' * indent, json.dumps(key)))
+    value = conf[key]
+    if isinstance(value, Table):
+      for text in value.iter_json(indent, level=1):
+        f.write(text)
+    else:
+      text = json.dumps(value, indent=indent, sort_keys=True,
+                        default=default)
+      f.write(text.replace('\n', '\n' + ' ' * indent))
+  f.write('\n}' if conf else '}')
+
+def move_to_sidecar (conf, conf_fname):
+  """Write the Tables in the top level of `conf` into the sidecar of
+  `conf_fname` and replace them with references, see conf_tables"""
+  tables = {k: v for k, v in conf.items() if isinstance(v, Table)}
+  if tables:
+    conf.update(write_sidecar(sidecar_name(conf_fname), tables))
+  return conf
+
 def set_defaults(parser, **defaults):
   defaults = {k.replace('-', '_'): v for k, v in defaults.items()}
   parser.set_defaults(**defaults)
@@ -104,10 +134,10 @@ class GenConf_l2fwd (GenConf):
 
   def add_l2 (self):
     def make_tbl (size, template):
-      table = []
-      for i in range(size):
-        table.append({'mac':  byte_seq(template, i), 'out_port': None})
-      return table
+      return Table(size, [
+        ('mac', 'mac', lambda i: byte_seq_int(template, i)),
+        ('out_port', 'const', None),
+      ])
 
     usize = self.args.upstream_table_size
     dsize = self.args.downstream_table_size
@@ -117,21 +147,21 @@ class GenConf_l2fwd (GenConf):
     # Run-time behaviour, distribute dynamic entries proportionally
     fluct = self.args.fluct_table
     u_entries = int(fluct * usize / (usize + dsize))
-    d_entries = fluct - u_entries
-
-    def make_rule (op, entry, tbl):
-      return [{
-        'action': 'mod_table',
-        'cmd': op,
-        'entry': entry,
-        'table': tbl,
-      }]
-    rules = []
-    directions = ['upstream'] * u_entries + ['downstream'] * d_entries
-    entries = make_tbl(fluct, 'aa:bb:bb:aa:%02x:%02x')
-    for entry, d in zip(entries, directions):
-      rules = make_rule('add', entry, d) + rules + make_rule('del', entry, d)
-    self.conf['run_time'] += rules
+    if not fluct:
+      return
+
+    # The first u_entries of the table are upstream, the rest downstream.
+    # The entries are added in reverse order and deleted in order.
+    def make_rule (op, d, start, stop):
+      cmd = {'action': 'mod_table', 'cmd': op, 'table': d}
+      return run_time_range(cmd, 'run_time_table', start, stop,
+                            reverse=(op == 'add'), key='entry')
+    self.conf['run_time_table'] = make_tbl(fluct, 'aa:bb:bb:aa:%02x:%02x')
+    self.add_run_time(
+      make_rule('add', 'downstream', u_entries, fluct) +
+      make_rule('add', 'upstream', 0, u_entries),
+      make_rule('del', 'upstream', 0, u_entries) +
+      make_rule('del', 'downstream', u_entries, fluct))
 
 
 class GenConf_l3fwd (GenConf):
@@ -148,7 +178,8 @@ class GenConf_l3fwd (GenConf):
         size=self.get_arg('%s_l3_table_size' % d),
         nhops=self.get_arg('%s_group_table_size' % d),
         addr_template='%d.%d.%d.2',
-        offset_first=50+i*100
+        offset_first=50+i*100,
+        pool=((50 + i*100) << 24, (150 + i*100) << 24)
       )
 
     for d in ['upstream', 'downstream']:
@@ -160,9 +191,18 @@ class GenConf_l3fwd (GenConf):
         smac_template='%s:%%02x:%%02x' % sprefix
       )
 
-    # Define the run-time behaviour
-    def make_rule(op, entry, tbl):
-      return {'action': action, 'cmd': op, 'entry': entry, 'table': tbl}
+    # Define the run-time behaviour: the entries are added in order and
+    # deleted in reverse order
+    def make_rules (d, name, table):
+      if not len(table):
+        return
+      self.conf[name] = table
+      cmd = {'action': action, 'table': d}
+      add_rules.extend(run_time_range(dict(cmd, cmd='add'), name,
+                                      0, len(table), key='entry'))
+      del_rules[:0] = run_time_range(dict(cmd, cmd='del'), name,
+                                     0, len(table), reverse=True, key='entry')
+
     action = 'mod_l3_table'
     add_rules, del_rules  = [], []
     for i, d in enumerate(['upstream', 'downstream']):
@@ -177,10 +217,8 @@ class GenConf_l3fwd (GenConf):
         addr_template='%d.%d.%d.2',
         offset_first=1+i*20
       )
-      for entry in temp_table:
-        add_rules = add_rules + [make_rule('add', entry, d)]
-        del_rules = [make_rule('del', entry, d)] + del_rules
-    self.conf['run_time'] = add_rules + self.conf['run_time'] + del_rules
+      make_rules(d, 'run_time_%s_l3_table' % d, temp_table)
+    self.add_run_time(add_rules, del_rules)
 
     action = 'mod_group_table'
     add_rules, del_rules = [], []
@@ -196,10 +234,8 @@ class GenConf_l3fwd (GenConf):
         dmac_template='%s:%%02x:%%02x' % dprefix,
         smac_template='%s:%%02x:%%02x' % sprefix
       )
-      for entry in extra_nhops:
-        add_rules = add_rules + [make_rule('add', entry, d)]
-        del_rules = [make_rule('del', entry, d)] + del_rules
-    self.conf['run_time'] = add_rules + self.conf['run_time'] + del_rules
+      make_rules(d, 'run_time_%s_group_table' % d, extra_nhops)
+    self.add_run_time(add_rules, del_rules)
 
 
 class GenConf_mgw (GenConf):
@@ -250,27 +286,17 @@ class GenConf_bng (GenConf):
 
 
   def add_cpe (self):
-    cpe = []
-    for b in range(self.args.cpe):
-      cpe.append({
-        'id': b,
-        'mac': byte_seq('aa:cc:dd:cc:%02x:%02x', b),
-        'ip': byte_seq('1.1.%d.%d', b),
-        'port': None,
-      })
-    self.conf['cpe'] = cpe
+    self.conf['cpe'] = Table(self.args.cpe, [
+      ('id', 'int', lambda b: b),
+      ('mac', 'mac', lambda b: byte_seq_int('aa:cc:dd:cc:%02x:%02x', b)),
+      ('ip', 'ip', lambda b: byte_seq_int('1.1.%d.%d', b)),
+      ('port', 'const', None),
+    ])
 
   def add_users (self):
-    users = []
-    for u in range(self.args.user):
-      users.append({
-        'ip': byte_seq('3.3.%d.%d', u),
-        'tun_end': u % self.args.cpe,
-        'teid': u + 1,
-        'rate_limit': self.args.rate_limit,
-      })
-    self.users = users
-    self.conf['users'] = users
+    self.users = self.create_user_table(self.args.user, self.args.cpe,
+                                        '3.3.%d.%d')
+    self.conf['users'] = self.users
 
   def add_fluct_user (self):
     self.args.bst = self.args.cpe
@@ -310,6 +336,9 @@ def parse_cli_args ():
       'choices': list_pipelines(),
       'help': argparse.SUPPRESS,
       'default': 'mgw'}),
+    (['--sidecar'], {
+      'action': 'store_true',
+      'help': 'Write the large tables into a columnar sidecar file'}),
     (['--info', '-i'], {
       'action': 'store_true',
       'help': 'Show detailed info of a pipeline and exit'}),
@@ -317,7 +346,7 @@ def parse_cli_args ():
     parser.add_argument(*args, **kw)
     parser2.add_argument(*args, **kw)
 
-  parser.set_defaults(info=False)
+  parser.set_defaults(info=False, sidecar=False)
   parser2.add_argument('dummy', metavar='pipeline specific args ...',
                        nargs='?', type=str, help='see -i for details')
 
@@ -334,6 +363,8 @@ def parse_cli_args ():
     set_defaults(parser, **new_defaults)
 
   args = parser.parse_args()
+  if args.sidecar and args.output.name == '/dev/stdout':
+    parser.error('--sidecar requires --output')
   if args.info:
     parser = argparse.ArgumentParser()
     parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
@@ -346,5 +377,7 @@ def parse_cli_args ():
 if __name__ == "__main__":
   args = parse_cli_args()
   conf = gen_conf(args.__dict__)
-  json.dump(conf, args.output, sort_keys=True, indent=4)
+  if args.sidecar:
+    move_to_sidecar(conf, args.output.name)
+  dump_conf(conf, args.output)
   args.output.write("\n")
@@ -15,6 +15,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+"""Base of the pipeline config generators.
+
+The large tables of a config (users, NAT, L2/L3 tables, ...) are
+Tables: their columns are functions of the entry index, which are
+evaluated with NumPy for a chunk of entries at a time, so a table
+never has to be in memory as a whole.  See gen_conf.dump_conf and
+conf_tables.write_sidecar for writing them.
+"""
+
+import json
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+try:
+  from conf_tables import format_ip, format_mac
+  from prefix_layout import PrefixLayout
+except ImportError:
+  from .conf_tables import format_ip, format_mac
+  from .prefix_layout import PrefixLayout
+
 def byte_seq (template, seq, offset_first=1):
   try:
     return template % (int(seq / 64516) + offset_first,
@@ -23,6 +46,150 @@ def byte_seq (template, seq, offset_first=1):
   except TypeError:
     return template % (int(seq / 254), (seq % 254) + 1)
 
+def byte_seq_int (template, seq, offset_first=1):
+  """Integer form of byte_seq(), works on NumPy arrays of `seq` as well.
+  Placeholders larger than a byte carry into the preceding byte."""
+  sep = ':' if ':' in template else '.'
+  base = 16 if sep == ':' else 10
+  parts = template.split(sep)
+  if sum('%' in p for p in parts) == 3:
+    values = [seq // 64516 + offset_first, seq % 64516 // 254, seq % 254 + 1]
+  else:
+    values = [seq // 254, seq % 254 + 1]
+  addr = 0
+  for p in parts:
+    addr = addr * 256 + (values.pop(0) if '%' in p else int(p, base))
+  return addr
+
+
+class Table (object):
+  """A conf table of `size` entries.  The columns are (name, kind, fn):
+  fn returns the values of the column for the entry indices (an int or
+  a NumPy array), kind tells how the values are written: 'ip' (uint32),
+  'mac' (uint64), 'int', or 'const' (fn is the value itself).
+
+  A Table can be iterated and indexed like a list of dicts."""
+
+  chunk = 65536
+
+  def __init__ (self, size, columns=()):
+    self.size = size
+    self.columns = list(columns)
+
+  def add_column (self, name, kind, fn):
+    self.columns.append((name, kind, fn))
+    return self
+
+  def fn (self, name):
+    "Return the function of the column `name`"
+    for col_name, kind, fn in self.columns:
+      if col_name == name:
+        if kind == 'const':
+          return lambda idx: fn
+        return fn
+    raise KeyError(name)
+
+  def __len__ (self):
+    return self.size
+
+  def values (self, name, start=0, stop=None):
+    """Return the values of the column `name` for the entries from
+    `start` to `stop`: a NumPy array if NumPy is available"""
+    if stop is None:
+      stop = self.size
+    fn = self.fn(name)
+    if np is None:
+      return [fn(i) for i in range(start, stop)]
+    values = fn(np.arange(start, stop, dtype=np.int64))
+    return np.broadcast_to(values, (stop - start,))
+
+  def rows (self, start, stop):
+    """Return the Python values of the entries from `start` to `stop` as
+    a list of columns, ips and macs formatted as strings"""
+    cols = []
+    for name, kind, fn in self.columns:
+      if kind == 'const':
+        cols.append([fn] * (stop - start))
+        continue
+      values = self.values(name, start, stop)
+      if np is not None:
+        values = values.tolist()
+      if kind == 'ip':
+        values = [format_ip(v) for v in values]
+      elif kind == 'mac':
+        values = [format_mac(v) for v in values]
+      cols.append(values)
+    return cols
+
+  def iter_chunks (self):
+    "Yield the (start, stop) of the chunks of entries"
+    for start in range(0, self.size, self.chunk):
+      yield start, min(start + self.chunk, self.size)
+
+  def __iter__ (self):
+    names = [name for name, _, _ in self.columns]
+    for start, stop in self.iter_chunks():
+      for row in zip(*self.rows(start, stop)):
+        yield dict(zip(names, row))
+
+  def __getitem__ (self, idx):
+    if isinstance(idx, slice):
+      start, stop, step = idx.indices(self.size)
+      if step != 1:
+        return [self[i] for i in range(start, stop, step)]
+      names = [name for name, _, _ in self.columns]
+      return [dict(zip(names, row))
+              for row in zip(*self.rows(start, max(start, stop)))]
+    if idx < 0:
+      idx += self.size
+    if not 0 <= idx < self.size:
+      raise IndexError('table index out of range')
+    names = [name for name, _, _ in self.columns]
+    return dict(zip(names, [c[0] for c in self.rows(idx, idx + 1)]))
+
+  def iter_json (self, indent=4, level=1):
+    """Yield the JSON text of the table as json.dump(..., indent=indent,
+    sort_keys=True) writes it at the nesting `level`"""
+    if not self.size:
+      yield '[]'
+      return
+    pad = ' ' * (indent * (level + 1))
+    key_pad = pad + ' ' * indent
+    cols = sorted(enumerate(self.columns), key=lambda c: c[1][0])
+    fields = []
+    for _, (name, kind, fn) in cols:
+      if kind == 'const':
+        value = json.dumps(fn).replace('%', '%%')
+      elif kind == 'int':
+        value = '%d'
+      else:
+        value = '"%s"'
+      fields.append('%s%s: %s' % (key_pad, json.dumps(name), value))
+    template = '%s{\n%s\n%s}' % (pad, ',\n'.join(fields), pad)
+    order = [i for i, (_, kind, _) in cols if kind != 'const']
+    yield '[\n'
+    for start, stop in self.iter_chunks():
+      rows = self.rows(start, stop)
+      rows = [rows[i] for i in order]
+      if rows:
+        text = ',\n'.join(template % row for row in zip(*rows))
+      else:
+        text = ',\n'.join([template] * (stop - start))
+      yield text if start == 0 else ',\n' + text
+    yield '\n%s]' % (' ' * (indent * level))
+
+
+def run_time_range (cmd, table, start, stop, reverse=False, key='args'):
+  """Return the run-time commands (at most one) standing for `cmd` with
+  `key` set to each entry of the conf table `table` from `start` to
+  `stop`, see lib/run_time.py"""
+  if start >= stop:
+    return []
+  cmd = dict(cmd)
+  cmd['range'] = {'table': table, 'start': start, 'stop': stop,
+                  'reverse': reverse, 'key': key}
+  return [cmd]
+
 
 class GenConf (object):
 
@@ -45,39 +212,34 @@ class GenConf (object):
     self.conf['core'] = self.args.core
     self.conf['run_time'] = [] # Commands to be executed in every second
 
+  def add_run_time (self, first, last=()):
+    """Put the commands `first` before and `last` after the run-time
+    commands of the config"""
+    self.conf['run_time'] = list(first) + self.conf['run_time'] + list(last)
+
   def add_fakedrop (self):
     self.conf['fakedrop'] = self.args.fakedrop
 
   def add_bsts (self):
-    bsts = []
-    for b in range(self.args.bst):
-      bsts.append({
-        'id': b,
-        'mac': byte_seq('aa:cc:dd:cc:%02x:%02x', b),
-        'ip': byte_seq('1.1.%d.%d', b),
-        'port': None,
-      })
-    self.conf['bsts'] = bsts
+    self.conf['bsts'] = Table(self.args.bst, [
+      ('id', 'int', lambda b: b),
+      ('mac', 'mac', lambda b: byte_seq_int('aa:cc:dd:cc:%02x:%02x', b)),
+      ('ip', 'ip', lambda b: byte_seq_int('1.1.%d.%d', b)),
+      ('port', 'const', None),
+    ])
 
   def add_servers (self):
     self.conf['srvs'] = self.create_l3_table(
-      self.args.server, self.args.nhop, '2.%d.%d.2')
+      self.args.server, self.args.nhop, '2.%d.%d.2', pool=(2 << 24, 3 << 24))
 
   def add_nhops (self):
     self.conf['nhops'] = self.create_l2_table(
       self.args.nhop, 'aa:bb:bb:aa:%02x:%02x', 'ee:dd:dd:aa:%02x:%02x')
 
   def add_users (self):
-    users = []
-    for u in range(self.args.user):
-      users.append({
-        'ip': byte_seq('3.3.%d.%d', u),
-        'tun_end': u % self.args.bst,
-        'teid': u + 1,
-        'rate_limit': self.args.rate_limit,
-      })
-    self.users = users
-    self.conf['users'] = users
+    self.users = self.create_user_table(self.args.user, self.args.bst,
+                                        '3.3.%d.%d')
+    self.conf['users'] = self.users
 
   def add_fw (self):
     ul_fw_rules, dl_fw_rules = [], []
@@ -102,23 +264,22 @@ class GenConf (object):
   def add_nat (self):
     # The 'nat' component depends on the 'users' component
     # NB: this requirement is not checked.
-    nat = []
     pub_ip_format_str = '200.1.%d.%d'  # TODO: Make this configurable
     max_port = 65023
-    for user in self.users:
-      priv_ip = user['ip']
-      for c in range(self.args.user_conn):
-        priv_port = c + 1
-        port_idx = (user['teid']-1) * self.args.user_conn + c
-        pub_port = (port_idx % max_port) + 1
-        incr = int((port_idx / max_port))
-        nat.append({'priv_ip': priv_ip,
-                    'priv_port': priv_port,
-                    'pub_ip': byte_seq(pub_ip_format_str, incr),
-                    'pub_port': pub_port,
-                    'proto': 6, # TCP
-        })
-    self.conf['nat_table'] = nat
+    conn = self.args.user_conn
+    user_ip, user_teid = self.users.fn('ip'), self.users.fn('teid')
+
+    def port_idx (i):
+      return (user_teid(i // conn) - 1) * conn + i % conn
+
+    self.conf['nat_table'] = Table(len(self.users) * conn, [
+      ('priv_ip', 'ip', lambda i: user_ip(i // conn)),
+      ('priv_port', 'int', lambda i: i % conn + 1),
+      ('pub_ip', 'ip', lambda i: byte_seq_int(pub_ip_format_str,
+                                              port_idx(i) // max_port)),
+      ('pub_port', 'int', lambda i: port_idx(i) % max_port + 1),
+      ('proto', 'const', 6), # TCP
+    ])
 
   def add_dcgw (self):
     self.conf['dcgw'] = {
@@ -144,50 +305,70 @@ class GenConf (object):
 
   def add_fluct_user (self):
     # Generate ephemeral users
-    extra_users = []
-    for u in range(self.args.fluct_user):
-        extra_users.append({
-            'ip': byte_seq('4.4.%d.%d', u),
-            'tun_end': u % self.args.bst,
-            'teid': u + self.args.user + 1,
-            'rate_limit': self.args.rate_limit,
-        })
-    fl_u_add, fl_u_del = [], []
-    for i in range(self.args.fluct_user):
-        user = extra_users[i]
-        fl_u_add = fl_u_add + [{'action': 'add_user', 'args': user}]
-        fl_u_del = [{'action': 'del_user', 'args': user}] + fl_u_del
-
-    self.conf['run_time'] = fl_u_add + self.conf['run_time'] + fl_u_del
+    size = self.args.fluct_user
+    if not size:
+      return
+    self.conf['run_time_users'] = self.create_user_table(
+      size, self.args.bst, '4.4.%d.%d', self.args.user)
+    self.add_run_time(
+      run_time_range({'action': 'add_user'}, 'run_time_users', 0, size),
+      run_time_range({'action': 'del_user'}, 'run_time_users', 0, size,
+                     reverse=True))
 
   def add_fluct_server (self):
     # Generate ephemeral servers
-    extra_servers = self.create_l3_table(
-      self.args.fluct_server, self.args.nhop, '5.%d.%d.2')
-    fl_s_add, fl_s_del = [], []
-    for server in extra_servers:
-        fl_s_add = fl_s_add + [{'action': 'add_server', 'args': server}]
-        fl_s_del = [{'action': 'del_server', 'args': server}] + fl_s_del
-
-    self.conf['run_time'] = fl_s_add + self.conf['run_time'] + fl_s_del
-
-  def create_l3_table (self, size, nhops, addr_template, offset_first=1):
-    table = []
-    for i in range(size):
-      table.append({
-        'ip': byte_seq(addr_template, i, offset_first=offset_first),
-        'prefix_len': 24,       # TODO: should vary
-        'nhop': i % nhops
-      })
-    return table
+    size = self.args.fluct_server
+    if not size:
+      return
+    self.conf['run_time_srvs'] = self.create_l3_table(
+      size, self.args.nhop, '5.%d.%d.2')
+    self.add_run_time(
+      run_time_range({'action': 'add_server'}, 'run_time_srvs', 0, size),
+      run_time_range({'action': 'del_server'}, 'run_time_srvs', 0, size,
+                     reverse=True))
+
+  def create_user_table (self, size, tun_ends, addr_template, first_teid=0):
+    return Table(size, [
+      ('ip', 'ip', lambda u: byte_seq_int(addr_template, u)),
+      ('tun_end', 'int', lambda u: u % tun_ends),
+      ('teid', 'int', lambda u: u + first_teid + 1),
+      ('rate_limit', 'const', self.args.rate_limit),
+    ])
+
+  def create_l3_table (self, size, nhops, addr_template, offset_first=1,
+                       pool=None):
+    """Return an L3 table of /24 prefixes following each other.  With
+    an address `pool` (start, end), the prefixes are laid out by the
+    prefix-len, addr-layout and nested-prefix options, see
+    lib/prefix_layout.py"""
+    layout = self.get_prefix_layout(size, pool)
+    if layout is None:
+      return Table(size, [
+        ('ip', 'ip', lambda i: byte_seq_int(addr_template, i, offset_first)),
+        ('prefix_len', 'const', 24),
+        ('nhop', 'int', lambda i: i % nhops),
+      ])
+    ips, prefix_lens = layout.ips, layout.prefix_lens
+    return Table(size, [
+      ('ip', 'ip', lambda i: ips[i]),
+      ('prefix_len', 'int', lambda i: prefix_lens[i]),
+      ('nhop', 'int', lambda i: i % nhops),
+    ])
+
+  def get_prefix_layout (self, size, pool):
+    "Return the PrefixLayout of an L3 table, None for the default layout"
+    prefix_len = str(self.get_arg('prefix_len', '24'))
+    layout = self.get_arg('addr_layout', 'sequential')
+    nested = self.get_arg('nested_prefix', 0)
+    if pool is None or (prefix_len, layout, nested) == ('24', 'sequential', 0):
+      return None
+    return PrefixLayout(size, pool, prefix_len, layout, nested,
+                        self.get_arg('prefix_seed', 1))
 
   def create_l2_table (self, size, dmac_template, smac_template):
-    nhops = []
-    for n in range(size):
-      nhops.append({
-        'dmac': byte_seq(dmac_template, n),
-        'smac': byte_seq(smac_template, n),
-        'port': None,
-      })
-    return nhops
+    return Table(size, [
+      ('dmac', 'mac', lambda n: byte_seq_int(dmac_template, n)),
+      ('smac', 'mac', lambda n: byte_seq_int(smac_template, n)),
+      ('port', 'const', None),
+    ])
 
@@ -21,12 +21,17 @@
 # so we stick with python2
 
 import argparse
+import heapq
 import json
 import math
 import multiprocessing
+import os
 import random
 import scapy
+import socket
+import struct
 import sys
+import time
 try:
     from pathlib import PosixPath
 except ImportError:
@@ -38,11 +43,15 @@ from scapy.contrib.gtp import *
 try:
     import args_from_schema
     import find_mod
+    from conf_tables import load_conf
     from gen_pcap_base import *
+    from acl_trace import AclTrace
 except ImportError:
     from . import args_from_schema
     from . import find_mod
+    from .conf_tables import load_conf
     from .gen_pcap_base import *
+    from .acl_trace import AclTrace
 
 __all__ = ["gen_pcap"]
 
@@ -67,146 +76,316 @@ class GenPkt_portfwd(GenPkt):
         return 1024
 
     def gen_pkt(self, pkt_idx):
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', random.randrange(1, 65023))
-        dip = byte_seq('3.3.%d.%d', random.randrange(1, 255))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', self.rng.randrange(1, 65023))
+        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', self.rng.randrange(1, 65023))
+        dip = byte_seq('3.3.%d.%d', self.rng.randrange(1, 255))
+        return self.build_pkt(
+            'portfwd', lambda: Ether(dst=dmac, src=smac) / IP(dst=dip),
+            ['Ether.dst', 'Ether.src', 'IP.dst'], [dmac, smac, dip])
 
 
 class GenPkt_l2fwd(GenPkt):
-    def __init__(self, *args, **kw):
-        super(GenPkt_l2fwd, self).__init__(*args, **kw)
-        if self.args.dir.startswith('u'):
-            self.table = self.conf.upstream_table
-        else:
-            self.table = self.conf.downstream_table
+    # The table depends on the direction of the current packet
+    @property
+    def table_name(self):
+        return {'u': 'upstream_table', 'd': 'downstream_table'}[self.dir]
+
+    @property
+    def table(self):
+        return getattr(self.conf, self.table_name)
+
+    flow_table = table_name
+
+    @property
+    def churn_tables(self):
+        return [self.table_name]
+
+    def iter_run_time_entries(self):
+        for cmd in self.iter_run_time():
+            if cmd.action == 'mod_table' and cmd.cmd == 'add':
+                yield cmd.table + '_table', cmd.entry
 
     def get_auto_pkt_num(self):
         dir = self.args.dir
-        if 'd' in dir:  # downstream
+        if 'b' in dir:  # bidir
+            return max(len(self.conf.upstream_table),
+                       len(self.conf.downstream_table))
+        elif 'd' in dir:  # downstream
             return len(self.conf.downstream_table)
         elif 'u' in dir:  # upstream
             return len(self.conf.upstream_table)
-        elif 'b' in dir:  # bidir
-            return max(len(self.conf.upstream_table),
-                       len(self.conf.downstream_table))
         else:
             raise ValueError
 
     def gen_pkt(self, pkt_idx):
-        dmac = self.table[pkt_idx % len(self.table)].mac
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dip = byte_seq('3.3.%d.%d', random.randrange(1, 255))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        entry = self.pick_entry(self.table_name)
+        if entry is None:
+            entry = self.table[pkt_idx % len(self.table)]
+        entry = self.churn_entry(self.table_name, entry)
+        dmac = entry.mac
+        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', self.rng.randrange(1, 65023))
+        dip = byte_seq('3.3.%d.%d', self.rng.randrange(1, 255))
+        return self.build_pkt(
+            'l2fwd', lambda: Ether(dst=dmac, src=smac) / IP(dst=dip),
+            ['Ether.dst', 'Ether.src', 'IP.dst'], [dmac, smac, dip])
+
+    def gen_batch(self, pkt_idxs):
+        num = len(pkt_idxs)
+        idxs = self.get_flows(self.table_name, num)
+        if idxs is None:
+            idxs = np.asarray(pkt_idxs, dtype=np.int64) % len(self.table)
+        idxs = self.add_churn(self.table_name, idxs)
+        dmac = self.get_column(self.table_name, 'mac')[idxs]
+        smac = byte_seq_int(0xaabbbbaa0000, self.np_rng.randint(1, 65023, num))
+        dip = byte_seq_int(0x03030000, self.np_rng.randint(1, 255, num))
+        mac = self.table[0].mac
+        groups = []
+        for pos in self.split_by_pkt_size(np.arange(num)):
+            tmpl = self.get_template(
+                'l2fwd', lambda: Ether(dst=mac, src=mac) / IP(dst='3.3.0.1'),
+                ['Ether.dst', 'Ether.src', 'IP.dst'])
+            groups.append((pos, tmpl.build_batch(
+                dmac[pos], smac[pos], dip[pos],
+                sig=self.get_signatures(pos))))
+        return merge_batches(groups, num)
 
 
 class GenPkt_l3fwd(GenPkt):
-    def __init__(self, *args, **kw):
-        super(GenPkt_l3fwd, self).__init__(*args, **kw)
-        if self.args.dir.startswith('u'):
-            self.l3_table = self.conf.upstream_l3_table
-        else:
-            self.l3_table = self.conf.downstream_l3_table
-        self.sut_mac = getattr(self.conf.sut,
-                               '%sl_port_mac' % self.get_other_direction())
+    # The table depends on the direction of the current packet
+    @property
+    def l3_table_name(self):
+        return {'u': 'upstream_l3_table', 'd': 'downstream_l3_table'}[self.dir]
+
+    @property
+    def l3_table(self):
+        return getattr(self.conf, self.l3_table_name)
+
+    flow_table = l3_table_name
+
+    @property
+    def churn_tables(self):
+        return [self.l3_table_name]
+
+    def iter_run_time_entries(self):
+        # The next hops of mod_group_table are not addressed by packets
+        for cmd in self.iter_run_time():
+            if cmd.action == 'mod_l3_table' and cmd.cmd == 'add':
+                yield cmd.table + '_l3_table', cmd.entry
+
+    @property
+    def sut_mac(self):
+        return getattr(self.conf.sut,
+                       '%sl_port_mac' % self.get_other_direction())
 
     def get_auto_pkt_num(self):
         dir = self.args.dir
-        if 'd' in dir:  # downstream
+        if 'b' in dir:  # bidir
+            return max(len(self.conf.upstream_l3_table),
+                       len(self.conf.downstream_l3_table))
+        elif 'd' in dir:  # downstream
             return len(self.conf.downstream_l3_table)
         elif 'u' in dir:  # upstream
             return len(self.conf.upstream_l3_table)
-        elif 'b' in dir:  # bidir
-            return max(len(self.conf.upstream_l3_table),
-                       len(self.conf.downstream_l3_table))
         else:
             raise ValueError
 
     def gen_pkt(self, pkt_idx):
         # NB.  In the uplink case, the traffic leaves Tester via its
         # uplink port and arrives at the downlink of the SUT.
-        ip = self.l3_table[pkt_idx % len(self.l3_table)].ip
-        p = Ether(dst=self.sut_mac) / IP(dst=ip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        entry = self.pick_entry(self.l3_table_name)
+        if entry is None:
+            entry = self.l3_table[pkt_idx % len(self.l3_table)]
+        entry = self.churn_entry(self.l3_table_name, entry)
+        ip = entry.ip
+        return self.build_pkt(
+            ('l3fwd', self.dir), lambda: Ether(dst=self.sut_mac) / IP(dst=ip),
+            ['IP.dst'], [ip])
+
+    def gen_batch(self, pkt_idxs):
+        num = len(pkt_idxs)
+        idxs = self.get_flows(self.l3_table_name, num)
+        if idxs is None:
+            idxs = np.asarray(pkt_idxs, dtype=np.int64) % len(self.l3_table)
+        idxs = self.add_churn(self.l3_table_name, idxs)
+        ip = self.l3_table[0].ip
+        dip = self.get_column(self.l3_table_name, 'ip')[idxs]
+        groups = []
+        for pos in self.split_by_pkt_size(np.arange(num)):
+            tmpl = self.get_template(
+                ('l3fwd', self.dir),
+                lambda: Ether(dst=self.sut_mac) / IP(dst=ip), ['IP.dst'])
+            groups.append((pos, tmpl.build_batch(
+                dip[pos], sig=self.get_signatures(pos))))
+        return merge_batches(groups, num)
 
 
 class GenPkt_mgw(GenPkt):
+    flow_table = 'users'
+
+    @property
+    def churn_tables(self):
+        # Servers are only looked up by the uplink packets
+        return {'u': ['users', 'srvs'], 'd': ['users']}[self.dir]
 
     def get_auto_pkt_num(self):
         return len(self.conf.users)
 
     def gen_pkt(self, pkt_idx):
-        direction = '%s' % self.args.dir[0]
-        pkt_size = self.args.pkt_size
+        direction = self.dir
+        pkt_size = self.pkt_size
         gw = self.conf.gw
-        server = random.choice(self.conf.srvs)
-        user = random.choice(self.conf.users)
-        proto = random.choice([TCP, UDP])
+        server = self.rng.choice(self.conf.srvs)
+        user = self.pick_entry('users') or self.rng.choice(self.conf.users)
+        proto = self.rng.choice([TCP, UDP])
+        server = self.churn_entry('srvs', server)
+        user = self.churn_entry('users', user)
         if 'd' == direction:
             return self.gen_dl_pkt(pkt_size, proto, gw, server, user)
         elif 'u' == direction:
             bst = self.conf.bsts[user.tun_end]
             return self.gen_ul_pkt(pkt_size, proto, gw, server, user, bst)
 
+    def gen_batch(self, pkt_idxs):
+        num = len(pkt_idxs)
+        rng = self.np_rng
+        gw = self.conf.gw
+        srvs = self.get_replay_flows('srvs', num)
+        if srvs is None:
+            srvs = self.get_bidir_flows('srvs', num)
+        if srvs is None:
+            srvs = rng.randint(len(self.conf.srvs), size=num)
+        users = self.get_flows('users', num)
+        if users is None:
+            users = self.get_bidir_flows('users', num)
+        if users is None:
+            users = rng.randint(len(self.conf.users), size=num)
+        srvs = self.add_churn('srvs', srvs)
+        users = self.add_churn('users', users)
+        protos = self.get_replay('proto', num)
+        if protos is not None:
+            # Other protocols are replayed as UDP
+            protos = (protos != 6).astype(np.int64)
+        else:
+            protos = self.get_bidir_flows('proto', num, size=2)
+        if protos is None:
+            protos = rng.randint(2, size=num)
+        sport = self.get_replay('sport', num)
+        dport = self.get_replay('dport', num)
+        server_ip = self.get_column('srvs', 'ip')[srvs]
+        user_ip = self.get_column('users', 'ip')[users]
+        server, user = self.conf.srvs[0], self.conf.users[0]
+        groups = []
+        for proto_idx, proto in enumerate([TCP, UDP]):
+            for pos in self.split_by_pkt_size(
+                    np.flatnonzero(protos == proto_idx)):
+                ports = []
+                if 'd' == self.dir:
+                    if sport is not None:
+                        ports = [dport[pos], sport[pos]]
+                    tmpl = self.get_dl_template(proto, gw, server, user)
+                    pkts = tmpl.build_batch(server_ip[pos], user_ip[pos],
+                                            *ports,
+                                            sig=self.get_signatures(pos))
+                else:
+                    if sport is not None:
+                        ports = [sport[pos], dport[pos]]
+                    bst = self.conf.bsts[user.tun_end]
+                    tmpl = self.get_ul_template(proto, gw, server, user, bst)
+                    bsts = self.get_column('users', 'tun_end')[users[pos]]
+                    pkts = tmpl.build_batch(
+                        self.get_column('bsts', 'mac')[bsts],
+                        self.get_column('bsts', 'ip')[bsts],
+                        self.get_column('users', 'teid')[users[pos]],
+                        user_ip[pos], server_ip[pos], *ports,
+                        sig=self.get_signatures(pos))
+                groups.append((pos, pkts))
+        return merge_batches(groups, num)
+
+    # Template fields are indexed from the innermost layer, so that
+    # GenPkt_vmgw can wrap the packets into an additional tunnel.
+
+    def get_port_fields(self, proto):
+        "The L4 ports of the user traffic are kept when replaying a capture"
+        if self.replay is None:
+            return []
+        return ['%s[-1].sport' % proto.__name__,
+                '%s[-1].dport' % proto.__name__]
+
     def gen_dl_pkt(self, pkt_size, proto, gw, server, user):
-        p = (
-            Ether(dst=gw.mac) /
-            IP(src=server.ip, dst=user.ip) /
-            proto()
-        )
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
-
-    def gen_ul_pkt(self, *args):
-        attr = getattr(self, 'gen_ul_pkt_%s' % self.args.tunneling_method)
+        tmpl = self.get_dl_template(proto, gw, server, user)
+        return tmpl.build(server.ip, user.ip, sig=self.get_signature())
+
+    def get_dl_template(self, proto, gw, server, user):
+        return self.get_template(
+            ('dl', proto.__name__),
+            lambda: (
+                Ether(dst=gw.mac) /
+                IP(src=server.ip, dst=user.ip) /
+                proto()
+            ),
+            ['IP[-1].src', 'IP[-1].dst'] + self.get_port_fields(proto))
+
+    def gen_ul_pkt(self, pkt_size, proto, gw, server, user, bst):
+        tmpl = self.get_ul_template(proto, gw, server, user, bst)
+        return tmpl.build(bst.mac, bst.ip, user.teid, user.ip, server.ip,
+                          sig=self.get_signature())
+
+    def get_ul_template(self, *args):
+        attr = getattr(self,
+                       'get_ul_template_%s' % self.args.tunneling_method)
         return attr(*args)
 
-    def gen_ul_pkt_vxlan(self, pkt_size, proto, gw, server, user, bst):
-        p = (
-            Ether(src=bst.mac, dst=gw.mac, type=0x0800) /
-            IP(src=bst.ip, dst=gw.ip) /
-            UDP(sport=4789, dport=4789) /
-            VXLAN(vni=user.teid, flags=0x08) /
-            Ether(dst=gw.mac, type=0x0800) /
-            IP(src=user.ip, dst=server.ip) /
-            proto()
-        )
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
-
-    def gen_ul_pkt_gtp(self, pkt_size, proto, gw, server, user, bst):
-        p = (
-            Ether(src=bst.mac, dst=gw.mac, type=0x0800) /
-            IP(src=bst.ip, dst=gw.ip) /
-            UDP(sport=2152, dport=2152) /
-            GTPHeader(teid=user.teid, version=1) /
-            IP(src=user.ip, dst=server.ip) /
-            proto()
-        )
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+    def get_ul_template_vxlan(self, proto, gw, server, user, bst):
+        return self.get_template(
+            ('ul_vxlan', proto.__name__),
+            lambda: (
+                Ether(src=bst.mac, dst=gw.mac, type=0x0800) /
+                IP(src=bst.ip, dst=gw.ip) /
+                UDP(sport=4789, dport=4789) /
+                VXLAN(vni=user.teid, flags=0x08) /
+                Ether(dst=gw.mac, type=0x0800) /
+                IP(src=user.ip, dst=server.ip) /
+                proto()
+            ),
+            ['Ether[-2].src', 'IP[-2].src', 'VXLAN[-1].vni',
+             'IP[-1].src', 'IP[-1].dst'] + self.get_port_fields(proto))
+
+    def get_ul_template_gtp(self, proto, gw, server, user, bst):
+        return self.get_template(
+            ('ul_gtp', proto.__name__),
+            lambda: (
+                Ether(src=bst.mac, dst=gw.mac, type=0x0800) /
+                IP(src=bst.ip, dst=gw.ip) /
+                UDP(sport=2152, dport=2152) /
+                GTPHeader(teid=user.teid, version=1) /
+                IP(src=user.ip, dst=server.ip) /
+                proto()
+            ),
+            ['Ether[-1].src', 'IP[-2].src', 'GTPHeader[-1].teid',
+             'IP[-1].src', 'IP[-1].dst'] + self.get_port_fields(proto))
 
 
 class GenPkt_vmgw(GenPkt_mgw):
-    def gen_pkt(self, pkt_idx):
-        pkt = super(GenPkt_vmgw, self).gen_pkt(pkt_idx)
+    def get_template(self, key, proto_fn, fields):
         # Add VXLAN header for infra processing
-        vxlan_pkt = (
-            Ether(src=self.conf.dcgw.mac, dst=self.conf.gw.mac) /
-            IP(src=self.conf.dcgw.ip, dst=self.conf.gw.ip) /
-            UDP(sport=4788, dport=4789) /
-            VXLAN(vni=self.conf.dcgw.vni) /
-            pkt
-        )
-        return vxlan_pkt
+        def vxlan_pkt():
+            return (
+                Ether(src=self.conf.dcgw.mac, dst=self.conf.gw.mac) /
+                IP(src=self.conf.dcgw.ip, dst=self.conf.gw.ip) /
+                UDP(sport=4788, dport=4789) /
+                VXLAN(vni=self.conf.dcgw.vni) /
+                self.add_payload(proto_fn(), self.pkt_size)
+            )
+        return super(GenPkt_vmgw, self).get_template(key, vxlan_pkt, fields)
 
 
 class GenPkt_bng(GenPkt):
+    flow_table = 'nat_table'
+
+    @property
+    def churn_tables(self):
+        # Downlink packets are sent to the public addresses of the NAT
+        return {'u': ['users', 'srvs'], 'd': []}[self.dir]
 
     def get_auto_pkt_num(self):
         return len(self.conf.nat_table)
@@ -214,20 +393,109 @@ class GenPkt_bng(GenPkt):
     def gen_pkt(self, pkt_idx):
         protos = {'6': TCP, '17': UDP}
         gw = self.conf.gw
-        server = random.choice(self.conf.srvs)
-        user = random.choice(self.conf.users)
-        user_nat = random.choice([e for e in self.conf.nat_table
-                                  if e.priv_ip == user.ip])
+        server = self.rng.choice(self.conf.srvs)
+        user_nat = self.pick_entry('nat_table')
+        if user_nat is None:
+            user = self.rng.choice(self.conf.users)
+            user_nat = self.rng.choice(
+                self.get_index('nat_table', 'priv_ip')[user.ip])
+        else:
+            user = self.get_index('users', 'ip')[user_nat.priv_ip][0]
+        server = self.churn_entry('srvs', server)
+        user = self.churn_entry('users', user)
         proto = protos[str(user_nat.proto)]
-        if 'd' in self.args.dir:
-            pkt = (
+        if 'd' == self.dir:
+            tmpl = self.get_dl_template(proto, gw, server, user_nat)
+            return tmpl.build(server.ip, user_nat.pub_ip, user_nat.pub_port,
+                              user_nat.pub_port, sig=self.get_signature())
+        elif 'u' == self.dir:
+            cpe = self.conf.cpe[user.tun_end]
+            tmpl = self.get_ul_template(proto, gw, server, user, user_nat, cpe)
+            return tmpl.build(cpe.mac, cpe.ip, user.teid, user.ip, server.ip,
+                              user_nat.priv_port, user_nat.priv_port,
+                              sig=self.get_signature())
+        else:
+            raise ValueError
+
+    def gen_batch(self, pkt_idxs):
+        num = len(pkt_idxs)
+        rng = self.np_rng
+        gw = self.conf.gw
+        srvs = self.get_replay_flows('srvs', num)
+        if srvs is None:
+            srvs = self.get_bidir_flows('srvs', num)
+        if srvs is None:
+            srvs = rng.randint(len(self.conf.srvs), size=num)
+        nats = self.get_flows('nat_table', num)
+        if nats is None:
+            nats = self.get_bidir_flows('nat_table', num)
+        if nats is None:
+            nats = rng.randint(len(self.conf.nat_table), size=num)
+        users = self.add_churn('users', self.get_nat_users()[nats])
+        srvs = self.add_churn('srvs', srvs)
+        server_ip = self.get_column('srvs', 'ip')[srvs]
+        nat_proto = self.get_column('nat_table', 'proto')[nats]
+        server, user = self.conf.srvs[0], self.conf.users[0]
+        groups = []
+        for proto_num, proto in [(6, TCP), (17, UDP)]:
+            user_nat = self.get_index('nat_table', 'proto').get(proto_num)
+            if not user_nat:
+                continue
+            user_nat = user_nat[0]
+            for pos in self.split_by_pkt_size(
+                    np.flatnonzero(nat_proto == proto_num)):
+                if 'd' == self.dir:
+                    tmpl = self.get_dl_template(proto, gw, server, user_nat)
+                    port = self.get_column('nat_table', 'pub_port')[nats[pos]]
+                    pkts = tmpl.build_batch(
+                        server_ip[pos],
+                        self.get_column('nat_table', 'pub_ip')[nats[pos]],
+                        port, port, sig=self.get_signatures(pos))
+                else:
+                    cpe = self.conf.cpe[user.tun_end]
+                    tmpl = self.get_ul_template(proto, gw, server, user,
+                                                user_nat, cpe)
+                    cpes = self.get_column('users', 'tun_end')[users[pos]]
+                    port = self.get_column('nat_table', 'priv_port')[nats[pos]]
+                    pkts = tmpl.build_batch(
+                        self.get_column('cpe', 'mac')[cpes],
+                        self.get_column('cpe', 'ip')[cpes],
+                        self.get_column('users', 'teid')[users[pos]],
+                        self.get_column('users', 'ip')[users[pos]],
+                        server_ip[pos], port, port,
+                        sig=self.get_signatures(pos))
+                groups.append((pos, pkts))
+        return merge_batches(groups, num)
+
+    def get_nat_users(self):
+        "Return the index of the user of each NAT entry as an array"
+        key = ('nat_table', 'user')
+        col = self.columns.get(key)
+        if col is None:
+            user_idx = {}
+            for i, user in enumerate(self.conf.users):
+                user_idx.setdefault(user.ip, i)
+            col = np.array([user_idx[e.priv_ip] for e in self.conf.nat_table],
+                           dtype=np.int64)
+            self.columns[key] = col
+        return col
+
+    def get_dl_template(self, proto, gw, server, user_nat):
+        l4 = proto.__name__
+        return self.get_template(
+            ('dl', l4),
+            lambda: (
                 Ether(dst=gw.mac) /
                 IP(src=server.ip, dst=user_nat.pub_ip) /
                 proto(sport=user_nat.pub_port, dport=user_nat.pub_port)
-            )
-        elif 'u' in self.args.dir:
-            cpe = self.conf.cpe[user.tun_end]
-            pkt = (
+            ),
+            ['IP.src', 'IP.dst', l4 + '.sport', l4 + '.dport'])
+
+    def get_ul_template(self, proto, gw, server, user, user_nat, cpe):
+        l4 = proto.__name__
+        return self.get_template(
+            ('ul', l4),
+            lambda: (
                 Ether(src=cpe.mac, dst=gw.mac, type=0x0800) /
                 IP(src=cpe.ip, dst=gw.ip) /
                 UDP(sport=4789, dport=4789) /
@@ -235,93 +503,177 @@ class GenPkt_bng(GenPkt):
                 Ether(dst=gw.mac, type=0x0800) /
                 IP(src=user.ip, dst=server.ip) /
                 proto(sport=user_nat.priv_port, dport=user_nat.priv_port)
-            )
-        else:
-            raise ValueError
-        pkt = self.add_payload(pkt, self.args.pkt_size)
-        return pkt
+            ),
+            ['Ether[0].src', 'IP[0].src', 'VXLAN.vni', 'IP[1].src',
+             'IP[1].dst', l4 + '.sport', l4 + '.dport'])
 
 
 class GenPkt_fw(GenPkt):
     def __init__(self, *args, **kw):
         super(GenPkt_fw, self).__init__(*args, **kw)
+        if self.replay is not None:
+            raise ValueError('fw traffic is generated from the ACL rules, '
+                             'it cannot replay a capture')
         self.args.auto_pkt_num = True
+        args = self.args
+        d = 'd' if 'd' == args.dir[0] else 'u'
+        self.trace = AclTrace(getattr(self.conf, '%sl_fw_rules' % d),
+                              derive_seed(args.random_seed, 'fw'),
+                              args.trace_generator_pareto_a,
+                              args.trace_generator_pareto_b,
+                              args.trace_generator_scale)
+
+    def get_pkt_num(self):
+        # The length of the trace is determined by the rules
+        self.args.pkt_num = len(self.trace)
+        return self.args.pkt_num
 
     def create_work_items(self, job_size):
-        # Call `trace_generator` first
-        args = self.args
-        rulefile = 'fw_rules'
-        tracefile = rulefile + '_trace'
-        pareto_a = args.trace_generator_pareto_a
-        pareto_b = args.trace_generator_pareto_b
-        scale    = args.trace_generator_scale
-        cmd = [args.trace_generator_cmd, pareto_a, pareto_b, scale, rulefile]
-        cmd = [str(s) for s in cmd]
-
-        print(' '.join(cmd))
-        subprocess.check_call(cmd)
-        with open(tracefile) as f:
-            lines = f.readlines()
-        self.args.pkt_num = len(lines)
-
-        items = []
-        for job_idx, ls in enumerate(grouper(job_size, lines)):
-            ls = [l for l in ls if l is not None]
-            items.append({'job_idx': job_idx, 'pkt_idxs': ls})
-        return items
-
-    def gen_pkt(self, line):
-        def int2ip(ip):
-            return socket.inet_ntoa(hex(ip)[2:].zfill(8).decode('hex'))
-        vals = line.split('\t')
-        src, dst, sport, dport, proto, a, b = [int(v) for v in vals]
-        src = int2ip(src)
-        dst = int2ip(dst)
-
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', random.randrange(1, 65023))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dst, src=src, proto=proto)
-        if proto == 6:   # TCP
-            p = p / TCP(sport=sport, dport=dport)
-        if proto == 17:  # UDP
-            p = p / UDP(sport=sport, dport=dport)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
-
-def output_pkts(args, pkts):
+        # Keep the order of the trace, the copies of a header are
+        # consecutive.
+        pkt_num = self.get_pkt_num()
+        for job_idx, start in enumerate(range(0, pkt_num, job_size)):
+            stop = min(start + job_size, pkt_num)
+            yield {'job_idx': job_idx, 'pos': start,
+                   'pkt_range': (start, stop)}
+
+    def get_headers(self):
+        "Return the (src, dst, sport, dport, proto) arrays of the job"
+        headers = self.job_flows.get('fw')
+        if headers is None:
+            headers = self.trace.headers(self.job_pos,
+                                         self.job_pos + self.job_num)
+            self.job_flows['fw'] = headers
+        return headers
+
+    def get_fw_template(self, proto):
+        l4 = {6: TCP, 17: UDP}.get(proto)
+
+        def proto_fn():
+            p = Ether() / IP(proto=proto)
+            if l4:
+                p = p / l4()
+            return p
+
+        fields = ['Ether.dst', 'Ether.src', 'IP.dst', 'IP.src']
+        if l4:
+            fields += [l4.__name__ + '.sport', l4.__name__ + '.dport']
+        return self.get_template(('fw', proto), proto_fn, fields)
+
+    def gen_pkt(self, pkt_idx):
+        i = self.pkt_pos - self.job_pos
+        src, dst, sport, dport, proto = [int(h[i]) for h in self.get_headers()]
+        src = socket.inet_ntoa(struct.pack('!I', src))
+        dst = socket.inet_ntoa(struct.pack('!I', dst))
+
+        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', self.rng.randrange(1, 65023))
+        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', self.rng.randrange(1, 65023))
+        return self.get_fw_template(proto).build(dmac, smac, dst, src,
+                                                 sport, dport,
+                                                 sig=self.get_signature())
+
+    def gen_batch(self, pkt_idxs):
+        num = len(pkt_idxs)
+        src, dst, sport, dport, proto = self.get_headers()
+        smac = byte_seq_int(0xaabbbbaa0000,
+                            self.np_rng.randint(1, 65023, num))
+        dmac = byte_seq_int(0xaaccddcc0000,
+                            self.np_rng.randint(1, 65023, num))
+        groups = []
+        for p in np.unique(proto):
+            for pos in self.split_by_pkt_size(np.flatnonzero(proto == p)):
+                tmpl = self.get_fw_template(int(p))
+                pkts = tmpl.build_batch(dmac[pos], smac[pos], dst[pos],
+                                        src[pos], sport[pos], dport[pos],
+                                        sig=self.get_signatures(pos))
+                groups.append((pos, pkts))
+        return merge_batches(groups, num)
+
+def output_pkts(args, result, records):
     if args.ascii:
-        for p in pkts:
+        for frame in iter_frames(records):
             if sys.stdout.isatty():
                 #scapy.config.conf.color_theme = themes.DefaultTheme()
                 scapy.config.conf.color_theme = scapy.themes.ColorOnBlackTheme()
-            print(p.__repr__())
+            print(Ether(frame).__repr__())
     else:
+        repeat = 1
         if args.auto_pkt_num and args.pkt_num < 1024:
-            pkts = list(pkts)
-            if pkts == []:
+            if result['num'] == 0:
                 exit(-1)
-            while len(pkts) < 1024:
-                pkts = pkts + pkts
-        args.pcap_file.write(pkts)
+            while result['num'] * repeat < 1024:
+                repeat *= 2
+        if 'ul_size' in result:
+            # bidir-split: the uplink records come first
+            ul_size = result['ul_size']
+            parts = [(args.pcap_file, records[:ul_size]),
+                     (args.pcap_file_dl, records[ul_size:])]
+        else:
+            parts = [(args.pcap_file, records)]
+        for f, recs in parts:
+            for i in range(repeat):
+                f.write(recs)
+
+def warn_unsigned(args, result):
+    """Warn once about every packet template of the trace without room
+    for the signature (see GenPkt.get_template)"""
+    if not hasattr(args, 'warned_unsigned'):
+        args.warned_unsigned = set()
+    for tmpl in result.get('unsigned', []):
+        if tmpl not in args.warned_unsigned:
+            args.warned_unsigned.add(tmpl)
+            sys.stderr.write('%s: warning: no room for the signature in the '
+                             '%s packets, they are not signed\n'
+                             % (getattr(args.output, 'name', args.output),
+                                tmpl))
+
+def get_dl_output(fname):
+    "Return the name of the downlink pcap of bidir-split, e.g., traffic-dl.pcap"
+    root, ext = os.path.splitext(fname)
+    return root + '-dl' + ext
+
+def get_gen_class(name):
+    "Return the GenPkt class of pipeline `name` (module or builtin)"
+    return find_mod.find_class('GenPkt', name)
 
 def gen_pcap(*defaults):
     args = parse_args(defaults)
-    conf = json_load(args.conf, object_hook=ObjectView)
+    conf = load_conf(args.conf, object_hook=ObjectView)
 
-    if args.random_seed:
-        random.seed(args.random_seed)
+    # Workers derive a random generator for each job from the seed
+    if not args.random_seed:
+        args.random_seed = int(time.time())
 
     in_que = multiprocessing.Queue()
     out_que = multiprocessing.Queue()
-    gen_pkt_class = find_mod.find_class('GenPkt', conf.name)
+    gen_pkt_class = get_gen_class(conf.name)
     gen_pkt_obj = gen_pkt_class(args, conf, in_que, out_que)
+    # Set before the workers are forked
+    gen_pkt_obj.pkt_num = gen_pkt_obj.get_pkt_num()
     worker_num = max(1, args.thread)
     job_size = 1024
 
+    # Jobs in flight, each job has its own slot in the ring.  Results
+    # larger than a slot (and every result in ascii mode) are sent
+    # through the out_que.  As new jobs are only dispatched when a slot
+    # is freed, the memory used is independent of the number of jobs.
+    slot_num = 4 * worker_num
+    # Add some room for tunnel headers if the sizes are of inner frames
+    pkt_size = gen_pkt_obj.max_pkt_size() + 128 * args.pkt_size_inner
+    slot_size = job_size * (REC_HDR.size + max(pkt_size, 256))
     if args.ascii:
         print("Dumping packets:")
+        ring = None
     else:
-        args.pcap_file = PcapWriter(args.output.name)
+        args.pcap_file = open(args.output.name, 'wb')
+        args.pcap_file.write(pcap_header())
+        if args.dir == 'bidir' and args.bidir_split:
+            if args.output.name.startswith('/dev/'):
+                exit('bidir-split requires an output file')
+            args.pcap_file_dl = open(get_dl_output(args.output.name), 'wb')
+            args.pcap_file_dl.write(pcap_header())
+        ring = ShmRing(slot_num, slot_size)
+    gen_pkt_obj.ring = ring
 
     processes = []
     for i in range(worker_num):
@@ -329,11 +681,15 @@ def gen_pcap(*defaults):
         p.start()
         processes.append(p)
 
+    items = iter(gen_pkt_obj.work_items(job_size))
     num_jobs = 0
-    for item in gen_pkt_obj.create_work_items(job_size):
+    for slot, item in zip(range(slot_num), items):
+        item['slot'] = slot
         in_que.put(item)
         num_jobs += 1
 
+    # Reorder buffer: a heap of the results that arrived before the
+    # results of preceding jobs.
     results = []
     next_idx = 0
     while next_idx < num_jobs:
@@ -342,16 +698,22 @@ def gen_pcap(*defaults):
             print('Exception: %s' % result['exception'])
             print(''.join(result['traceback']))
             exit()
-        # print('idx: %s' % result['job_idx'])
-        results.append(result)
-        results.sort(key=lambda x: x['job_idx'])
-        # print([x['job_idx'] for x in results])
-        while len(results) > 0 and results[0]['job_idx'] == next_idx:
-            # print('w: %s' % results[0]['job_idx'])
-            pkts = [PicklablePacket.__call__(p) for p in results[0]['pkts']]
-            output_pkts(args, pkts)
-            results.pop(0)
+        heapq.heappush(results, (result['job_idx'], result))
+        while results and results[0][0] == next_idx:
+            _, result = heapq.heappop(results)
+            slot = result['slot']
+            warn_unsigned(args, result)
+            if 'records' in result:
+                output_pkts(args, result, result['records'])
+            else:
+                output_pkts(args, result, ring.view(slot, result['size']))
             next_idx += 1
+            # Reuse the slot for the next job
+            for item in items:
+                item['slot'] = slot
+                in_que.put(item)
+                num_jobs += 1
+                break
 
     # stop workers
     for i in range(worker_num):
@@ -361,6 +723,9 @@ def gen_pcap(*defaults):
 
     if not args.ascii:
         args.pcap_file.close()
+        if getattr(args, 'pcap_file_dl', None):
+            args.pcap_file_dl.close()
+        ring.close()
 
 def json_load(file, object_hook=None):
     if type(file) == str:
@@ -372,7 +737,7 @@ def json_load(file, object_hook=None):
     else:
         return json.load(file, object_hook=object_hook)
 
-def parse_args(defaults=None):
+def parse_args(defaults=None, argv=None):
     if defaults:
         required = False
     else:
@@ -380,7 +745,7 @@ def parse_args(defaults=None):
     parser = argparse.ArgumentParser()
     args_from_schema.add_args(parser, 'traffic')
     parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
-    pa_args = None
+    pa_args = argv
     if defaults:
         parser.set_defaults(**defaults)
         pa_args = []
@@ -15,81 +15,830 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from itertools import izip, chain, repeat
+import hashlib
 import random
 import traceback
 
 from scapy.all import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from arrival import get_arrival
+    from conf_tables import TableView
+    from run_time import iter_run_time
+    from pcap_io import *
+    from pkt_size import PktSizeDist
+    from pkt_template import *
+    from pkt_template import get_layers
+    from trace_replay import TraceReplay
+except ImportError:
+    from .arrival import get_arrival
+    from .conf_tables import TableView
+    from .run_time import iter_run_time
+    from .pcap_io import *
+    from .pkt_size import PktSizeDist
+    from .pkt_template import *
+    from .pkt_template import get_layers
+    from .trace_replay import TraceReplay
+
+def entries_to_column(entries, attr):
+    """Return the `attr` of the conf `entries` as a NumPy array, MAC and
+    IP addresses are converted to integers"""
+    vals = [getattr(e, attr) for e in entries]
+    if vals and ':' in str(vals[0]):
+        vals = [mac2int(v) for v in vals]
+    elif vals and '.' in str(vals[0]):
+        vals = [ip2int(v) for v in vals]
+    return np.array(vals, dtype=np.uint64)
+
 def byte_seq(template, seq):
     return template % (int(seq / 254), (seq % 254) + 1)
 
-# https://stackoverflow.com/a/312644
-def grouper(n, iterable, padvalue=None):
-    "grouper(3, 'abcdefg', 'x') --> ('a','b','c'), ('d','e','f'), ('g','x','x')"
-    return izip(*[chain(iterable, repeat(padvalue, n-1))]*n)
+def derive_seed(seed, *path):
+    """Return a 64-bit seed derived from `seed` and `path` (e.g., a job
+    index).  The result does not depend on the python version."""
+    key = '/'.join(str(x) for x in (seed,) + path).encode('ascii')
+    return int(hashlib.sha256(key).hexdigest()[:16], 16)
+
+def byte_seq_int(prefix, seq):
+    "Integer form of byte_seq(), works on NumPy arrays of `seq` as well"
+    return prefix | ((seq // 254) << 8) | ((seq % 254) + 1)
+
+
+class Permutation(object):
+    """A pseudo-random permutation of range(size) evaluated on demand.
+
+    This is a 4-round Feistel network over the smallest even-bit domain
+    containing `size` with cycle walking, so the shuffled order of a
+    trace needs O(1) memory.  The NumPy path gives the same result."""
+
+    C1 = 0x9E3779B1
+    C2 = 0x85EBCA6B
+
+    def __init__(self, size, keys):
+        self.size = size
+        self.keys = keys
+        self.half = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half) - 1
+
+    def encrypt(self, x):
+        l, r = x >> self.half, x & self.mask
+        for k in self.keys:
+            f = ((r * self.C1 + k) & 0xffffffff) * self.C2 >> 16
+            l, r = r, l ^ (f & self.mask)
+        return (l << self.half) | r
+
+    def __getitem__(self, idx):
+        x = self.encrypt(idx)
+        while x >= self.size:
+            x = self.encrypt(x)
+        return x
+
+    def encrypt_array(self, x):
+        half, mask = np.uint64(self.half), np.uint64(self.mask)
+        l, r = x >> half, x & mask
+        for k in self.keys:
+            f = ((r * np.uint64(self.C1) + np.uint64(k)) &
+                 np.uint64(0xffffffff)) * np.uint64(self.C2) >> np.uint64(16)
+            l, r = r, l ^ (f & mask)
+        return (l << half) | r
+
+    def take(self, start, stop):
+        "Return [self[i] for i in range(start, stop)]"
+        if np is None:
+            return [self[i] for i in range(start, stop)]
+        x = self.map_array(np.arange(start, stop, dtype=np.uint64))
+        return x.tolist()
+
+    def map_array(self, idxs):
+        "Return the NumPy array [self[i] for i in idxs]"
+        x = self.encrypt_array(np.asarray(idxs, dtype=np.uint64))
+        out = x >= self.size
+        while out.any():
+            x[out] = self.encrypt_array(x[out])
+            out = x >= self.size
+        return x.astype(np.int64)
+
 
+def hash_uniform(seed, x):
+    """Return uniform floats in [0, 1) as a function of `seed` and the
+    integer array `x` (splitmix64).  Unlike a random stream, the value
+    for a packet does not depend on how the trace is split into jobs."""
+    z = (np.asarray(x, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15) +
+         np.uint64(seed))
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
 
-class PicklablePacket(object):
-    """A container for scapy packets that can be pickled (in contrast
-    to scapy packets themselves). https://stackoverflow.com/a/4312192"""
 
-    __slots__ = ['contents', 'time']
+class FlowSelector(object):
+    """Locality model of the flows (table entries) of a trace.
 
-    def __init__(self, pkt):
-        self.contents = bytes(pkt)
-        self.time = pkt.time
+    The entries are ranked in a random order.  A packet picks a rank of
+    the working set (the `working_set` consecutive ranks starting at an
+    offset) according to the `popularity` distribution:
 
-    def __call__(self):
-        """Get the original scapy packet."""
-        pkt = Ether(self.contents)
-        pkt.time = self.time
-        return pkt
+      uniform: every rank is equally likely
+      zipf:    the probability of rank r is proportional to (r + 1)^-s
+      pareto:  rank r has the mass of [r, r + 1) of a Lomax(s)
+               distribution, i.e., a Pareto shifted to 0
+
+    where s is the `exponent`.  The working set slides through all the
+    entries in every `lifetime` packets (0: the working set is fixed),
+    and `burst` consecutive packets go to the same flow.
+
+    With `coverage` k, every entry is hit at least k times: k * size
+    randomly chosen positions of the trace of `trace_len` packets
+    are stratified (each entry appears exactly k times among them), the
+    rest of the positions follow the model above.  The entry of a
+    packet only depends on its position in the trace."""
+
+    def __init__(self, size, seed, popularity='uniform', exponent=1.0,
+                 working_set=0, lifetime=0, burst=1, coverage=0,
+                 trace_len=0):
+        if np is None:
+            raise ImportError('the locality models require NumPy')
+        self.size = size
+        self.seed = seed
+        self.working_set = min(working_set or size, size)
+        self.lifetime = lifetime
+        self.burst = max(1, burst)
+        rng = random.Random(seed)
+        self.perm = Permutation(size, [rng.getrandbits(32) for _ in range(4)])
+        self.covered = coverage * size
+        if self.covered:
+            if trace_len < self.covered:
+                raise ValueError('%d packets cannot hit %d entries %d times'
+                                 % (trace_len, size, coverage))
+            self.trace_perm = Permutation(
+                trace_len, [rng.getrandbits(32) for _ in range(4)])
+            self.cover_perm = Permutation(
+                self.covered, [rng.getrandbits(32) for _ in range(4)])
+        ranks = np.arange(self.working_set, dtype=np.float64)
+        if popularity == 'zipf':
+            weights = (ranks + 1) ** -exponent
+        elif popularity == 'pareto':
+            weights = (ranks + 1) ** -exponent - (ranks + 2) ** -exponent
+        elif popularity in ('uniform', 'default'):
+            weights = None
+        else:
+            raise ValueError('unknown popularity model: %s' % popularity)
+        if weights is None:
+            self.cdf = None
+        else:
+            self.cdf = np.cumsum(weights)
+            self.cdf /= self.cdf[-1]
+
+    def select(self, pos):
+        "Return the entry index of the packets at positions `pos`"
+        pos = np.asarray(pos, dtype=np.int64)
+        burst_start = pos - pos % self.burst
+        u = hash_uniform(self.seed, burst_start // self.burst)
+        if self.cdf is None:
+            rank = (u * self.working_set).astype(np.int64)
+        else:
+            rank = np.searchsorted(self.cdf, u, side='right')
+        rank = np.minimum(rank, self.working_set - 1)
+        if self.lifetime:
+            rank += burst_start * self.size // self.lifetime
+        flows = self.perm.map_array(rank % self.size)
+        if self.covered:
+            q = self.trace_perm.map_array(pos)
+            cover = q < self.covered
+            flows[cover] = self.cover_perm.map_array(q[cover]) % self.size
+        return flows
 
 
 class GenPkt(object):
+    # The conf table the flows of the pipeline are the entries of, see
+    # get_flows
+    flow_table = None
+    # The conf tables having entries added at run time that the packets
+    # of the 'churn' option are sent to, see iter_run_time_entries
+    churn_tables = []
+
     def __init__(self, args, conf, in_que, out_que):
         self.args = args
         self.conf = conf
         self.in_que = in_que
         self.out_que = out_que
+        self.ring = None
+        self.templates = {}
+        # The templates without room for the signature, see get_template
+        self.unsigned = set()
+        self.columns = {}
+        self.indexes = {}
+        self.selectors = {}
+        self.job_flows = {}
+        self.job_pos = 0
+        self.job_num = 0
+        # The job positions of the packets of the current gen_batch call
+        # if not the whole job (see gen_bidir_batch)
+        self.batch_sel = None
+        self.pkt_pos = 0
+        self.pkt_num = 0
+        self.pkt_size = args.pkt_size
+        # Direction of the current packet: 'u' or 'd'
+        self.dir = 'd' if args.dir == 'downlink' else 'u'
+        if args.dir == 'bidir':
+            if np is None:
+                raise ImportError('bidir traffic requires NumPy')
+            # The directions are generated by separate gen_batch calls
+            args.batch = True
+        if args.churn and np is None:
+            raise ImportError('churn traffic requires NumPy')
+        self.job_sizes = None
+        self.trace_id = (args.trace_id or
+                         derive_seed(args.random_seed, 'trace') & 0xffffffff)
+        self.size_dist = None
+        if args.pkt_size_dist:
+            self.size_dist = PktSizeDist(args.pkt_size_dist)
+        # Flows, sizes and timestamps are taken from a capture, the
+        # sizes are those of the innermost frames
+        self.replay = None
+        if args.replay_file:
+            self.replay = TraceReplay(args.replay_file)
+            args.batch = True
+            args.pkt_size_inner = True
+        # Timestamps other than 1us apart, see work_items
+        self.arrival = None
+        if self.replay is None:
+            self.arrival = get_arrival(args, self.arrival_uniform)
+        self.rng = random
+        self.np_rng = None
+
+    def seed_job(self, job_idx):
+        """Reset the random generators for job `job_idx`.  Each job has its
+        own stream, so the trace is independent of the number of
+        workers and of the order the jobs are processed in.
+
+        Pipelines should draw random numbers from self.rng (a
+        random.Random) and, in gen_batch, from self.np_rng (a
+        numpy.random.RandomState, whose stream is fixed across NumPy
+        versions).  The global `random` module is seeded as well for
+        pipelines not yet converted."""
+        seed = derive_seed(self.args.random_seed, 'job', job_idx)
+        self.rng = random.Random(seed)
+        random.seed(derive_seed(self.args.random_seed, 'global', job_idx))
+        if np is not None:
+            self.np_rng = np.random.RandomState(
+                [seed & 0xffffffff, seed >> 32])
 
     def create_work_items(self, job_size):
+        """Yield the jobs.  A job either lists its 'pkt_idxs' or gives a
+        'pkt_range' of the packet indices, shuffled by 'perm' if set."""
         pkt_num = self.get_pkt_num()
-        pkt_idx = list(range(pkt_num))
-        random.shuffle(pkt_idx)
-        items = []
-        for job_idx, pkt_idxs in enumerate(grouper(job_size, pkt_idx)):
-            pkt_idxs = [idx for idx in pkt_idxs if idx is not None]
-            items.append({'job_idx': job_idx, 'pkt_idxs': pkt_idxs})
-        return items
+        if self.replay is not None:
+            # Keep the order of the capture, a job is a block of it
+            for job_idx, (pos, num) in enumerate(self.replay.jobs(pkt_num)):
+                yield {'job_idx': job_idx, 'pos': pos,
+                       'pkt_range': (pos, pos + num)}
+            return
+        rng = random.Random(derive_seed(self.args.random_seed, 'perm'))
+        perm = Permutation(pkt_num, [rng.getrandbits(32) for _ in range(4)])
+        for job_idx, start in enumerate(range(0, pkt_num, job_size)):
+            stop = min(start + job_size, pkt_num)
+            yield {'job_idx': job_idx, 'pos': start,
+                   'pkt_range': (start, stop), 'perm': perm}
+
+    def work_items(self, job_size):
+        """Yield the jobs of create_work_items.  With an arrival process,
+        the jobs get the 'arrival' carry of the preceding jobs, i.e.,
+        the time of their first packet."""
+        items = self.create_work_items(job_size)
+        if self.arrival is None:
+            for item in items:
+                yield item
+            return
+        carry = self.arrival.start()
+        for item in items:
+            if 'pkt_idxs' in item:
+                num = len(item['pkt_idxs'])
+            else:
+                num = item['pkt_range'][1] - item['pkt_range'][0]
+            item['arrival'] = carry
+            carry = self.arrival.next_carry(item['pos'], num, carry)
+            yield item
+
+    def arrival_uniform(self, stream, x):
+        seed = derive_seed(self.args.random_seed, 'arrival', stream)
+        return hash_uniform(seed, x)
+
+    @staticmethod
+    def get_pkt_idxs(item):
+        if 'pkt_idxs' in item:
+            return item.pop('pkt_idxs')
+        if 'perm' not in item:
+            return list(range(*item.pop('pkt_range')))
+        return item.pop('perm').take(*item.pop('pkt_range'))
 
     def do_work(self):
+        """Generate the jobs of the in_que and send the results to the
+        out_que (see do_job)"""
         try:
             while True:
                 item = self.in_que.get()
                 if item is None:
                     break
-                pkt_idxs = item['pkt_idxs']
-                pkts = [PicklablePacket(self.gen_pkt(idx)) for idx in pkt_idxs]
-                item['pkts'] = pkts
-                del item['pkt_idxs']
-                self.out_que.put(item)
+                self.out_que.put(self.do_job(item))
         except Exception as e:
             item = {'exception': e, 'traceback': traceback.format_exc()}
             self.out_que.put(item)
             return True
 
+    def do_job(self, item):
+        """Generate the packets of the job `item` as pcap records and
+        return the result.  The records are written into the ring slot
+        of the job, or, if they do not fit, they are sent in the
+        'records' field of the result."""
+        pkt_idxs = self.get_pkt_idxs(item)
+        slot = item['slot']
+        self.seed_job(item['job_idx'])
+        self.job_pos = item['pos']
+        self.job_num = len(pkt_idxs)
+        self.job_flows = {}
+        self.job_sizes = self.get_pkt_sizes(self.job_pos,
+                                            self.job_num)
+        self.pkt_size = self.args.pkt_size
+        uplink = self.get_uplink(self.job_pos, self.job_num)
+        batch = None
+        if self.args.batch and np is not None:
+            batch = self.gen_bidir_batch(pkt_idxs, uplink)
+        if batch is None and self.replay is not None:
+            raise NotImplementedError(
+                '%s cannot replay captures' % type(self).__name__)
+        ts = self.get_timestamps(item['pos'], len(pkt_idxs),
+                                 item.get('arrival'))
+        order = None
+        if uplink is not None and self.args.bidir_split:
+            # Uplink packets first, see output_pkts
+            order = np.concatenate([np.flatnonzero(uplink),
+                                    np.flatnonzero(~uplink)])
+            ts = np.asarray(ts)[order]
+            item['ul_num'] = int(uplink.sum())
+        if batch is None:
+            pkts = []
+            for i, idx in enumerate(pkt_idxs):
+                self.pkt_pos = self.job_pos + i
+                if self.job_sizes is not None:
+                    self.pkt_size = int(self.job_sizes[i])
+                if uplink is not None:
+                    self.dir = 'u' if uplink[i] else 'd'
+                pkts.append(bytes(self.gen_pkt(idx)))
+            if order is not None:
+                pkts = [pkts[i] for i in order]
+                item['ul_size'] = sum(
+                    len(p) + REC_HDR.size
+                    for p in pkts[:item['ul_num']])
+            records = pcap_records(pkts, ts)
+            size = len(records)
+            if self.ring is not None and self.ring.fits(size):
+                self.ring.write(slot, records)
+            else:
+                item['records'] = records
+        else:
+            data, lens = batch
+            if order is not None:
+                data, lens = take_frames(data, lens, order)
+                ul_lens = lens[:item['ul_num']]
+                item['ul_size'] = int(ul_lens.sum() +
+                                      len(ul_lens) * REC_HDR.size)
+            size = int(lens.sum()) + len(lens) * REC_HDR.size
+            if self.ring is not None and self.ring.fits(size):
+                pcap_records_batch(data, lens, ts,
+                                   out=self.ring.array(slot, size))
+            else:
+                records = pcap_records_batch(data, lens, ts)
+                item['records'] = records.tobytes()
+        item['num'] = len(pkt_idxs)
+        item['size'] = size
+        if self.unsigned:
+            item['unsigned'] = sorted(self.unsigned)
+        return item
+
     def gen_pkt(self, pkt_idx):
         raise NotImplementedError
 
+    def get_uplink(self, pos, num):
+        """Return a boolean array telling which of the `num` packets
+        starting at position `pos` are uplink packets in bidir mode
+        (None otherwise).  On average, there are bidir_ratio uplink
+        packets for every downlink packet."""
+        if self.args.dir != 'bidir':
+            return None
+        if self.replay is not None:
+            return self.replay.job(pos, num)['uplink']
+        ratio = float(self.args.bidir_ratio)
+        seed = derive_seed(self.args.random_seed, 'dir')
+        u = hash_uniform(seed, np.arange(pos, pos + num))
+        return u < ratio / (1 + ratio)
+
+    def gen_bidir_batch(self, pkt_idxs, uplink):
+        """Call gen_batch, in bidir mode once for the packets of each
+        direction, and merge the two batches in packet order"""
+        if uplink is None:
+            return self.gen_batch(pkt_idxs)
+        pkt_idxs = np.asarray(pkt_idxs, dtype=np.int64)
+        job_sizes = self.job_sizes
+        batches = []
+        try:
+            for d, sel in [('u', uplink), ('d', ~uplink)]:
+                self.dir = d
+                self.batch_sel = np.flatnonzero(sel)
+                self.job_flows = {}
+                if job_sizes is not None:
+                    self.job_sizes = job_sizes[self.batch_sel]
+                if len(self.batch_sel) == 0:
+                    batch = (np.zeros(0, dtype=np.uint8),
+                             np.zeros(0, dtype=np.int64))
+                else:
+                    batch = self.gen_batch(pkt_idxs[self.batch_sel])
+                if batch is None:
+                    return None
+                batches.append(batch)
+        finally:
+            self.batch_sel = None
+            self.job_flows = {}
+            self.job_sizes = job_sizes
+        (ul_data, ul_lens), (dl_data, dl_lens) = batches
+        # The k-th uplink/downlink packet is the k-th frame of its batch
+        idxs = np.empty(len(pkt_idxs), dtype=np.int64)
+        idxs[uplink] = np.arange(len(ul_lens))
+        idxs[~uplink] = len(ul_lens) + np.arange(len(dl_lens))
+        return take_frames(np.concatenate([ul_data, dl_data]),
+                           np.concatenate([ul_lens, dl_lens]), idxs)
+
+    def get_batch_pos(self):
+        """Return the trace positions of the packets of the current
+        gen_batch call as an array: those of the job, or in bidir mode,
+        those of the job in the current direction"""
+        pos = np.arange(self.job_pos, self.job_pos + self.job_num)
+        if self.batch_sel is not None:
+            pos = pos[self.batch_sel]
+        return pos
+
+    def get_timestamps(self, pos, num, carry=None):
+        """Return the pcap timestamps [us] of `num` packets starting at
+        position `pos` of the trace.  Without an arrival process, the
+        packets are 1us apart.  `carry` is the 'arrival' of the job (see
+        work_items)."""
+        if self.replay is not None:
+            return self.replay.job(pos, num)['ts']
+        if self.arrival is not None:
+            return self.arrival.timestamps(pos, num, carry)
+        if np is not None:
+            return np.arange(pos, pos + num, dtype=np.int64)
+        return list(range(pos, pos + num))
+
+    def get_pkt_sizes(self, pos, num):
+        """Return the sizes of `num` packets starting at position `pos`
+        of the trace, or None if every packet has the size pkt_size"""
+        if self.replay is not None:
+            return self.replay.job(pos, num)['size']
+        if self.size_dist is None:
+            return None
+        seed = derive_seed(self.args.random_seed, 'pkt-size')
+        return self.size_dist.sizes(hash_uniform(seed,
+                                                 np.arange(pos, pos + num)))
+
+    def max_pkt_size(self):
+        if self.replay is not None:
+            return self.replay.max_size
+        if self.size_dist is None:
+            return self.args.pkt_size
+        return self.size_dist.max_size()
+
+    def split_by_pkt_size(self, pos):
+        """Yield the subsets of the job positions `pos` (an index array)
+        having the same packet size.  self.pkt_size is set to the size
+        of the subset, so get_template returns templates of that size."""
+        if self.job_sizes is None:
+            yield pos
+            return
+        sizes = self.job_sizes[pos]
+        for size in np.unique(sizes):
+            self.pkt_size = int(size)
+            yield pos[sizes == size]
+
+    def gen_batch(self, pkt_idxs):
+        """Generate the packets of a job at once with NumPy.  Return the
+        frames as a flat uint8 array and their lengths (see
+        merge_batches), or None if the pipeline supports only gen_pkt."""
+        return None
+
+    def get_template(self, key, proto_fn, fields):
+        """Return the PktTemplate `key`.
+
+        On the first call for a `key` and packet size, the scapy packet
+        returned by `proto_fn` is padded to self.pkt_size and compiled
+        into a template with the writable `fields`.  With pkt_size_inner,
+        the size is that of the innermost frame and the encapsulation
+        headers come on top of it."""
+        tmpl = self.templates.get((key, self.pkt_size))
+        if tmpl is None:
+            pkt = proto_fn()
+            size = self.pkt_size
+            if self.args.pkt_size_inner:
+                size += self.get_encap_overhead(pkt)
+            pkt = self.add_payload(pkt, size)
+            tmpl = PktTemplate.from_scapy(pkt, fields)
+            self.templates[(key, self.pkt_size)] = tmpl
+            if self.args.signature and not tmpl.has_sig_room:
+                if isinstance(key, tuple):
+                    key = '/'.join(str(k) for k in key)
+                self.unsigned.add('%s (%d bytes)' % (key, len(tmpl)))
+        return tmpl
+
+    @staticmethod
+    def get_encap_overhead(pkt):
+        """Return the length of the headers before the Ethernet header
+        (real or, e.g., for GTP, assumed) of the innermost IP packet"""
+        ip = [offset for name, offset, _ in get_layers(pkt) if name == 'IP']
+        if not ip:
+            return 0
+        return max(0, ip[-1] - 14)
+
+    def build_pkt(self, key, proto_fn, fields, values):
+        "Return the bytes of a packet built from the template `key`"
+        return self.get_template(key, proto_fn, fields).build(
+            *values, sig=self.get_signature())
+
+    def get_signature(self):
+        """Return the signature of the current packet to be passed to
+        PktTemplate.build, or None if signatures are disabled.  The
+        sequence number of the packets of run-time entities is flagged
+        with SIG_CHURN."""
+        if not self.args.signature:
+            return None
+        churn = self.get_churn()
+        if churn is not None and churn[self.pkt_pos - self.job_pos] >= 0:
+            return (self.trace_id, self.pkt_pos | SIG_CHURN)
+        return (self.trace_id, self.pkt_pos)
+
+    def get_signatures(self, pos):
+        """Return the signatures of the packets at the job positions
+        `pos` for PktTemplate.build_batch"""
+        if not self.args.signature:
+            return None
+        churn = self.get_churn()
+        if churn is None:
+            return (self.trace_id, self.get_batch_pos()[pos])
+        seq = self.get_batch_pos()[pos].astype(np.uint64)
+        seq[churn[pos] >= 0] |= np.uint64(SIG_CHURN)
+        return (self.trace_id, seq)
+
+    def has_locality(self):
+        "Is a locality model configured instead of the pipeline's default?"
+        args = self.args
+        return (getattr(args, 'popularity', 'default') != 'default' or
+                getattr(args, 'working_set_size', 0) > 0 or
+                getattr(args, 'burst_size', 1) > 1 or
+                getattr(args, 'coverage', 0) > 0)
+
+    def get_flows(self, table_name, num):
+        """Return the indexes of the entries of a conf table the first
+        `num` packets of the current job belong to according to the
+        locality model, or None if there is no model.  In bidir mode,
+        these are the packets of the current direction (see
+        get_batch_pos).  Pipelines choose their entries uniformly or
+        round-robin in that case."""
+        if self.replay is not None:
+            return self.get_replay_flows(table_name, num)
+        if not self.has_locality():
+            return None
+        flows = self.job_flows.get(table_name)
+        if flows is None or len(flows) < num:
+            sel = self.selectors.get(table_name)
+            if sel is None:
+                args = self.args
+                sel = FlowSelector(
+                    len(getattr(self.conf, table_name)),
+                    derive_seed(args.random_seed, 'flows', table_name),
+                    args.popularity, args.popularity_exponent,
+                    args.working_set_size, args.working_set_lifetime,
+                    args.burst_size, args.coverage, self.pkt_num)
+                self.selectors[table_name] = sel
+            flows = sel.select(self.get_batch_pos()[:num])
+            self.job_flows[table_name] = flows
+        return flows[:num]
+
+    def get_replay(self, field, num):
+        """Return `field` (see TraceReplay.job) of the first `num` packets
+        of the current job when replaying a capture, otherwise None"""
+        if self.replay is None:
+            return None
+        values = self.replay.job(self.job_pos, self.job_num)[field]
+        if self.batch_sel is not None:
+            values = values[self.batch_sel]
+        return values[:num]
+
+    def get_replay_flows(self, table_name, num):
+        """Return the indexes of the entries of a conf table the first
+        `num` packets of the current job are mapped to when replaying a
+        capture, otherwise None.  The flows of the capture are mapped
+        round-robin onto the flow_table, so that distinct flows remain
+        distinct up to the size of the table.  Entries of other tables
+        (e.g., servers) are a random function of the flow."""
+        flows = self.get_replay('flow', num)
+        if flows is None:
+            return None
+        size = len(getattr(self.conf, table_name))
+        if table_name == self.flow_table:
+            return flows % size
+        seed = derive_seed(self.args.random_seed, 'replay', table_name)
+        idxs = (hash_uniform(seed, flows) * size).astype(np.int64)
+        return np.minimum(idxs, size - 1)
+
+    def get_bidir_flows(self, table_name, num, size=None):
+        """In bidir mode, return the indexes of the entries of a conf
+        table the first `num` packets of the current batch belong to,
+        otherwise None.  The flow of a packet (an entry of the
+        flow_table) is chosen by the locality model or uniformly as a
+        function of its position, the other entries (e.g., the server)
+        are a random function of the flow.  So the downlink packets of
+        a flow are the replies to its uplink packets.  `size` is the
+        number of choices if they are not the entries of a table."""
+        if self.args.dir != 'bidir':
+            return None
+        flows = self.get_flows(self.flow_table, num)
+        if flows is None:
+            flow_num = self.get_flow_num()
+            seed = derive_seed(self.args.random_seed, 'bidir')
+            u = hash_uniform(seed, self.get_batch_pos()[:num])
+            flows = np.minimum((u * flow_num).astype(np.int64), flow_num - 1)
+        if table_name == self.flow_table:
+            return flows
+        if size is None:
+            size = len(getattr(self.conf, table_name))
+        seed = derive_seed(self.args.random_seed, 'bidir', table_name)
+        idxs = (hash_uniform(seed, flows) * size).astype(np.int64)
+        return np.minimum(idxs, size - 1)
+
+    def iter_run_time(self):
+        """Yield the 'run_time' commands of the pipeline config, the
+        ranges expanded"""
+        # The commands are built like the objects of the conf (ObjectView)
+        return iter_run_time(self.conf, type(self.conf))
+
+    def iter_run_time_entries(self):
+        """Yield the (conf table, entry) of the entries the 'run_time'
+        commands of the pipeline config add.  By default, these are the
+        users and servers of the fluct-user and fluct-server options."""
+        tables = {'add_user': 'users', 'add_server': 'srvs'}
+        for cmd in self.iter_run_time():
+            if cmd.action in tables:
+                yield tables[cmd.action], cmd.args
+
+    def get_run_time_entries(self, table_name):
+        "Return the entries added to a conf table at run time as a list"
+        key = ('run_time', table_name)
+        entries = self.indexes.get(key)
+        if entries is None:
+            entries = [e for t, e in self.iter_run_time_entries()
+                       if t == table_name]
+            self.indexes[key] = entries
+        return entries
+
+    def get_churn(self):
+        """Return, for each packet of the current batch (see
+        get_batch_pos), the index of the run-time entity the packet is
+        sent to or -1 for the packets of the static entries.  The
+        run-time entries of the churn_tables of the current direction
+        are numbered one after the other.  Return None if there is no
+        churn traffic in this direction.  A packet is sent to a run-time
+        entity with probability 'churn', as a function of its
+        position."""
+        key = ('churn', self.dir)
+        if key in self.job_flows:
+            return self.job_flows[key]
+        churn = None
+        total = sum(len(self.get_run_time_entries(t))
+                    for t in self.churn_tables)
+        if self.args.churn and total:
+            pos = self.get_batch_pos()
+            seed = derive_seed(self.args.random_seed, 'churn')
+            sel = hash_uniform(seed, pos) < self.args.churn
+            seed = derive_seed(self.args.random_seed, 'churn', 'entity')
+            entity = (hash_uniform(seed, pos) * total).astype(np.int64)
+            churn = np.where(sel, np.minimum(entity, total - 1), -1)
+        self.job_flows[key] = churn
+        return churn
+
+    def get_churn_range(self, table_name):
+        """Return the numbers of the first and after the last run-time
+        entity of a conf table (see get_churn), or None if the packets
+        are not sent to its run-time entries"""
+        if table_name not in self.churn_tables:
+            return None
+        start = 0
+        for t in self.churn_tables:
+            if t == table_name:
+                break
+            start += len(self.get_run_time_entries(t))
+        return start, start + len(self.get_run_time_entries(table_name))
+
+    def add_churn(self, table_name, idxs):
+        """Return `idxs`, the indexes of the entries of a conf table the
+        first packets of the current job are sent to, with the packets
+        of the run-time entries of the table redirected.  Run-time
+        entries are indexed after the entries of the table, see
+        get_column."""
+        churn = self.get_churn()
+        if churn is None or table_name not in self.churn_tables:
+            return idxs
+        start, stop = self.get_churn_range(table_name)
+        entity = churn[:len(idxs)]
+        sel = (entity >= start) & (entity < stop)
+        if not sel.any():
+            return idxs
+        idxs = np.array(idxs, dtype=np.int64)
+        idxs[sel] = (len(getattr(self.conf, table_name)) +
+                     entity[sel] - start)
+        return idxs
+
+    def churn_entry(self, table_name, entry):
+        """Return the run-time entry of a conf table the current packet
+        is sent to instead of `entry`, or `entry` (see add_churn)"""
+        churn = self.get_churn()
+        if churn is None or table_name not in self.churn_tables:
+            return entry
+        start, stop = self.get_churn_range(table_name)
+        entity = churn[self.pkt_pos - self.job_pos]
+        if start <= entity < stop:
+            return self.get_run_time_entries(table_name)[entity - start]
+        return entry
+
+    def pick_entry(self, table_name):
+        """Return the entry of a conf table the current packet belongs to
+        according to the locality model, or None if there is no model"""
+        if not self.has_locality():
+            return None
+        # Select the flows of the whole job at once
+        flows = self.get_flows(table_name, self.job_num)
+        return getattr(self.conf, table_name)[flows[self.pkt_pos -
+                                                    self.job_pos]]
+
+    def get_index(self, table_name, attr):
+        """Return a dict mapping the values of `attr` to the entries of a
+        conf table with that value (as a list in table order).  Indexes
+        are built on first use, so once per worker.  Use them instead of
+        scanning a table for every packet."""
+        key = (table_name, attr)
+        index = self.indexes.get(key)
+        if index is None:
+            index = {}
+            for entry in getattr(self.conf, table_name):
+                index.setdefault(getattr(entry, attr), []).append(entry)
+            self.indexes[key] = index
+        return index
+
+    def get_column(self, table_name, attr):
+        """Return the `attr` of every entry of a conf table as a NumPy
+        array.  MAC and IP addresses are converted to integers.  With
+        churn traffic, the entries added at run time follow the entries
+        of the table."""
+        key = (table_name, attr)
+        col = self.columns.get(key)
+        if col is None:
+            entries = getattr(self.conf, table_name)
+            if isinstance(entries, TableView):
+                # Columnar sidecar: no need to build the entries
+                col = entries.column(attr).astype(np.uint64)
+                entries = []
+            else:
+                col = np.zeros(0, dtype=np.uint64)
+            if self.args.churn:
+                entries = entries + self.get_run_time_entries(table_name)
+            col = np.concatenate([col, entries_to_column(entries, attr)])
+            self.columns[key] = col
+        return col
+
     def get_pkt_num(self):
-        "Return the number of packets to be generated"
+        """Return the number of packets to be generated.  With the
+        coverage option, the trace is long enough to hit every flow
+        `coverage` times.  A replayed capture is cut at pkt_num."""
+        if self.replay is not None:
+            self.args.auto_pkt_num = False
+            if self.args.pkt_num:
+                return min(self.args.pkt_num, len(self.replay))
+            return len(self.replay)
+        covered = self.args.coverage * self.get_flow_num()
         if self.args.pkt_num:
             self.args.auto_pkt_num = False
-            return self.args.pkt_num
+            return max(self.args.pkt_num, covered)
         self.args.auto_pkt_num = True
-        return self.get_auto_pkt_num()
+        return covered or self.get_auto_pkt_num()
+
+    def get_flow_num(self):
+        "Return the number of flows, i.e., the size of the flow_table"
+        if self.flow_table is None:
+            return 0
+        return len(getattr(self.conf, self.flow_table))
 
     def get_auto_pkt_num(self):
         raise NotImplementedError
@@ -103,6 +852,6 @@ class GenPkt(object):
         return p
 
     def get_other_direction(self):
-        return {'u': 'd', 'd': 'u'}[self.args.dir[0]]
+        return {'u': 'd', 'd': 'u'}[self.dir]
 
 
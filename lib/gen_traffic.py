@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Generate the traffic traces of many measurements in one process.
+
+The traces share a single pool of workers.  The jobs of the traces
+form one stream: the jobs of the next trace are dispatched as soon as
+slots of the ring are freed, so the workers do not wait for a trace to
+be written before starting the next one.  The workers create the
+generator of a trace when they get its first job, the pipeline
+configs are parsed once per worker.  The traces are identical to the
+ones gen_pcap.py generates.
+
+The input is a JSON list of the traces (see 'tipsy gen-traffic'):
+  [{"json": "traffic.json", "conf": "pipeline.json",
+    "output": "traffic.pcap"}, ...]
+
+Usage:
+  gen_traffic.py traces.json --thread 8
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+try:
+    from gen_pcap import ObjectView, get_dl_output, get_gen_class
+    from gen_pcap import output_pkts, parse_args, warn_unsigned
+    from conf_tables import loads_conf
+    from pcap_io import ShmRing, pcap_header, REC_HDR
+except ImportError:
+    from .gen_pcap import ObjectView, get_dl_output, get_gen_class
+    from .gen_pcap import output_pkts, parse_args, warn_unsigned
+    from .conf_tables import loads_conf
+    from .pcap_io import ShmRing, pcap_header, REC_HDR
+
+__all__ = ["gen_traffic"]
+
+JOB_SIZE = 1024
+# Generators kept by a worker, for the traces with jobs in flight
+WORKER_GENS = 4
+
+
+class Trace(object):
+    "A trace to be generated, with its own gen_pcap arguments"
+
+    def __init__(self, idx, spec, confs):
+        self.idx = idx
+        argv = ['--json', spec['json'], '--conf', spec['conf'],
+                '--output', spec['output']]
+        self.args = parse_args(argv=argv)
+        for f in (self.args.json, self.args.conf, self.args.output):
+            f.close()
+        self.output = spec['output']
+        if self.args.ascii:
+            raise ValueError('%s: ascii output is not supported'
+                             % spec['json'])
+        if not self.args.random_seed:
+            self.args.random_seed = int(time.time())
+        self.conf = get_conf(confs, spec['conf'])
+        self.gen = get_gen_class(self.conf.name)(self.args, self.conf,
+                                                 None, None)
+        self.gen.pkt_num = self.gen.get_pkt_num()
+        # Arguments of the workers: file names instead of open files
+        self.spec = {k: getattr(v, 'name', v)
+                     for k, v in vars(self.args).items()}
+        self.spec['json'] = None
+        self.files = []
+
+    def slot_size(self):
+        pkt_size = self.gen.max_pkt_size() + 128 * self.args.pkt_size_inner
+        return JOB_SIZE * (REC_HDR.size + max(pkt_size, 256))
+
+    def open(self):
+        args = self.args
+        args.pcap_file = open(self.output, 'wb')
+        self.files = [args.pcap_file]
+        if args.dir == 'bidir' and args.bidir_split:
+            args.pcap_file_dl = open(get_dl_output(self.output), 'wb')
+            self.files.append(args.pcap_file_dl)
+        for f in self.files:
+            f.write(pcap_header())
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        self.files = []
+        # The parent's generator is no longer needed
+        self.gen = None
+
+
+def get_conf(confs, fname):
+    """Load a pipeline config, configs of the same content (and of the
+    same sidecar, see conf_tables) are shared"""
+    with open(fname, 'rb') as f:
+        data = f.read()
+    base_dir = os.path.dirname(os.path.abspath(fname))
+    sha1 = hashlib.sha1(data)
+    if b'"$sidecar"' in data:
+        sha1.update(base_dir.encode('utf-8'))
+    key = sha1.hexdigest()
+    if key not in confs:
+        confs[key] = loads_conf(data.decode('utf-8'), base_dir,
+                                object_hook=ObjectView)
+    return confs[key]
+
+
+def get_worker_gen(gens, confs, item, ring):
+    "Return the generator of the trace of `item`, create it if needed"
+    trace = item['trace']
+    gen = gens.get(trace)
+    if gen is None:
+        if len(gens) >= WORKER_GENS:
+            del gens[min(gens)]
+        args = argparse.Namespace(**item['spec'])
+        conf = get_conf(confs, args.conf)
+        gen = get_gen_class(conf.name)(args, conf, None, None)
+        gen.ring = ring
+        gen.pkt_num = gen.get_pkt_num()
+        gens[trace] = gen
+    return gen
+
+
+def work(in_que, out_que, ring):
+    gens = {}
+    confs = {}
+    while True:
+        item = in_que.get()
+        if item is None:
+            break
+        try:
+            gen = get_worker_gen(gens, confs, item, ring)
+            del item['spec']
+            out_que.put(gen.do_job(item))
+        except Exception as e:
+            out_que.put({'exception': e, 'trace': item['trace'],
+                         'traceback': traceback.format_exc()})
+            return
+
+
+def iter_items(traces):
+    """Yield the jobs of the traces one after the other, the last job of
+    a trace is marked.  The files of a trace are opened when its first
+    job is dispatched."""
+    seq = 0
+    for trace in traces:
+        trace.open()
+        prev = None
+        for item in trace.gen.work_items(JOB_SIZE):
+            if prev is not None:
+                yield prev
+            item.update({'seq': seq, 'trace': trace.idx, 'last': False,
+                         'spec': trace.spec})
+            seq += 1
+            prev = item
+        if prev is None:
+            trace.close()
+        else:
+            prev['last'] = True
+            yield prev
+
+
+def gen_traffic(specs, thread=0):
+    "Generate the traces listed in `specs`"
+    worker_num = thread or multiprocessing.cpu_count()
+    confs = {}
+    traces = [Trace(i, spec, confs) for i, spec in enumerate(specs)]
+    if not traces:
+        return
+    slot_num = 4 * worker_num
+    ring = ShmRing(slot_num, max(t.slot_size() for t in traces))
+
+    in_que = multiprocessing.Queue()
+    out_que = multiprocessing.Queue()
+    processes = []
+    for i in range(worker_num):
+        p = multiprocessing.Process(target=work,
+                                    args=(in_que, out_que, ring))
+        p.start()
+        processes.append(p)
+
+    items = iter_items(traces)
+    num_jobs = 0
+    for slot, item in zip(range(slot_num), items):
+        item['slot'] = slot
+        in_que.put(item)
+        num_jobs += 1
+
+    # Reorder buffer, see gen_pcap
+    results = []
+    next_seq = 0
+    try:
+        while next_seq < num_jobs:
+            result = out_que.get()
+            if 'exception' in result:
+                sys.stderr.write('%s: exception: %s\n%s' % (
+                    traces[result['trace']].output, result['exception'],
+                    ''.join(result['traceback'])))
+                exit(1)
+            heapq.heappush(results, (result['seq'], result))
+            while results and results[0][0] == next_seq:
+                _, result = heapq.heappop(results)
+                trace = traces[result['trace']]
+                slot = result['slot']
+                warn_unsigned(trace.args, result)
+                if 'records' in result:
+                    output_pkts(trace.args, result, result['records'])
+                else:
+                    output_pkts(trace.args, result,
+                                ring.view(slot, result['size']))
+                if result['last']:
+                    trace.close()
+                next_seq += 1
+                # Reuse the slot for the next job
+                for item in items:
+                    item['slot'] = slot
+                    in_que.put(item)
+                    num_jobs += 1
+                    break
+    finally:
+        for i in range(worker_num):
+            in_que.put(None)
+        for p in processes:
+            p.join()
+        ring.close()
+
+
+def parse_cli_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('traces', type=argparse.FileType('r'),
+                        help='JSON list of the traces')
+    parser.add_argument('--thread', '-t', type=int, default=0,
+                        help='Number of workers (0: all of the cores)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli_args()
+    gen_traffic(json.load(args.traces), args.thread)
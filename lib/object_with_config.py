@@ -16,7 +16,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import json
+
+try:
+  from conf_tables import load_conf
+except ImportError:
+  from .conf_tables import load_conf
 
 class ObjectView(object):
   def __init__(self, **kwargs):
@@ -42,7 +46,7 @@ class ObjectWithConfig(object):
     try:
       with open(fname, 'r') as f:
         conv_fn = lambda d: ObjectView(**d)
-        config = json.load(f, object_hook=conv_fn)
+        config = load_conf(f, object_hook=conv_fn)
     except IOError as e:
       self.logger.error('Failed to load cfg file (%s): %s' %
                         (fname, e))
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Summary of a captured pcap or pcapng file: throughput over time,
+per-flow counters, header field histograms and encapsulation breakdown.
+
+The file is mmapped and the records are processed in chunks of NumPy
+arrays: the record and protocol headers are gathered from the mapping
+and viewed through structured dtypes, nothing is parsed per packet.
+Runs of equal sized records (the usual case for benchmark traffic) are
+located without a Python loop and read as strided views.
+
+Flows are identified by the innermost 5-tuple, i.e., the user traffic
+in VXLAN and GTP-U tunnels.
+
+Usage:
+  pcap_analyzer.py capture.pcap --results results.json
+"""
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+try:
+    from pcap_io import PCAP_MAGIC, PCAP_MAGIC_NS
+except ImportError:
+    from .pcap_io import PCAP_MAGIC, PCAP_MAGIC_NS
+
+__all__ = ["Capture", "analyze"]
+
+# Nested tunnels peeled to find the innermost 5-tuple
+MAX_DEPTH = 3
+CHUNK = 1 << 16
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_EPB = 6
+PCAPNG_BOM = 0x1A2B3C4D
+
+ETH = np.dtype([('dst', 'V6'), ('src', 'V6'), ('type', '>u2')])
+VLAN = np.dtype([('tci', '>u2'), ('type', '>u2')])
+IPV4 = np.dtype([('ver_ihl', 'u1'), ('tos', 'u1'), ('len', '>u2'),
+                 ('id', '>u2'), ('frag', '>u2'), ('ttl', 'u1'),
+                 ('proto', 'u1'), ('csum', '>u2'),
+                 ('src', '>u4'), ('dst', '>u4')])
+L4 = np.dtype([('sport', '>u2'), ('dport', '>u2')])
+VXLAN = np.dtype([('flags', 'u1'), ('res', '>u2'), ('next', 'u1'),
+                  ('vni', '>u4')])
+GTP = np.dtype([('flags', 'u1'), ('type', 'u1'), ('len', '>u2'),
+                ('teid', '>u4')])
+
+VXLAN_PORT = 4789
+GTPU_PORT = 2152
+ENCAPS = ['none', 'vxlan', 'gtpu']
+
+
+def rec_dtypes(endian):
+    pcap = np.dtype([('sec', endian + 'u4'), ('frac', endian + 'u4'),
+                     ('caplen', endian + 'u4'), ('len', endian + 'u4')])
+    epb = np.dtype([('type', endian + 'u4'), ('blen', endian + 'u4'),
+                    ('iface', endian + 'u4'), ('ts_high', endian + 'u4'),
+                    ('ts_low', endian + 'u4'), ('caplen', endian + 'u4'),
+                    ('len', endian + 'u4')])
+    return pcap, epb
+
+
+def gather(u8, offsets, dtype):
+    """View the bytes at `offsets` of the uint8 array `u8` as `dtype`.
+    Equally spaced offsets are read through a strided view."""
+    offsets = np.minimum(offsets, len(u8) - dtype.itemsize)
+    num = len(offsets)
+    if num > 1:
+        stride = int(offsets[1] - offsets[0])
+        if stride > 0 and (np.diff(offsets) == stride).all():
+            view = np.lib.stride_tricks.as_strided(
+                u8[int(offsets[0]):], shape=(num, dtype.itemsize),
+                strides=(stride, 1), writeable=False)
+            return view.copy().view(dtype)[:, 0]
+    idx = offsets[:, None] + np.arange(dtype.itemsize)
+    return u8[idx].view(dtype)[:, 0]
+
+
+def ip2str(ip):
+    return '.'.join(str((int(ip) >> s) & 0xff) for s in (24, 16, 8, 0))
+
+
+class Capture(object):
+    """Records of a memory-mapped pcap or pcapng file"""
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            self.mem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.u8 = np.frombuffer(self.mem, dtype=np.uint8)
+        self.ts_units = {}
+        magic = self.mem[:4]
+        if len(self.mem) >= 12 and struct.unpack('<I', magic)[0] == PCAPNG_SHB:
+            self.format = 'pcapng'
+            for endian in '<>':
+                if struct.unpack_from(endian + 'I', self.mem, 8)[0] == PCAPNG_BOM:
+                    break
+            else:
+                raise ValueError('%s: invalid pcapng section' % fname)
+            self.endian = endian
+            self.start = 0
+            self.rec_hdr_len = 28
+        else:
+            self.format = 'pcap'
+            for endian in '<>':
+                magic = struct.unpack_from(endian + 'I', self.mem, 0)[0]
+                if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+                    break
+            else:
+                raise ValueError('%s: not a pcap or pcapng file' % fname)
+            self.endian = endian
+            self.ts_unit = 1 if magic == PCAP_MAGIC_NS else 1000
+            self.start = 24
+            self.rec_hdr_len = 16
+        self.rec, self.epb = rec_dtypes(self.endian)
+
+    def close(self):
+        del self.u8
+        self.mem.close()
+
+    def scan(self, chunk=CHUNK, start=None):
+        """Yield the offsets of the records from the record at offset
+        `start` in arrays of about `chunk`.  A Python loop walks the
+        records while their size changes, and runs of equal sized records
+        are checked in one NumPy step."""
+        if self.format == 'pcap':
+            hdr = struct.Struct(self.endian + '8xI')
+            hdr_size, key_dtype, keys = 16, self.rec, ('caplen',)
+        else:
+            hdr = struct.Struct(self.endian + 'II')
+            hdr_size, key_dtype, keys = 8, self.epb, ('type', 'blen')
+        mem, size = self.mem, len(self.mem)
+        if start is None:
+            start = self.start
+            self.ts_units = {}
+        pos = start
+        out, out_len = [], 0
+        single, prev, streak = [], None, 0
+        while pos + hdr_size <= size:
+            key = hdr.unpack_from(mem, pos)
+            if self.format == 'pcap':
+                stride = hdr_size + key[0]
+            else:
+                stride = key[1]
+                if stride < 12 or stride % 4:
+                    raise ValueError('%s: invalid block at %d' %
+                                     (self.fname, pos))
+                if key[0] == PCAPNG_IDB:
+                    self.add_interface(pos, stride)
+            if pos + stride > size:
+                break  # truncated capture
+            streak = streak + 1 if key == prev else 0
+            prev = key
+            if streak < 8 or (self.format == 'pcapng' and
+                              key[0] != PCAPNG_EPB):
+                single.append(pos)
+                pos += stride
+                if out_len + len(single) >= chunk:
+                    out.append(np.array(single, dtype=np.int64))
+                    yield np.concatenate(out)
+                    out, out_len, single = [], 0, []
+                continue
+            # Extend the run of equal records as far as possible
+            out.append(np.array(single, dtype=np.int64))
+            out_len += len(single)
+            single = []
+            num = min(chunk, (size - pos) // stride)
+            run = np.ndarray(num, dtype=key_dtype, buffer=mem,
+                             offset=pos, strides=(stride,))
+            ok = np.ones(num, dtype=bool)
+            for k, v in zip(keys, key):
+                ok &= run[k] == v
+            num = num if ok.all() else int(np.argmin(ok))
+            out.append(pos + stride * np.arange(num, dtype=np.int64))
+            out_len += num
+            pos += stride * num
+            prev, streak = None, 0
+            if out_len >= chunk:
+                yield np.concatenate(out)
+                out, out_len = [], 0
+        out.append(np.array(single, dtype=np.int64))
+        yield np.concatenate(out)
+
+    def add_interface(self, pos, blen):
+        "Parse the timestamp resolution of a pcapng interface"
+        unit = 1000  # default: microseconds
+        opt = pos + 16
+        end = pos + blen - 4
+        while opt + 4 <= end:
+            code, length = struct.unpack_from(self.endian + 'HH',
+                                              self.mem, opt)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                resol = struct.unpack_from('B', self.mem, opt + 4)[0]
+                if resol & 0x80:
+                    unit = 1e9 / 2 ** (resol & 0x7f)
+                else:
+                    unit = 10 ** (9 - resol) if resol <= 9 else 1e9 / 10 ** resol
+            opt += 4 + (length + 3) // 4 * 4
+        self.ts_units[len(self.ts_units)] = unit
+
+    def batches(self, chunk=CHUNK, start=None, count=None):
+        """Yield (timestamp [ns], captured length, wire length, frame
+        offset) arrays of the packets, from the record at offset `start`
+        and at most `count` packets if given"""
+        for offsets in self.scan(chunk, start):
+            if self.format == 'pcapng' and len(offsets):
+                btype = gather(self.u8, offsets, np.dtype(self.endian + 'u4'))
+                offsets = offsets[btype == PCAPNG_EPB]
+            if count is not None:
+                offsets = offsets[:count]
+                count -= len(offsets)
+            if len(offsets):
+                yield self.read_records(offsets)
+            if count == 0:
+                break
+
+    def read_records(self, offsets):
+        "Return the batch of the (packet) records at `offsets`"
+        if self.format == 'pcap':
+            rec = gather(self.u8, offsets, self.rec)
+            ts = (rec['sec'].astype(np.int64) * 1000000000 +
+                  rec['frac'].astype(np.int64) * self.ts_unit)
+            return ts, rec['caplen'], rec['len'], offsets + self.rec_hdr_len
+        rec = gather(self.u8, offsets, self.epb)
+        raw = ((rec['ts_high'].astype(np.int64) << 32) |
+               rec['ts_low'].astype(np.int64))
+        ts = np.empty(len(raw), dtype=np.int64)
+        for iface in np.unique(rec['iface']):
+            sel = rec['iface'] == iface
+            unit = self.ts_units.get(int(iface), 1000)
+            ts[sel] = (raw[sel] * unit).astype(np.int64)
+        return ts, rec['caplen'], rec['len'], offsets + self.rec_hdr_len
+
+
+def dissect(u8, frames, caplen):
+    """Return the encapsulation, the outer and innermost headers of the
+    frames at `frames` as a dict of arrays.  Nested tunnels are peeled
+    up to MAX_DEPTH levels.  'flow' and 'outer_flow' are the innermost
+    and the outermost 5-tuples (see pack_flows)."""
+    num = len(frames)
+    caplen = caplen.astype(np.int64)
+
+    def field(rel, dtype):
+        return gather(u8, frames + rel, dtype)
+
+    d = {'encap': np.zeros(num, dtype=np.int8)}
+    etype = field(0, ETH)['type']
+    vlan = (etype == 0x8100) & (caplen >= 18)
+    l3 = np.full(num, 14, dtype=np.int64)
+    if vlan.any():
+        etype = np.where(vlan, field(14, VLAN)['type'], etype)
+        l3[vlan] = 18
+    d['vlan'] = vlan
+    d['ethertype'] = etype
+
+    # Innermost IP header and 5-tuple
+    inner_l3 = l3.copy()
+    src = np.zeros(num, dtype=np.uint64)
+    dst = np.zeros(num, dtype=np.uint64)
+    proto = np.zeros(num, dtype=np.uint64)
+    sport = np.zeros(num, dtype=np.uint64)
+    dport = np.zeros(num, dtype=np.uint64)
+    valid = etype == 0x0800
+    for depth in range(MAX_DEPTH):
+        ip = field(l3, IPV4)
+        valid &= (ip['ver_ihl'] >> 4 == 4) & (caplen >= l3 + 20)
+        l4 = l3 + (ip['ver_ihl'] & 0xf).astype(np.int64) * 4
+        has_ports = (valid & ((ip['proto'] == 6) | (ip['proto'] == 17)) &
+                     (caplen >= l4 + 4))
+        ports = field(l4, L4)
+        inner_l3[valid] = l3[valid]
+        src[valid] = ip['src'][valid]
+        dst[valid] = ip['dst'][valid]
+        proto[valid] = ip['proto'][valid]
+        sport[valid] = np.where(has_ports, ports['sport'], 0)[valid]
+        dport[valid] = np.where(has_ports, ports['dport'], 0)[valid]
+
+        udp = has_ports & (ip['proto'] == 17) & (caplen >= l4 + 16)
+        vx = field(l4 + 8, VXLAN)
+        gtp = field(l4 + 8, GTP)
+        vxlan = udp & (ports['dport'] == VXLAN_PORT)
+        gtpu = udp & (ports['dport'] == GTPU_PORT) & (gtp['type'] == 0xff)
+        if depth == 0:
+            d['ip'] = valid.copy()
+            d['ttl'] = ip['ttl']
+            d['dscp'] = ip['tos'] >> 2
+            d['proto'] = ip['proto']
+            d['outer_sport'] = np.where(has_ports, ports['sport'], 0)
+            d['outer_flow'] = pack_flows(src, dst, proto, sport, dport)
+            d['vni'] = vx['vni'] >> 8
+            d['teid'] = gtp['teid']
+            d['vxlan'] = vxlan
+            d['gtpu'] = gtpu
+            d['encap'][vxlan] = ENCAPS.index('vxlan')
+            d['encap'][gtpu] = ENCAPS.index('gtpu')
+        if not (vxlan | gtpu).any():
+            break
+        # VXLAN-GPE may carry IPv4 without an Ethernet header
+        gpe_ip = ((vx['flags'] & 0x04) > 0) & (vx['next'] == 1)
+        l3 = np.where(vxlan, l4 + 16 + np.where(gpe_ip, 0, 14),
+                      l4 + 16 + np.where(gtp['flags'] & 0x07, 4, 0))
+        valid = vxlan | gtpu
+    d['inner_l3'] = inner_l3
+    d['flow'] = pack_flows(src, dst, proto, sport, dport)
+    return d
+
+
+def pack_flows(src, dst, proto, sport, dport):
+    "Pack 5-tuples into two 64-bit words: src|dst and proto|sport|dport"
+    return np.stack([(src << np.uint64(32)) | dst,
+                     (proto << np.uint64(32)) |
+                     (sport << np.uint64(16)) | dport], axis=1)
+
+
+def unique_rows(keys):
+    "np.unique(keys, axis=0, return_inverse=True) of a uint64 matrix"
+    if keys.shape[1] == 1:
+        uniq, inv = np.unique(keys[:, 0], return_inverse=True)
+        return uniq[:, None], inv
+    order = np.lexsort(keys.T[::-1])
+    keys = keys[order]
+    new = np.ones(len(keys), dtype=bool)
+    new[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    inv = np.empty(len(keys), dtype=np.int64)
+    inv[order] = np.cumsum(new) - 1
+    return keys[new], inv
+
+
+class Hist(object):
+    "Packet counts of small integer values"
+
+    def __init__(self, size):
+        self.counts = np.zeros(size, dtype=np.int64)
+
+    def add(self, values):
+        self.counts += np.bincount(values, minlength=len(self.counts))
+
+    def nonzero(self):
+        return np.flatnonzero(self.counts)
+
+    def as_dict(self, fmt=str):
+        return {fmt(v): int(self.counts[v]) for v in self.nonzero()}
+
+
+class Counts(object):
+    """Packet (and byte) counts of arbitrary keys, i.e., rows of uint64
+    matrices, accumulated over chunks"""
+
+    def __init__(self, width=1, weights=0):
+        self.width = width
+        self.weights = weights
+        self.parts = []
+
+    def add(self, keys, *weights):
+        if not len(keys):
+            return
+        keys = np.asarray(keys, dtype=np.uint64).reshape(len(keys), -1)
+        uniq, inv = unique_rows(keys)
+        sums = [np.bincount(inv, minlength=len(uniq))]
+        sums += [np.bincount(inv, weights=w, minlength=len(uniq))
+                 for w in weights]
+        self.parts.append((uniq, sums))
+        if len(self.parts) > 16:
+            self.parts = [self.result()]
+
+    def result(self):
+        """Return (keys, [packets, weights...]) sorted by key"""
+        if not self.parts:
+            return (np.zeros((0, self.width), dtype=np.uint64),
+                    [np.zeros(0, dtype=np.int64)] * (1 + self.weights))
+        if len(self.parts) == 1:
+            return self.parts[0]
+        uniq, inv = unique_rows(np.concatenate([k for k, _ in self.parts]))
+        sums = []
+        for i in range(1 + self.weights):
+            w = np.concatenate([s[i] for _, s in self.parts])
+            sums.append(np.bincount(inv, weights=w, minlength=len(uniq)))
+        return uniq, sums
+
+    def top(self, num):
+        """Return the keys and counts of the `num` most frequent keys, and
+        the number of keys"""
+        keys, sums = self.result()
+        order = np.argsort(-sums[0], kind='stable')[:num]
+        return keys[order], [s[order] for s in sums], len(keys)
+
+
+def analyze(fname, interval=0.1, top=20, chunk=CHUNK):
+    """Return the summary of the capture `fname`.  The throughput is
+    computed in `interval` seconds long bins."""
+    cap = Capture(fname)
+    bin_ns = max(1, int(interval * 1e9))
+    t0 = t_last = None
+    bin_pkts = np.zeros(0, dtype=np.int64)
+    bin_bytes = np.zeros(0, dtype=np.int64)
+    total = {'packets': 0, 'bytes': 0, 'captured_bytes': 0}
+    hist = {'ethertype': Hist(1 << 16), 'ip_proto': Hist(256),
+            'ttl': Hist(256), 'dscp': Hist(64), 'frame_len': Hist(1 << 16)}
+    encap, nat_ports = Hist(len(ENCAPS)), Hist(1 << 16)
+    vni, teid = Counts(), Counts()
+    flows = Counts(width=2, weights=1)
+    vlan_pkts = 0
+
+    for ts, caplen, wirelen, frames in cap.batches(chunk):
+        wirelen = wirelen.astype(np.int64)
+        total['packets'] += len(ts)
+        total['bytes'] += int(wirelen.sum())
+        total['captured_bytes'] += int(caplen.sum(dtype=np.int64))
+        if t0 is None:
+            t0 = int(ts[0])
+        t_last = int(ts[-1])
+        bins = np.maximum(ts - t0, 0) // bin_ns
+        nbins = int(bins.max()) + 1
+        if nbins > len(bin_pkts):
+            grow = np.zeros(nbins - len(bin_pkts), dtype=np.int64)
+            bin_pkts = np.concatenate([bin_pkts, grow])
+            bin_bytes = np.concatenate([bin_bytes, grow])
+        bin_pkts[:nbins] += np.bincount(bins, minlength=nbins)
+        bin_bytes[:nbins] += np.bincount(
+            bins, weights=wirelen, minlength=nbins).astype(np.int64)
+
+        d = dissect(cap.u8, frames, caplen)
+        ip = d['ip']
+        hist['ethertype'].add(d['ethertype'])
+        hist['ip_proto'].add(d['proto'][ip])
+        hist['ttl'].add(d['ttl'][ip])
+        hist['dscp'].add(d['dscp'][ip])
+        hist['frame_len'].add(np.minimum(wirelen, (1 << 16) - 1))
+        encap.add(d['encap'])
+        vlan_pkts += int(d['vlan'].sum())
+        vni.add(d['vni'][d['vxlan']])
+        teid.add(d['teid'][d['gtpu']])
+        plain = ip & ~(d['vxlan'] | d['gtpu']) & (d['outer_sport'] > 0)
+        nat_ports.add(d['outer_sport'][plain])
+        flows.add(d['flow'], wirelen)
+    cap.close()
+
+    duration = (t_last - t0) / 1e9 if total['packets'] > 1 else 0.0
+    summary = dict(total)
+    summary.update({
+        'file': fname,
+        'format': cap.format,
+        'duration': duration,
+        'pps': total['packets'] / duration if duration else 0.0,
+        'bps': total['bytes'] * 8 / duration if duration else 0.0,
+        'throughput': {
+            'interval': interval,
+            'pps': (bin_pkts / interval).tolist(),
+            'bps': (bin_bytes * 8 / interval).tolist(),
+        },
+    })
+
+    keys, (pkts, byts), num = flows.top(top)
+    summary['flows'] = {
+        'count': num,
+        'top': [{'src': ip2str(k[0] >> np.uint64(32)), 'dst': ip2str(k[0]),
+                 'proto': int(k[1] >> np.uint64(32)),
+                 'sport': int(k[1] >> np.uint64(16)) & 0xffff,
+                 'dport': int(k[1]) & 0xffff,
+                 'packets': int(p), 'bytes': int(b)}
+                for k, p, b in zip(keys, pkts, byts)],
+    }
+
+    summary['histograms'] = {k: h.as_dict() for k, h in hist.items()}
+    summary['histograms']['ethertype'] = \
+        hist['ethertype'].as_dict(lambda x: '0x%04x' % x)
+
+    def id_summary(counts):
+        keys, (pkts,), num = counts.top(top)
+        return {'count': num,
+                'top': {str(int(k[0])): int(p) for k, p in zip(keys, pkts)}}
+
+    ports = nat_ports.nonzero()
+    summary['encap'] = {
+        'types': encap.as_dict(lambda x: ENCAPS[x]),
+        'vlan': vlan_pkts,
+        'vxlan_vni': id_summary(vni),
+        'gtpu_teid': id_summary(teid),
+        'nat_ports': {
+            'count': len(ports),
+            'min': int(ports.min()) if len(ports) else None,
+            'max': int(ports.max()) if len(ports) else None,
+        },
+    }
+    return summary
+
+
+def update_results(fname, summary, key='capture'):
+    "Add the summary to the 'out' section of a results.json"
+    try:
+        with open(fname) as f:
+            results = json.load(f)
+    except FileNotFoundError:
+        results = {}
+    results.setdefault('out', {})[key] = summary
+    with open(fname, 'w') as f:
+        json.dump(results, f, sort_keys=True, indent=4)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('pcap', help='Captured pcap or pcapng file')
+    parser.add_argument('--interval', '-i', type=float, default=0.1,
+                        help='Bin length of the throughput [s]')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of the most frequent flows and ids '
+                        'listed')
+    parser.add_argument('--results', '-r', type=str,
+                        help='Add the summary to the "out.capture" section '
+                        'of this results.json')
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        help='Output JSON file (default: stdout, unless '
+                        '--results is given)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    summary = analyze(args.pcap, args.interval, args.top)
+    if args.results:
+        update_results(args.results, summary)
+    if args.output or not args.results:
+        out = args.output or sys.stdout
+        json.dump(summary, out, indent=4, sort_keys=True)
+        out.write('\n')
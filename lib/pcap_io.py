@@ -0,0 +1,166 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Raw pcap records and the shared-memory ring gen_pcap workers fill.
+
+Workers encode their packets as complete pcap records (record header
+and frame), so the writer process only copies bytes to the output
+file.
+"""
+
+import mmap
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python2
+    shared_memory = None
+
+__all__ = ["ShmRing", "pcap_header", "pcap_records", "pcap_records_batch",
+           "iter_frames", "read_pcap", "REC_HDR"]
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+SNAPLEN = 65535
+
+PCAP_HDR = struct.Struct('<IHHiIII')
+REC_HDR = struct.Struct('<IIII')
+
+
+def pcap_header(linktype=LINKTYPE_ETHERNET):
+    "Return the global header of a pcap file"
+    return PCAP_HDR.pack(PCAP_MAGIC, 2, 4, 0, 0, SNAPLEN, linktype)
+
+
+def pcap_records(pkts, ts):
+    """Return the frames in the `pkts` list as pcap records.  `ts` are the
+    timestamps of the packets in microseconds."""
+    out = []
+    for p, t in zip(pkts, ts):
+        out.append(REC_HDR.pack(int(t // 1000000), int(t % 1000000),
+                                len(p), len(p)))
+        out.append(p)
+    return b''.join(out)
+
+
+def pcap_records_batch(data, lens, ts, out=None):
+    """Return the frames of a NumPy batch (see merge_batches) as pcap
+    records in a uint8 array.  `ts` is an array of timestamps in
+    microseconds.  If `out` is given, the records are written into it."""
+    num = len(lens)
+    size = int(lens.sum()) + num * REC_HDR.size
+    if out is None:
+        out = np.empty(size, dtype=np.uint8)
+    ts = np.asarray(ts, dtype=np.int64)
+    hdr = np.empty((num, 4), dtype='<u4')
+    hdr[:, 0] = ts // 1000000
+    hdr[:, 1] = ts % 1000000
+    hdr[:, 2] = lens
+    hdr[:, 3] = lens
+    rec_lens = lens + REC_HDR.size
+    rec_offsets = np.cumsum(rec_lens) - rec_lens
+    idx = rec_offsets[:, None] + np.arange(REC_HDR.size)
+    out[idx] = hdr.view(np.uint8).reshape(num, REC_HDR.size)
+    pkt_nums = np.repeat(np.arange(num), lens)
+    out[np.arange(len(data)) + (pkt_nums + 1) * REC_HDR.size] = data
+    return out
+
+
+def iter_frames(records):
+    "Yield the frames of a buffer of pcap records"
+    records = bytes(records)
+    offset = 0
+    while offset < len(records):
+        _, _, caplen, _ = REC_HDR.unpack_from(records, offset)
+        offset += REC_HDR.size
+        yield records[offset:offset + caplen]
+        offset += caplen
+
+
+def read_pcap(fname):
+    """Yield the (timestamp [ns], frame) of the packets of a pcap file.
+    Both microsecond and nanosecond resolution pcaps are supported."""
+    with open(fname, 'rb') as f:
+        hdr = f.read(PCAP_HDR.size)
+        if len(hdr) < PCAP_HDR.size:
+            raise ValueError('%s: not a pcap file' % fname)
+        for endian in '<>':
+            magic = struct.unpack(endian + 'I', hdr[:4])[0]
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+                break
+        else:
+            raise ValueError('%s: not a pcap file' % fname)
+        unit = 1 if magic == PCAP_MAGIC_NS else 1000
+        rec_hdr = struct.Struct(endian + 'IIII')
+        while True:
+            rec = f.read(rec_hdr.size)
+            if len(rec) < rec_hdr.size:
+                break
+            sec, frac, caplen, _ = rec_hdr.unpack(rec)
+            yield sec * 1000000000 + frac * unit, f.read(caplen)
+
+
+class ShmRing(object):
+    """Fixed size slots in shared memory.
+
+    The ring must be created before the workers are started.  Python 3
+    uses multiprocessing.shared_memory, python 2 an anonymous shared
+    mmap inherited by the forked workers."""
+
+    def __init__(self, slot_num, slot_size):
+        self.slot_num = slot_num
+        self.slot_size = slot_size
+        size = slot_num * slot_size
+        if shared_memory is None:
+            self.shm = None
+            self.mem = mmap.mmap(-1, size)
+        else:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.mem = self.shm.buf
+
+    def fits(self, size):
+        return size <= self.slot_size
+
+    def write(self, slot, data):
+        offset = slot * self.slot_size
+        self.mem[offset:offset + len(data)] = data
+
+    def array(self, slot, size):
+        "Return a writable NumPy view of the first `size` bytes of `slot`"
+        return np.frombuffer(self.mem, dtype=np.uint8, count=size,
+                             offset=slot * self.slot_size)
+
+    def view(self, slot, size):
+        "Return the first `size` bytes of `slot` without copying"
+        offset = slot * self.slot_size
+        if self.shm is None:
+            return buffer(self.mem, offset, size)
+        return self.mem[offset:offset + size]
+
+    def close(self):
+        if self.shm is None:
+            self.mem.close()
+        else:
+            self.shm.close()
+            self.shm.unlink()
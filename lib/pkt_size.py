@@ -0,0 +1,102 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Packet size distributions.
+
+A distribution is given as
+  - the name of an IMIX profile (see PROFILES),
+  - a list of sizes with weights: '64:7,594:4,1518:1', or
+  - the path of an empirical CDF file with 'size probability' lines,
+    where probability is the cumulative probability of the size.
+"""
+
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ["PktSizeDist", "PROFILES"]
+
+PROFILES = {
+    # Simple IMIX (7:4:1)
+    'imix': [(64, 7), (594, 4), (1518, 1)],
+    # IMIX used by Tolly
+    'imix-tolly': [(64, 55), (78, 5), (576, 17), (1518, 23)],
+}
+
+
+def parse_weights(spec):
+    dist = []
+    for item in spec.split(','):
+        size, _, weight = item.partition(':')
+        dist.append((int(size), float(weight or 1)))
+    return dist
+
+
+def parse_cdf(fname):
+    "Convert a CDF file to (size, weight) pairs"
+    dist = []
+    prev = 0.0
+    with open(fname) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            size, prob = int(line[0]), float(line[1])
+            if prob < prev:
+                raise ValueError('%s: CDF is not monotonic at size %d' %
+                                 (fname, size))
+            dist.append((size, prob - prev))
+            prev = prob
+    return dist
+
+
+class PktSizeDist(object):
+    def __init__(self, spec):
+        if np is None:
+            raise ImportError('packet size distributions require NumPy')
+        if spec in PROFILES:
+            dist = PROFILES[spec]
+        elif os.path.exists(spec):
+            dist = parse_cdf(spec)
+        else:
+            try:
+                dist = parse_weights(spec)
+            except ValueError:
+                raise ValueError('invalid packet size distribution: %s '
+                                 '(known profiles: %s)' %
+                                 (spec, ', '.join(sorted(PROFILES))))
+        dist = [(s, w) for s, w in dist if w > 0]
+        if not dist:
+            raise ValueError('empty packet size distribution: %s' % spec)
+        self.size_list = np.array([s for s, _ in dist], dtype=np.int64)
+        self.cdf = np.cumsum([w for _, w in dist], dtype=np.float64)
+        self.cdf /= self.cdf[-1]
+
+    def max_size(self):
+        return int(self.size_list.max())
+
+    def mean_size(self):
+        prob = np.diff(np.concatenate([[0.0], self.cdf]))
+        return float((prob * self.size_list).sum())
+
+    def sizes(self, u):
+        "Return the sizes for the uniform random numbers `u`"
+        idx = np.searchsorted(self.cdf, u, side='right')
+        return self.size_list[np.minimum(idx, len(self.size_list) - 1)]
@@ -0,0 +1,445 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Raw-bytes packet templates.
+
+A template is a fully built packet (including padding) together with
+the offsets of its layers.  Building a new packet from a template
+copies the bytes, patches the requested fields and recomputes the
+IPv4, TCP and UDP checksums, so scapy is only needed once per
+template.  With NumPy, a whole batch of packets can be built at once
+from columns of field values.
+"""
+
+import array
+import binascii
+import re
+import socket
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ["PktTemplate", "checksum", "mac2int", "ip2int", "merge_batches",
+           "take_frames", "SIGNATURE", "SIG_MAGIC", "SIGNATURE_SHORT",
+           "SIG_MAGIC_SHORT", "SIG_CHURN", "parse_signature"]
+
+# (offset within the layer, field type)
+FIELDS = {
+    'Ether': {'dst': (0, 'mac'), 'src': (6, 'mac'), 'type': (12, 'H')},
+    'IP': {'tos': (1, 'B'), 'id': (4, 'H'), 'ttl': (8, 'B'),
+           'proto': (9, 'B'), 'src': (12, 'ip'), 'dst': (16, 'ip')},
+    'TCP': {'sport': (0, 'H'), 'dport': (2, 'H'), 'seq': (4, 'I')},
+    'UDP': {'sport': (0, 'H'), 'dport': (2, 'H')},
+    'VXLAN': {'vni': (4, 'I24')},
+    'GTPHeader': {'teid': (4, 'I')},
+}
+
+# Offset of the checksum field within the L4 header
+L4_CHKSUM = {'TCP': 16, 'UDP': 6}
+
+# Packet signature at the start of the payload: magic, trace id, flow
+# id, sequence number (position in the trace), TX timestamp slot [ns]
+# left zero for testers that can fill it in
+SIG_MAGIC = b'TIPS'
+SIGNATURE = struct.Struct('!4sIIQQ')
+# The signature of packets without room for the TX timestamp slot
+SIG_MAGIC_SHORT = b'TIPs'
+SIGNATURE_SHORT = struct.Struct('!4sIIQ')
+# Flag in the sequence number of the packets of run-time entities (see
+# the 'churn' traffic option)
+SIG_CHURN = 1 << 63
+SIG_DTYPE = [('magic', 'S4'), ('trace', '>u4'), ('flow', '>u4'),
+             ('seq', '>u8'), ('tx_ts', '>u8')]
+SIG_DTYPE_SHORT = SIG_DTYPE[:-1]
+
+# Encapsulations of the generated packets, see get_payload_offset
+VXLAN_PORT = 4789
+GTPU_PORT = 2152
+MAX_DEPTH = 4
+# Header length of the L4 protocols without options, the payload of
+# IP without an L4 header (protocol 0, as built by scapy) is at offset 0
+L4_HDR_LEN = {0: 0, 1: 8, 17: 8}  # -, ICMP, UDP
+
+FNV_OFFSET = 0x811c9dc5
+FNV_PRIME = 0x01000193
+
+
+def checksum(data):
+    "Internet checksum (RFC 1071) of `data` as computed by scapy"
+    if len(data) % 2:
+        data += b'\x00'
+    s = sum(array.array('H', data))
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    s = ~s & 0xffff
+    if sys.byteorder == 'little':
+        s = ((s >> 8) & 0xff) | ((s << 8) & 0xff00)
+    return s
+
+
+def mac2bytes(mac):
+    return binascii.unhexlify(mac.replace(':', ''))
+
+
+def ip2bytes(ip):
+    return socket.inet_aton(ip)
+
+
+def mac2int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def ip2int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int2bytes24(val):
+    return struct.pack('!I', val)[1:]
+
+
+def sum16_batch(arr, start, end):
+    "Sum of the 16-bit big-endian words of arr[:, start:end] as uint64"
+    hi = arr[:, start:end:2].astype(np.uint64).sum(axis=1)
+    lo = arr[:, start + 1:end:2].astype(np.uint64).sum(axis=1)
+    return (hi << 8) + lo
+
+
+def checksum_batch(s):
+    "Fold the partial sums `s` into Internet checksums"
+    for _ in range(3):
+        s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
+
+def set_column(arr, offset, size, col):
+    "Write the integer column `col` big-endian into arr[:, offset:offset+size]"
+    col = np.asarray(col, dtype='>u8').view(np.uint8).reshape(-1, 8)
+    arr[:, offset:offset + size] = col[:, 8 - size:]
+
+
+def merge_batches(groups, num):
+    """Concatenate the rows of uniform batches in packet order.
+
+    `groups` is a list of (positions, batch) pairs, where row i of the
+    (N x len) uint8 batch is the packet at positions[i] of the output.
+    Return (data, lens): the frames as one flat uint8 array and their
+    lengths."""
+    lens = np.zeros(num, dtype=np.int64)
+    for pos, batch in groups:
+        lens[pos] = batch.shape[1]
+    offsets = np.cumsum(lens) - lens
+    data = np.empty(int(lens.sum()), dtype=np.uint8)
+    for pos, batch in groups:
+        idx = offsets[pos][:, None] + np.arange(batch.shape[1])
+        data[idx] = batch
+    return data, lens
+
+
+def take_frames(data, lens, idxs):
+    """Return (data, lens) of the frames `idxs` of the flat frame array
+    `data` (see merge_batches), in the order of `idxs`."""
+    idxs = np.asarray(idxs, dtype=np.int64)
+    offsets = (np.cumsum(lens) - lens)[idxs]
+    new_lens = lens[idxs]
+    starts = np.repeat(np.cumsum(new_lens) - new_lens, new_lens)
+    within = np.arange(int(new_lens.sum())) - starts
+    return data[np.repeat(offsets, new_lens) + within], new_lens
+
+
+def get_payload_offset(frame):
+    """Return the offset of the payload of the innermost L4 header of
+    `frame` (Ethernet, VLAN, IPv4, VXLAN and GTP-U tunnels as in
+    pcap_analyzer.dissect), or None if the headers are not known."""
+    if len(frame) < 14:
+        return None
+    etype, = struct.unpack_from('!H', frame, 12)
+    l3 = 14
+    if etype == 0x8100 and len(frame) >= 18:
+        etype, = struct.unpack_from('!H', frame, 16)
+        l3 = 18
+    if etype != 0x0800:
+        return None
+    for _ in range(MAX_DEPTH):
+        if len(frame) < l3 + 20:
+            return None
+        ver_ihl, = struct.unpack_from('!B', frame, l3)
+        proto, = struct.unpack_from('!B', frame, l3 + 9)
+        if ver_ihl >> 4 != 4:
+            return None
+        l4 = l3 + (ver_ihl & 0xf) * 4
+        if proto == 6:
+            if len(frame) < l4 + 20:
+                return None
+            data_off, = struct.unpack_from('!B', frame, l4 + 12)
+            return l4 + (data_off >> 4) * 4
+        if proto not in L4_HDR_LEN:
+            return None
+        payload = l4 + L4_HDR_LEN[proto]
+        if proto != 17 or len(frame) < l4 + 16:
+            return payload
+        dport, = struct.unpack_from('!H', frame, l4 + 2)
+        flags, next_proto = struct.unpack_from('!B2xB', frame, l4 + 8)
+        if dport == VXLAN_PORT:
+            # VXLAN-GPE may carry IPv4 without an Ethernet header
+            if flags & 0x04 and next_proto == 1:
+                l3 = l4 + 16
+                continue
+            if len(frame) < l4 + 30:
+                return None
+            etype, = struct.unpack_from('!H', frame, l4 + 28)
+            if etype != 0x0800:
+                return None
+            l3 = l4 + 30
+        elif dport == GTPU_PORT:
+            msg_type, = struct.unpack_from('!B', frame, l4 + 9)
+            if msg_type != 0xff:
+                # Not a G-PDU, the inner packet is not known
+                return None
+            l3 = l4 + 16 + (4 if flags & 0x07 else 0)
+        else:
+            return payload
+    return None
+
+
+def parse_signature(frame):
+    """Return the (trace id, flow id, seq, TX timestamp) of the signature
+    in `frame`, or None if it has none.  The TX timestamp of a short
+    signature is 0.  The signature is read at the start of the payload
+    (see get_payload_offset), it is only searched for in the frames of
+    unknown encapsulation."""
+    sigs = [(SIG_MAGIC, SIGNATURE), (SIG_MAGIC_SHORT, SIGNATURE_SHORT)]
+    found = None
+    offset = get_payload_offset(frame)
+    if offset is not None:
+        for magic, sig in sigs:
+            if (offset + sig.size <= len(frame) and
+                    frame[offset:offset + 4] == magic):
+                found = (offset, sig)
+    else:
+        for magic, sig in sigs:
+            offset = frame.find(magic)
+            if offset < 0 or offset + sig.size > len(frame):
+                continue
+            if found is None or offset < found[0]:
+                found = (offset, sig)
+    if found is None:
+        return None
+    offset, sig = found
+    values = sig.unpack_from(frame, offset)[1:]
+    if sig is SIGNATURE_SHORT:
+        values += (0,)
+    return values
+
+
+def get_layers(pkt):
+    "Return the (name, offset, header length) of the layers of a scapy pkt"
+    layers = []
+    offset = 0
+    while pkt and pkt.__class__.__name__ not in ('Raw', 'Padding'):
+        hdr_len = len(pkt) - len(pkt.payload)
+        layers.append((pkt.__class__.__name__, offset, hdr_len))
+        offset += hdr_len
+        pkt = pkt.payload
+    return layers
+
+
+class PktTemplate(object):
+    """Packet bytes with known field offsets.
+
+    `fields` name the patchable fields as 'Layer.field' or
+    'Layer[n].field', where n indexes the layers of the same type
+    (negative values count from the innermost one).  Fields derived
+    by scapy (e.g., the source address looked up in the routing table)
+    are resolved once, when the template is built.
+    """
+
+    def __init__(self, data, layers, fields=()):
+        self.data = bytes(data)
+        self.layers = layers
+        self.setters = [self.compile_field(f) for f in fields]
+        self.array = None
+        self.chksums = self.compile_checksums()
+        self.flow_key = self.compile_flow_key()
+        _, offset, hdr_len = layers[-1]
+        self.payload_offset = offset + hdr_len
+        room = len(self.data) - self.payload_offset
+        # The short signature if there is no room for the TX timestamp
+        self.sig = None
+        if room >= SIGNATURE.size:
+            self.sig = (SIG_MAGIC, SIGNATURE, SIG_DTYPE)
+        elif room >= SIGNATURE_SHORT.size:
+            self.sig = (SIG_MAGIC_SHORT, SIGNATURE_SHORT, SIG_DTYPE_SHORT)
+        self.has_sig_room = self.sig is not None
+
+    @classmethod
+    def from_scapy(cls, pkt, fields=()):
+        return cls(bytes(pkt), get_layers(pkt), fields)
+
+    def __len__(self):
+        return len(self.data)
+
+    def find_layer(self, name, idx=0):
+        "Return (offset, hdr_len) of the `idx`th layer called `name`"
+        layers = [l[1:] for l in self.layers if l[0] == name]
+        try:
+            return layers[idx]
+        except IndexError:
+            raise KeyError('no layer %s[%d] in template' % (name, idx))
+
+    def compile_field(self, field):
+        m = re.match(r'^(\w+)(?:\[(-?\d+)\])?\.(\w+)$', field)
+        if not m:
+            raise ValueError('invalid template field: %s' % field)
+        layer, idx, name = m.group(1), int(m.group(2) or 0), m.group(3)
+        offset, _ = self.find_layer(layer, idx)
+        field_offset, ftype = FIELDS[layer][name]
+        offset += field_offset
+        if ftype == 'mac':
+            return (offset, 6, mac2bytes)
+        elif ftype == 'ip':
+            return (offset, 4, ip2bytes)
+        elif ftype == 'I24':
+            return (offset, 3, int2bytes24)
+        else:
+            fmt = struct.Struct('!' + ftype)
+            return (offset, fmt.size, fmt.pack)
+
+    def compile_checksums(self):
+        """Return the checksums to recompute, inner ones first, as
+        (ip_offset, ihl, l4_offset, l4_len, l4_chksum_offset, is_udp)"""
+        chksums = []
+        data = self.data
+        for i, (name, offset, hdr_len) in enumerate(self.layers):
+            if name != 'IP':
+                continue
+            ihl = (struct.unpack_from('!B', data, offset)[0] & 0xf) * 4
+            ip_len = struct.unpack_from('!H', data, offset + 2)[0]
+            l4 = (None, None, None, False)
+            if i + 1 < len(self.layers):
+                l4_name, l4_offset, _ = self.layers[i + 1]
+                if l4_name in L4_CHKSUM:
+                    l4 = (l4_offset, ip_len - ihl,
+                          l4_offset + L4_CHKSUM[l4_name], l4_name == 'UDP')
+            chksums.append((offset, ihl) + l4)
+        return list(reversed(chksums))
+
+    def compile_flow_key(self):
+        """Return the byte ranges of the 5-tuple of the innermost IP
+        packet, the flow id of the signature is the hash of these"""
+        ips = [i for i, l in enumerate(self.layers) if l[0] == 'IP']
+        if not ips:
+            return []
+        offset = self.layers[ips[-1]][1]
+        key = [(offset + 12, offset + 20), (offset + 9, offset + 10)]
+        if ips[-1] + 1 < len(self.layers):
+            l4_name, l4_offset, _ = self.layers[ips[-1] + 1]
+            if l4_name in L4_CHKSUM:
+                key.append((l4_offset, l4_offset + 4))
+        return key
+
+    def flow_id(self, buf):
+        "FNV-1a hash of the flow key of the packet"
+        h = FNV_OFFSET
+        for start, end in self.flow_key:
+            for b in bytearray(buf[start:end]):
+                h = ((h ^ b) * FNV_PRIME) & 0xffffffff
+        return h
+
+    def flow_id_batch(self, arr):
+        h = np.full(len(arr), FNV_OFFSET, dtype=np.uint64)
+        for start, end in self.flow_key:
+            for i in range(start, end):
+                h = ((h ^ arr[:, i]) * np.uint64(FNV_PRIME)) & \
+                    np.uint64(0xffffffff)
+        return h
+
+    def build(self, *values, **kw):
+        """Return the packet bytes with the fields set to `values`.  If
+        `sig` = (trace id, sequence number) is given and the packet has
+        room for it, the signature is written at the start of the
+        payload."""
+        buf = bytearray(self.data)
+        for (offset, size, conv), val in zip(self.setters, values):
+            buf[offset:offset + size] = conv(val)
+        sig = kw.get('sig')
+        if sig is not None and self.has_sig_room:
+            trace_id, seq = sig
+            magic, fmt, _ = self.sig
+            values = (magic, trace_id, self.flow_id(buf), seq)
+            if fmt is SIGNATURE:
+                values += (0,)
+            fmt.pack_into(buf, self.payload_offset, *values)
+        self.update_checksums(buf)
+        return bytes(buf)
+
+    def build_batch(self, *columns, **kw):
+        """Return an (N x len) uint8 array of packets.  The fields are
+        set from `columns`, arrays of integers (MAC and IP addresses
+        should be converted with mac2int and ip2int).  `sig` is (trace
+        id, array of sequence numbers), see build()."""
+        if self.array is None:
+            self.array = np.frombuffer(self.data, dtype=np.uint8)
+        num = len(columns[0]) if columns else 0
+        arr = np.tile(self.array, (num, 1))
+        for (offset, size, _), col in zip(self.setters, columns):
+            set_column(arr, offset, size, col)
+        sig = kw.get('sig')
+        if sig is not None and self.has_sig_room:
+            trace_id, seq = sig
+            magic, fmt, dtype = self.sig
+            rec = np.zeros(num, dtype=dtype)
+            rec['magic'] = magic
+            rec['trace'] = trace_id
+            rec['flow'] = self.flow_id_batch(arr)
+            rec['seq'] = seq
+            off = self.payload_offset
+            arr[:, off:off + fmt.size] = \
+                rec.view(np.uint8).reshape(num, fmt.size)
+        for ip_off, ihl, l4_off, l4_len, l4_ck_off, is_udp in self.chksums:
+            if l4_off is not None:
+                arr[:, l4_ck_off:l4_ck_off + 2] = 0
+                s = (sum16_batch(arr, ip_off + 12, ip_off + 20) +
+                     arr[:, ip_off + 9].astype(np.uint64) + l4_len +
+                     sum16_batch(arr, l4_off, l4_off + l4_len))
+                ck = checksum_batch(s)
+                if is_udp:
+                    ck[ck == 0] = 0xffff
+                set_column(arr, l4_ck_off, 2, ck)
+            arr[:, ip_off + 10:ip_off + 12] = 0
+            ck = checksum_batch(sum16_batch(arr, ip_off, ip_off + ihl))
+            set_column(arr, ip_off + 10, 2, ck)
+        return arr
+
+    def update_checksums(self, buf):
+        for ip_off, ihl, l4_off, l4_len, l4_ck_off, is_udp in self.chksums:
+            if l4_off is not None:
+                buf[l4_ck_off:l4_ck_off + 2] = b'\x00\x00'
+                pseudo = struct.pack('!4s4sBBH',
+                                     bytes(buf[ip_off + 12:ip_off + 16]),
+                                     bytes(buf[ip_off + 16:ip_off + 20]),
+                                     0, buf[ip_off + 9], l4_len)
+                ck = checksum(pseudo + bytes(buf[l4_off:l4_off + l4_len]))
+                if is_udp and ck == 0:
+                    ck = 0xffff
+                struct.pack_into('!H', buf, l4_ck_off, ck)
+            buf[ip_off + 10:ip_off + 12] = b'\x00\x00'
+            ck = checksum(bytes(buf[ip_off:ip_off + ihl]))
+            struct.pack_into('!H', buf, ip_off + 10, ck)
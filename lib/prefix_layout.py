@@ -0,0 +1,192 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Prefixes of the L3 tables (l3fwd L3FIB, servers of mgw and bng).
+
+By default, the entries are /24 prefixes allocated one after the other
+(see gen_conf_base.byte_seq), which is the best case for every LPM
+implementation.  Here, the prefix lengths follow a distribution, and
+the prefixes are placed in an address pool
+  - 'sequential': densely, one after the other (aligned to their size)
+  - 'random': sparsely, at random positions
+and a share of them is nested into a shorter prefix of the table.
+
+The prefixes of a table are distinct.  The address of an entry (the
+destination of the generated traffic) is in its prefix, but not in a
+longer prefix of the table, if possible, so that the packets sent to
+an entry match that entry.
+"""
+
+import bisect
+import random
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+try:
+  from conf_tables import format_ip
+except ImportError:
+  from .conf_tables import format_ip
+
+__all__ = ["PREFIX_LEN_DISTS", "parse_prefix_len_dist", "PrefixLayout"]
+
+# Approximate prefix length histogram [%] of the IPv4 Internet routing
+# table (about 2023): mostly /24s, and a long tail of aggregates
+PREFIX_LEN_DISTS = {
+  'bgp': {8: 0.02, 9: 0.01, 10: 0.03, 11: 0.08, 12: 0.17, 13: 0.3,
+          14: 0.6, 15: 1.0, 16: 1.35, 17: 0.8, 18: 1.3, 19: 2.5,
+          20: 4.0, 21: 5.0, 22: 12.0, 23: 10.0, 24: 60.84},
+}
+
+def parse_prefix_len_dist (spec):
+  """Return the prefix lengths and their probabilities of `spec`: a
+  single length ('24'), the name of a distribution ('bgp'), or
+  'length:weight' pairs ('16:1,24:8,32:1')"""
+  spec = str(spec)
+  if spec in PREFIX_LEN_DISTS:
+    hist = PREFIX_LEN_DISTS[spec]
+  else:
+    hist = {}
+    try:
+      for item in spec.split(','):
+        plen, _, weight = item.partition(':')
+        hist[int(plen)] = hist.get(int(plen), 0) + float(weight or 1)
+    except ValueError:
+      raise ValueError('invalid prefix-len: %s' % spec)
+  if (not hist or any(not 0 < l <= 32 for l in hist) or
+      any(w < 0 for w in hist.values()) or sum(hist.values()) <= 0):
+    raise ValueError('invalid prefix-len: %s' % spec)
+  lens = sorted(l for l in hist if hist[l] > 0)
+  total = float(sum(hist[l] for l in lens))
+  return lens, [hist[l] / total for l in lens]
+
+
+class PrefixLayout (object):
+  """The prefixes of an L3 table of `size` entries in the address range
+  [pool_start, pool_end).  `ips` and `prefix_lens` are the columns of
+  the table (NumPy arrays if NumPy is available)."""
+
+  def __init__ (self, size, pool, prefix_len='24', layout='sequential',
+                nested=0.0, seed=1):
+    if layout not in ('sequential', 'random'):
+      raise ValueError('invalid addr-layout: %s' % layout)
+    if not 0 <= nested <= 1:
+      raise ValueError('nested-prefix must be in [0, 1]')
+    self.rng = random.Random('%s:%s:%s' % (seed, pool[0], pool[1]))
+    self.pool_start, self.pool_end = pool
+    self.layout = layout
+    self.nested = nested
+    lens, probs = parse_prefix_len_dist(prefix_len)
+    self.lens = self.draw_lens(size, lens, probs)
+    self.taken = set()          # (prefix_len, net)
+    self.nets = []
+    self.cursor = self.pool_start
+    for plen in self.lens:
+      self.nets.append(self.place(plen))
+    ips = self.get_hosts()
+    if np is not None:
+      ips = np.array(ips, dtype=np.int64)
+      self.lens = np.array(self.lens, dtype=np.int64)
+    self.ips = ips
+    self.prefix_lens = self.lens
+
+  def draw_lens (self, size, lens, probs):
+    cum, acc = [], 0.0
+    for p in probs:
+      acc += p
+      cum.append(acc)
+    last = len(lens) - 1
+    return [lens[min(bisect.bisect_left(cum, self.rng.random() * acc), last)]
+            for _ in range(size)]
+
+  def place (self, plen):
+    "Return the network address of a new, distinct prefix of length plen"
+    if self.nested and self.nets and self.rng.random() < self.nested:
+      net = self.place_nested(plen)
+      if net is not None:
+        return net
+    place = getattr(self, 'place_%s' % self.layout)
+    for _ in range(32):
+      net = place(plen)
+      if (plen, net) not in self.taken:
+        self.taken.add((plen, net))
+        return net
+    raise ValueError('cannot place %d distinct /%d prefixes in %s-%s' % (
+      len(self.nets) + 1, plen, format_ip(self.pool_start),
+      format_ip(self.pool_end - 1)))
+
+  def place_nested (self, plen):
+    "Place the prefix into a random shorter prefix of the table"
+    for _ in range(8):
+      idx = self.rng.randrange(len(self.nets))
+      parent_len = self.lens[idx]
+      if parent_len >= plen:
+        continue
+      offset = self.rng.randrange(1 << plen - parent_len)
+      net = self.nets[idx] + (offset << 32 - plen)
+      if (plen, net) not in self.taken:
+        self.taken.add((plen, net))
+        return net
+    return None
+
+  def blocks (self, plen):
+    "Return the first and the last+1 aligned blocks of length plen"
+    size = 1 << 32 - plen
+    first = (self.pool_start + size - 1) // size
+    last = self.pool_end // size
+    if first >= last:
+      raise ValueError('/%d prefixes do not fit in %s-%s' % (
+        plen, format_ip(self.pool_start), format_ip(self.pool_end - 1)))
+    return first, last, size
+
+  def place_sequential (self, plen):
+    first, last, size = self.blocks(plen)
+    block = max(first, (self.cursor + size - 1) // size)
+    if block >= last:
+      # Pool exhausted, fill the gaps left by the alignment randomly
+      return self.place_random(plen)
+    self.cursor = (block + 1) * size
+    return block * size
+
+  def place_random (self, plen):
+    first, last, size = self.blocks(plen)
+    return self.rng.randrange(first, last) * size
+
+  def get_hosts (self):
+    """Return an address in each prefix: its third address (x.y.z.2 of
+    a /24) if it is not in a longer prefix, otherwise a random one
+    outside the longer prefixes, if found in a few tries"""
+    lens_present = sorted(set(self.lens))
+
+    def covered (addr, plen):
+      for l in lens_present:
+        if l > plen and (l, addr >> 32 - l << 32 - l) in self.taken:
+          return True
+      return False
+
+    hosts = []
+    for net, plen in zip(self.nets, self.lens):
+      size = 1 << 32 - plen
+      addr = net + min(2, size - 1)
+      for _ in range(16):
+        if not covered(addr, plen):
+          break
+        addr = net + self.rng.randrange(size)
+      hosts.append(addr)
+    return hosts
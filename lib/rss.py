@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""RSS queues of the packets of a pcap: per-queue balance report and
+per-queue pcaps.
+
+The queue of a packet is looked up in the indirection table (RETA) by
+the Toeplitz hash of its IPv4 addresses and, for TCP and UDP, ports, as
+a NIC receiving the traffic would do.  By default the outer headers are
+hashed, the innermost (tunneled) ones with --inner.  Non-IPv4 packets
+get the hash 0.
+
+The hash is computed for whole chunks of packets with NumPy: the key is
+turned into a table of the partial hashes of each input byte position
+and byte value, the hash of a packet is the XOR of its table entries.
+
+Usage:
+  rss.py traffic.pcap --queues 4              # balance report
+  rss.py traffic.pcap --queues 4 --split      # traffic-q0.pcap, ...
+"""
+
+import argparse
+import binascii
+import json
+import os
+import sys
+
+import numpy as np
+
+try:
+    from pcap_analyzer import Capture, dissect, unique_rows, update_results
+    from pcap_io import PCAP_HDR, PCAP_MAGIC_NS, SNAPLEN, REC_HDR
+except ImportError:
+    from .pcap_analyzer import Capture, dissect, unique_rows, update_results
+    from .pcap_io import PCAP_HDR, PCAP_MAGIC_NS, SNAPLEN, REC_HDR
+
+__all__ = ["Toeplitz", "get_reta", "get_queues", "shard", "shard_name"]
+
+# The default key of many drivers (e.g., Intel, Microsoft verification
+# suite)
+DEFAULT_KEY = ('6d5a56da255b0ec24167253d43a38fb0'
+               'd0ca2bcbae7b30b477cb2da38030f20c'
+               '6a42b73bbeac01fa')
+DEFAULT_RETA_SIZE = 128
+
+# Hash input: src IP, dst IP, src port, dst port
+INPUT_LEN = 12
+
+
+class Toeplitz(object):
+    def __init__(self, key=None):
+        key = parse_key(key or DEFAULT_KEY)
+        if len(key) < INPUT_LEN + 4:
+            raise ValueError('RSS key is too short: %d bytes' % len(key))
+        k = int(binascii.hexlify(key), 16)
+        bits = len(key) * 8
+        # 32-bit window of the key at every bit of the input
+        windows = np.array([(k >> (bits - 32 - i)) & 0xffffffff
+                            for i in range(INPUT_LEN * 8)], dtype=np.uint32)
+        windows = windows.reshape(INPUT_LEN, 8)
+        values = np.arange(256)
+        self.table = np.zeros((INPUT_LEN, 256), dtype=np.uint32)
+        for bit in range(8):
+            set_bit = (values & (0x80 >> bit)) > 0
+            self.table[:, set_bit] ^= windows[:, bit, None]
+
+    def hash(self, data):
+        "Return the hashes of the rows of a (num, INPUT_LEN) uint8 array"
+        h = np.zeros(len(data), dtype=np.uint32)
+        for pos in range(data.shape[1]):
+            h ^= self.table[pos, data[:, pos]]
+        return h
+
+    def hash_flows(self, flow):
+        "Return the hashes of packed 5-tuples (see pcap_analyzer.dissect)"
+        data = np.empty((len(flow), INPUT_LEN), dtype=np.uint8)
+        words = [(flow[:, 0], 0, 8), (flow[:, 1], 8, 4)]
+        for word, pos, num in words:
+            for i in range(num):
+                shift = np.uint64(8 * (num - 1 - i))
+                data[:, pos + i] = (word >> shift) & np.uint64(0xff)
+        return self.hash(data)
+
+
+def parse_key(key):
+    "Parse a hex RSS key, bytes may be separated with ':' or spaces"
+    if not isinstance(key, str):
+        return key
+    return binascii.unhexlify(''.join(key.replace(':', ' ').split()))
+
+
+def get_reta(queues, reta=None):
+    """Return the indirection table as an array: the given list of
+    queues or the queues spread round-robin over DEFAULT_RETA_SIZE
+    entries"""
+    if reta:
+        reta = np.array(reta, dtype=np.int64)
+        if reta.min() < 0 or reta.max() >= queues:
+            raise ValueError('RETA refers to a queue out of 0..%d'
+                             % (queues - 1))
+        return reta
+    return np.arange(DEFAULT_RETA_SIZE) % queues
+
+
+def get_flow(d, inner=False):
+    "Return the tuples of a dissected chunk the RSS hash is computed on"
+    return d['flow'] if inner else d['outer_flow']
+
+
+def get_queues(toeplitz, reta, d, inner=False):
+    "Return the hashes and the queues of the packets of a dissected chunk"
+    h = toeplitz.hash_flows(get_flow(d, inner))
+    h[~d['ip']] = 0
+    return h, reta[h % np.uint32(len(reta))]
+
+
+def shard_name(fname, queue):
+    "Return the name of the pcap of a queue, e.g., traffic-q0.pcap"
+    return '%s-q%d.pcap' % (os.path.splitext(fname)[0], queue)
+
+
+def copy_records(cap, offsets, caplen):
+    "Return the raw records at `offsets` of a pcap as a uint8 array"
+    rec_lens = caplen.astype(np.int64) + cap.rec_hdr_len
+    rec_offsets = np.cumsum(rec_lens) - rec_lens
+    pos = np.arange(int(rec_lens.sum()))
+    pos += np.repeat(offsets - rec_offsets, rec_lens)
+    return cap.u8[pos]
+
+
+def build_records(cap, ts, caplen, wirelen, frames):
+    "Return the packets of a pcapng as pcap records (ns resolution)"
+    num = len(frames)
+    hdr = np.empty((num, 4), dtype='<u4')
+    hdr[:, 0] = ts // 1000000000
+    hdr[:, 1] = ts % 1000000000
+    hdr[:, 2] = caplen
+    hdr[:, 3] = wirelen
+    caplen = caplen.astype(np.int64)
+    rec_lens = caplen + REC_HDR.size
+    rec_offsets = np.cumsum(rec_lens) - rec_lens
+    out = np.empty(int(rec_lens.sum()), dtype=np.uint8)
+    idx = rec_offsets[:, None] + np.arange(REC_HDR.size)
+    out[idx] = hdr.view(np.uint8).reshape(num, REC_HDR.size)
+    pkt_nums = np.repeat(np.arange(num), caplen)
+    pos = np.arange(int(caplen.sum())) - np.repeat(np.cumsum(caplen) - caplen,
+                                                   caplen)
+    out[rec_offsets[pkt_nums] + REC_HDR.size + pos] = \
+        cap.u8[frames[pkt_nums] + pos]
+    return out
+
+
+def shard(fname, queues, key=None, reta=None, inner=False, split=False):
+    """Return the per-queue balance report of the pcap or pcapng `fname`.
+    If `split` is set, the packets of each queue are written into a
+    separate pcap as well (see shard_name), in their original order."""
+    toeplitz = Toeplitz(key)
+    reta = get_reta(queues, reta)
+    cap = Capture(fname)
+    files = []
+    if split:
+        if cap.format == 'pcap':
+            hdr = cap.u8[:cap.start].tobytes()
+        else:
+            hdr = PCAP_HDR.pack(PCAP_MAGIC_NS, 2, 4, 0, 0, SNAPLEN, 1)
+        for q in range(queues):
+            files.append(open(shard_name(fname, q), 'wb'))
+            files[-1].write(hdr)
+
+    pkts = np.zeros(queues, dtype=np.int64)
+    byts = np.zeros(queues, dtype=np.int64)
+    flows = []
+    for ts, caplen, wirelen, frames in cap.batches():
+        d = dissect(cap.u8, frames, caplen)
+        _, queue = get_queues(toeplitz, reta, d, inner)
+        pkts += np.bincount(queue, minlength=queues)
+        byts += np.bincount(queue, weights=wirelen,
+                            minlength=queues).astype(np.int64)
+        # Flows as the NIC sees them: by the hashed tuples
+        keys = np.concatenate([get_flow(d, inner),
+                               queue[:, None].astype(np.uint64)], axis=1)
+        flows.append(unique_rows(keys)[0])
+        for q, f in enumerate(files):
+            sel = queue == q
+            if not sel.any():
+                continue
+            if cap.format == 'pcap':
+                f.write(copy_records(cap, frames[sel] - cap.rec_hdr_len,
+                                     caplen[sel]).tobytes())
+            else:
+                f.write(build_records(cap, ts[sel], caplen[sel],
+                                      wirelen[sel], frames[sel]).tobytes())
+    for f in files:
+        f.close()
+
+    if flows:
+        flows = unique_rows(np.concatenate(flows))[0]
+        flow_num = np.bincount(flows[:, -1].astype(np.int64),
+                               minlength=queues)
+    else:
+        flow_num = np.zeros(queues, dtype=np.int64)
+    mean = pkts.sum() / float(queues)
+    return {
+        'queues': queues,
+        'reta_size': len(reta),
+        'inner': inner,
+        'packets': pkts.tolist(),
+        'bytes': byts.tolist(),
+        'flows': flow_num.tolist(),
+        'imbalance': float(pkts.max() / mean) if mean else 0.0,
+        'files': [f.name for f in files],
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('pcap', help='Input pcap or pcapng file')
+    parser.add_argument('--queues', '-q', type=int, required=True,
+                        help='Number of RX queues (e.g., SUT or tester cores)')
+    parser.add_argument('--key', '-k', type=str, default=DEFAULT_KEY,
+                        help='Toeplitz key as hex bytes')
+    parser.add_argument('--reta', type=str,
+                        help='Indirection table: comma separated queues '
+                        '(default: round-robin, %d entries)'
+                        % DEFAULT_RETA_SIZE)
+    parser.add_argument('--inner', action='store_true',
+                        help='Hash the innermost (tunneled) headers')
+    parser.add_argument('--split', '-s', action='store_true',
+                        help='Write the packets of each queue into a '
+                        'separate pcap (traffic-q0.pcap, ...)')
+    parser.add_argument('--results', '-r', type=str,
+                        help='Add the report to the "out.rss" section '
+                        'of this results.json')
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        help='Output JSON file (default: stdout, unless '
+                        '--results is given)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    reta = None
+    if args.reta:
+        reta = [int(q) for q in args.reta.split(',')]
+    report = shard(args.pcap, args.queues, args.key, reta, args.inner,
+                   args.split)
+    if args.results:
+        update_results(args.results, report, key='rss')
+    if args.output or not args.results:
+        out = args.output or sys.stdout
+        json.dump(report, out, indent=4, sort_keys=True)
+        out.write('\n')
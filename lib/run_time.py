@@ -0,0 +1,98 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Run-time commands of a pipeline config.
+
+The 'run_time' list of pipeline.json holds the commands the SUT
+executes in every second.  A command with a 'range' stands for a
+command for each entry of a conf table, e.g.,
+
+  {"action": "add_user",
+   "range": {"table": "run_time_users", "start": 0, "stop": 40,
+             "reverse": false, "key": "args"}}
+
+is {"action": "add_user", "args": user} for the first 40 entries of
+run_time_users.  Ranges are expanded by iter_run_time when the
+commands are executed.
+"""
+
+__all__ = ["iter_run_time", "range_len", "run_time_len"]
+
+RANGE_KEY = 'range'
+
+
+def get_field(obj, name, default=None):
+    "Return a field of a conf object (a dict or an ObjectView)"
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    try:
+        return getattr(obj, name)
+    except (AttributeError, KeyError):
+        # KeyError: the ObjectView of the Ryu apps
+        return default
+
+
+def get_fields(obj):
+    if isinstance(obj, dict):
+        return dict(obj)
+    return dict(vars(obj))
+
+
+def iter_entries(table, start, stop, reverse=False, chunk=4096):
+    "Yield the entries of `table` from `start` to `stop`, chunk by chunk"
+    starts = range(start, stop, chunk)
+    if reverse:
+        starts = reversed(starts)
+    for first in starts:
+        entries = table[first:min(first + chunk, stop)]
+        for entry in (reversed(entries) if reverse else entries):
+            yield entry
+
+
+def range_len(cmd):
+    "Return the number of commands `cmd` stands for"
+    rng = get_field(cmd, RANGE_KEY)
+    if rng is None:
+        return 1
+    return max(0, get_field(rng, 'stop') - get_field(rng, 'start'))
+
+
+def run_time_len(conf, pred=None):
+    """Return the number of run-time commands of `conf` (those matching
+    `pred` only) without expanding the ranges"""
+    return sum(range_len(cmd) for cmd in get_field(conf, 'run_time', [])
+               if pred is None or pred(cmd))
+
+
+def iter_run_time(conf, object_hook=None):
+    """Yield the run-time commands of `conf` with the ranges expanded.
+    The commands of a range are dicts passed through `object_hook`, as
+    the config was loaded."""
+    for cmd in get_field(conf, 'run_time', []):
+        rng = get_field(cmd, RANGE_KEY)
+        if rng is None:
+            yield cmd
+            continue
+        fields = get_fields(cmd)
+        del fields[RANGE_KEY]
+        key = get_field(rng, 'key', 'args')
+        table = get_field(conf, get_field(rng, 'table'))
+        for entry in iter_entries(table, get_field(rng, 'start'),
+                                  get_field(rng, 'stop'),
+                                  get_field(rng, 'reverse', False)):
+            fields[key] = entry
+            yield object_hook(dict(fields)) if object_hook else dict(fields)
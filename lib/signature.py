@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-flow loss, reordering, duplication and latency of a captured
+trace generated with the 'signature' traffic option.
+
+The signature (see pkt_template.SIGNATURE) contains the trace id, the
+flow id (hash of the inner 5-tuple), the sequence number (position of
+the packet in the generated trace) and a TX timestamp slot.  Packets
+with 20-27 bytes of payload have the short signature without the TX
+timestamp slot (SIGNATURE_SHORT), shorter packets are not signed.
+
+Packets are lost if they are in the TX pcap but not in the capture.  The
+reordering depth of a packet is the number of packets of its flow that
+were sent later but received earlier.  The one-way latency is only
+computed if the tester filled in the TX timestamps.
+
+The packets sent to the entities added and removed at run time (see
+the 'churn' traffic option) are flagged in their sequence number.  The
+flag is not part of the sequence number the packets are ordered by,
+the flagged packets are counted separately in 'churn' (of the flows
+and in total) as well.
+"""
+
+import argparse
+import bisect
+import json
+import sys
+from collections import defaultdict
+
+try:
+    from pcap_io import read_pcap
+    from pkt_template import SIG_CHURN, parse_signature
+except ImportError:
+    from .pcap_io import read_pcap
+    from .pkt_template import SIG_CHURN, parse_signature
+
+__all__ = ["iter_signatures", "analyze"]
+
+
+def iter_signatures(fname, trace_id=None):
+    """Yield the (RX timestamp [ns], trace id, flow id, seq, TX timestamp
+    [ns], churn) of the packets with a signature in the pcap `fname`.
+    churn is set for the packets of run-time entities, the SIG_CHURN
+    bit is cleared in their seq."""
+    for ts, frame in read_pcap(fname):
+        sig = parse_signature(frame)
+        if sig is None:
+            continue
+        trace, flow, seq, tx_ts = sig
+        if trace_id is not None and trace != trace_id:
+            continue
+        yield ts, trace, flow, seq & ~SIG_CHURN, tx_ts, bool(seq & SIG_CHURN)
+
+
+class FlowStats(object):
+    def __init__(self):
+        self.tx = None
+        self.rx = 0
+        self.seqs = set()
+        # Packets of run-time entities
+        self.churn_tx = None
+        self.churn_rx = 0
+        self.churn_seqs = set()
+        self.arrived = []  # sorted sequence numbers
+        self.reordered = 0
+        self.max_reorder_depth = 0
+        self.latency = []
+
+    def add(self, seq, rx_ts, tx_ts, churn=False):
+        self.rx += 1
+        if churn:
+            self.churn_rx += 1
+        if seq in self.seqs:
+            return
+        self.seqs.add(seq)
+        if churn:
+            self.churn_seqs.add(seq)
+        depth = len(self.arrived) - bisect.bisect(self.arrived, seq)
+        if depth:
+            self.reordered += 1
+            self.max_reorder_depth = max(self.max_reorder_depth, depth)
+        bisect.insort(self.arrived, seq)
+        if tx_ts:
+            self.latency.append(rx_ts - tx_ts)
+
+    def as_dict(self):
+        d = {
+            'rx': self.rx,
+            'unique': len(self.seqs),
+            'dup': self.rx - len(self.seqs),
+            'reordered': self.reordered,
+            'max_reorder_depth': self.max_reorder_depth,
+        }
+        if self.tx is not None:
+            d['tx'] = self.tx
+            d['lost'] = self.tx - len(self.seqs)
+        if self.churn_tx or self.churn_rx:
+            churn = {'rx': self.churn_rx, 'unique': len(self.churn_seqs),
+                     'dup': self.churn_rx - len(self.churn_seqs)}
+            if self.churn_tx is not None:
+                churn['tx'] = self.churn_tx
+                churn['lost'] = self.churn_tx - len(self.churn_seqs)
+            d['churn'] = churn
+        if self.latency:
+            d['latency_ns'] = {
+                'min': min(self.latency),
+                'avg': sum(self.latency) / len(self.latency),
+                'max': max(self.latency),
+            }
+        return d
+
+
+def analyze(rx_pcap, tx_pcap=None, trace_id=None):
+    """Return the per-flow and total statistics of the capture `rx_pcap`.
+    If the generated pcap `tx_pcap` is given, the lost packets are
+    counted and the trace id is taken from it."""
+    flows = defaultdict(FlowStats)
+    if tx_pcap:
+        tx = defaultdict(set)
+        churn_tx = defaultdict(set)
+        for _, trace, flow, seq, _, churn in iter_signatures(tx_pcap,
+                                                             trace_id):
+            if trace_id is None:
+                trace_id = trace
+            tx[flow].add(seq)
+            if churn:
+                churn_tx[flow].add(seq)
+        for flow, seqs in tx.items():
+            flows[flow].tx = len(seqs)
+            flows[flow].churn_tx = len(churn_tx[flow])
+    for rx_ts, trace, flow, seq, tx_ts, churn in iter_signatures(rx_pcap,
+                                                                 trace_id):
+        if trace_id is None:
+            trace_id = trace
+        flows[flow].add(seq, rx_ts, tx_ts, churn)
+
+    flows = {'%08x' % k: v.as_dict() for k, v in flows.items()}
+    result = {'trace_id': trace_id, 'total': sum_flows(flows.values()),
+              'flows': flows}
+    churn = [f['churn'] for f in flows.values() if 'churn' in f]
+    if churn:
+        result['churn'] = sum_churn(churn)
+    return result
+
+
+def sum_flows(flows):
+    "Return the total statistics of the flows (as returned by as_dict)"
+    total = defaultdict(int)
+    for f in flows:
+        for key in ('tx', 'rx', 'unique', 'dup', 'lost', 'reordered'):
+            if key in f:
+                total[key] += f[key]
+        total['max_reorder_depth'] = max(total['max_reorder_depth'],
+                                         f['max_reorder_depth'])
+    lat = [f['latency_ns'] for f in flows if 'latency_ns' in f]
+    if lat:
+        total['latency_ns'] = {
+            'min': min(l['min'] for l in lat),
+            'max': max(l['max'] for l in lat),
+        }
+    total['flows'] = len(flows)
+    return dict(total)
+
+
+def sum_churn(churn):
+    "Return the total of the per-flow churn packet counts"
+    total = defaultdict(int)
+    for c in churn:
+        for key in ('tx', 'rx', 'unique', 'dup', 'lost'):
+            if key in c:
+                total[key] += c[key]
+    total['flows'] = len(churn)
+    return dict(total)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('rx', help='Captured pcap')
+    parser.add_argument('--tx', '-t', help='Generated pcap (traffic.pcap)')
+    parser.add_argument('--trace-id', type=int, default=None,
+                        help='Only consider packets of this trace')
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        default=sys.stdout, help='Output JSON file')
+    parser.add_argument('--no-flows', action='store_true',
+                        help='Omit the per-flow statistics')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = analyze(args.rx, args.tx, args.trace_id)
+    if args.no_flows:
+        del result['flows']
+    json.dump(result, args.output, indent=4, sort_keys=True)
+    args.output.write('\n')
@@ -0,0 +1,165 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Flows, sizes, directions and timestamps of a captured trace, to be
+replayed onto the entities of a pipeline (see the 'replay-file' traffic
+option).
+
+The capture is scanned once when the generator is created.  Flows are
+identified by the innermost 5-tuple regardless of direction and are
+numbered in the order of their first packet.  The endpoint sending the
+first packet of a flow is the user side: its packets are uplink, the
+packets of the other endpoint are downlink.  Non-IPv4 packets are
+skipped.
+
+The capture is divided into blocks of BLOCK packets.  The workers read
+and dissect the block of their job on their own, so only the flow
+numbers are shared.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from pcap_analyzer import Capture, dissect, unique_rows
+except ImportError:
+    try:
+        from .pcap_analyzer import Capture, dissect, unique_rows
+    except ImportError:
+        # without NumPy
+        Capture = None
+
+__all__ = ["TraceReplay"]
+
+BLOCK = 1024
+
+
+def flow_keys(flow):
+    """Return the direction independent keys of the flows (see
+    pcap_analyzer.dissect) and whether the source is the lower endpoint"""
+    u16, u32 = np.uint64(16), np.uint64(32)
+    mask32 = np.uint64(0xffffffff)
+    mask16 = np.uint64(0xffff)
+    src_ep = ((flow[:, 0] >> u32) << u16) | ((flow[:, 1] >> u16) & mask16)
+    dst_ep = ((flow[:, 0] & mask32) << u16) | (flow[:, 1] & mask16)
+    proto = (flow[:, 1] >> u32) & np.uint64(0xff)
+    src_is_lo = src_ep <= dst_ep
+    lo = np.where(src_is_lo, src_ep, dst_ep)
+    hi = np.where(src_is_lo, dst_ep, src_ep)
+    return np.stack([(lo << np.uint64(8)) | proto, hi], axis=1), src_is_lo
+
+
+class TraceReplay(object):
+    def __init__(self, fname):
+        if Capture is None or np is None:
+            raise ImportError('replaying a capture requires NumPy')
+        self.cap = Capture(fname)
+        self.flows = {}     # flow key -> flow number
+        initiator_lo = []
+        block_off = []      # record offset of the blocks
+        ip_counts = []      # IPv4 packets in the blocks
+        self.t0 = None
+        self.max_size = 0
+        self.job_data = (None, None)
+
+        pkt_idx = 0
+        for ts, caplen, wirelen, frames in self.cap.batches():
+            num = len(frames)
+            starts = np.arange(-pkt_idx % BLOCK, num, BLOCK)
+            block_off.extend((frames[starts] - self.cap.rec_hdr_len).tolist())
+            d = dissect(self.cap.u8, frames, caplen)
+            ip = d['ip']
+            first_block = pkt_idx // BLOCK
+            block = (pkt_idx + np.arange(num)) // BLOCK - first_block
+            counts = np.bincount(block[ip], minlength=block[-1] + 1).tolist()
+            if first_block < len(ip_counts):
+                ip_counts[first_block] += counts.pop(0)
+            ip_counts.extend(counts)
+            pkt_idx += num
+            if not ip.any():
+                continue
+            if self.t0 is None:
+                self.t0 = int(ts[ip][0])
+            sizes = self.inner_sizes(d, wirelen)[ip]
+            self.max_size = max(self.max_size, int(sizes.max()))
+
+            keys, src_is_lo = flow_keys(d['flow'][ip])
+            uniq, inv = unique_rows(keys)
+            first = np.full(len(uniq), len(keys), dtype=np.int64)
+            np.minimum.at(first, inv, np.arange(len(keys)))
+            for u in np.argsort(first, kind='stable'):
+                key = tuple(int(k) for k in uniq[u])
+                if key not in self.flows:
+                    self.flows[key] = len(self.flows)
+                    initiator_lo.append(bool(src_is_lo[first[u]]))
+        self.block_off = np.array(block_off, dtype=np.int64)
+        self.block_pos = np.concatenate([[0], np.cumsum(ip_counts)])
+        self.initiator_lo = np.array(initiator_lo, dtype=bool)
+
+    def __len__(self):
+        "Number of (IPv4) packets in the trace"
+        return int(self.block_pos[-1])
+
+    @staticmethod
+    def inner_sizes(d, wirelen):
+        "Sizes of the innermost frames: the IP packet plus Ethernet"
+        return wirelen.astype(np.int64) - d['inner_l3'] + 14
+
+    def jobs(self, pkt_num):
+        """Yield the position and the number of packets of the non-empty
+        blocks of the first `pkt_num` packets"""
+        for pos, end in zip(self.block_pos[:-1], self.block_pos[1:]):
+            end = min(end, pkt_num)
+            if end > pos:
+                yield int(pos), int(end - pos)
+
+    def job(self, pos, num):
+        """Return the packets of the job at position `pos` as a dict of
+        arrays: 'ts' [us, relative to the first packet], 'size' (of the
+        innermost frame), 'flow' (flow number), 'uplink', 'proto', 'sport'
+        and 'dport' (as sent by the user side of the flow)"""
+        cached_pos, data = self.job_data
+        if cached_pos == pos and len(data['ts']) >= num:
+            return data
+        block = int(np.searchsorted(self.block_pos, pos, side='right')) - 1
+        batches = list(self.cap.batches(BLOCK, self.block_off[block], BLOCK))
+        ts, caplen, wirelen, frames = [np.concatenate(x)
+                                       for x in zip(*batches)]
+        d = dissect(self.cap.u8, frames, caplen)
+        ip = d['ip']
+        keys, src_is_lo = flow_keys(d['flow'][ip])
+        uniq, inv = unique_rows(keys)
+        ranks = np.array([self.flows[tuple(int(k) for k in u)] for u in uniq],
+                         dtype=np.int64)
+        flow = ranks[inv]
+        uplink = src_is_lo == self.initiator_lo[flow]
+        sport = (d['flow'][ip, 1] >> np.uint64(16)) & np.uint64(0xffff)
+        dport = d['flow'][ip, 1] & np.uint64(0xffff)
+        data = {
+            'ts': np.maximum(ts[ip] - self.t0, 0) // 1000,
+            'size': self.inner_sizes(d, wirelen)[ip],
+            'flow': flow,
+            'uplink': uplink,
+            'proto': (d['flow'][ip, 1] >> np.uint64(32)).astype(np.int64),
+            'sport': np.where(uplink, sport, dport).astype(np.int64),
+            'dport': np.where(uplink, dport, sport).astype(np.int64),
+        }
+        data = {k: v[:num] for k, v in data.items()}
+        self.job_data = (pos, data)
+        return data
@@ -108,10 +108,10 @@ def extend_with_default (validator_class):
       if "default" in subschema:
         instance.setdefault(property, subschema["default"])
 
-      for error in validate_properties(
-          validator, properties, instance, schema,
-      ):
-        yield error
+    for error in validate_properties(
+        validator, properties, instance, schema,
+    ):
+      yield error
 
   return jsonschema.validators.extend(
     validator_class, {"properties" : set_defaults,
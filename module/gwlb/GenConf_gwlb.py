@@ -15,55 +15,97 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import random
+
 from gen_conf_base import GenConf as Base
-from gen_conf_base import byte_seq
+from gen_conf_base import byte_seq, format_ip
 
-class GenConf (Base):
-  "Cloud access-gateway & load-balancer"
+class LeafSet (object):
+  "A set of prefix-tree leaves with O(1) add, remove and random choice"
 
-  def __init__ (self, args):
-    super().__init__(args)
-    self.components += ['fakedrop', 'service']
+  def __init__ (self):
+    self.items = []
+    self.pos = {}
+
+  def __len__ (self):
+    return len(self.items)
 
-  def get_prefix_tree (self, new_elements, tree=None):
-    import random
-    from socket import inet_ntoa, inet_aton
-    from struct import pack, unpack
+  def add (self, leaf):
+    self.pos[leaf] = len(self.items)
+    self.items.append(leaf)
 
-    if new_elements == 0:
-      return tree
+  def remove (self, leaf):
+    idx = self.pos.pop(leaf)
+    last = self.items.pop()
+    if idx < len(self.items):
+      self.items[idx] = last
+      self.pos[last] = idx
 
-    if tree is None:
-      tree = [('0.0.0.0', 0)]
-      return self.get_prefix_tree(new_elements - 1, tree)
+  def choice (self, rng):
+    return self.items[rng.randrange(len(self.items))]
 
-    ok = False
-    while not ok:
-      subtree = random.choice(tree)
-      prefix, prefix_len = subtree
-      ok = prefix_len < 24
-    idx = tree.index(subtree)
-    del tree[idx]
+def partition_prefixes (num, max_len=24, balance=0.0, rng=random):
+  """Split 0.0.0.0/0 into `num` disjoint prefixes no longer than
+  `max_len` by splitting a leaf of the prefix tree in two, num-1 times.
+  The leaf to split is the shallowest one with probability `balance`
+  (balance=1 gives prefixes of about log2(num) bits), a random one
+  otherwise.  Return the sorted (network address, prefix length) pairs."""
+  if num == 0:
+    return []
+  if num > 1 << max_len:
+    raise ValueError('cannot split 0.0.0.0/0 into %d prefixes of at most '
+                     '/%d' % (num, max_len))
+  done = []
+  splittable = LeafSet()
+  by_len = [LeafSet() for _ in range(max_len)]
+  shallowest = 0
 
-    # split subtree
+  def add (leaf):
+    if leaf[1] < max_len:
+      splittable.add(leaf)
+      by_len[leaf[1]].add(leaf)
+    else:
+      done.append(leaf)
+
+  add((0, 0))
+  for _ in range(num - 1):
+    if balance and rng.random() < balance:
+      while not by_len[shallowest]:
+        shallowest += 1
+      leaf = by_len[shallowest].choice(rng)
+    else:
+      leaf = splittable.choice(rng)
+    splittable.remove(leaf)
+    by_len[leaf[1]].remove(leaf)
+    net, prefix_len = leaf
     prefix_len += 1
-    prefix_b = unpack('!I', inet_aton(prefix))[0]
-    prefix_2 = prefix_b | (1 << (32 - prefix_len))
-    prefix_2 = pack('!I', prefix_2)
-    # add new subtrees
-    tree += [(prefix, prefix_len), (inet_ntoa(prefix_2), prefix_len)]
+    add((net, prefix_len))
+    add((net | 1 << 32 - prefix_len, prefix_len))
+  return sorted(done + splittable.items)
+
+class GenConf (Base):
+  "Cloud access-gateway & load-balancer"
 
-    return self.get_prefix_tree(new_elements -1, tree)
+  def __init__ (self, args):
+    super().__init__(args)
+    self.components += ['fakedrop', 'service']
 
+  def get_prefix_tree (self, new_elements, rng=random):
+    "Return `new_elements` disjoint backend prefixes as (ip, prefix_len)"
+    if self.args.backend_max_prefix_len > 24:
+      raise ValueError('backend-max-prefix-len must be at most 24')
+    prefixes = partition_prefixes(new_elements,
+                                  self.args.backend_max_prefix_len,
+                                  self.args.backend_balance, rng)
+    return [(format_ip(net), prefix_len) for net, prefix_len in prefixes]
 
   def add_service (self):
-    from socket import inet_ntoa
-    from struct import pack
+    rng = random.Random(self.args.backend_seed)
     self.conf['service'] = []
     self.conf['gw'] = {'mac': 'aa:cc:dd:cc:ac:dc'}
     for s in range(self.args.service_num):
       backends = []
-      prefixes = self.get_prefix_tree(self.args.backend_num)
+      prefixes = self.get_prefix_tree(self.args.backend_num, rng)
       for (ip_src, prefix_len) in prefixes:
         backend = {'output': None, # send via the uplink port
                    'ip-src': ip_src,
@@ -21,6 +21,21 @@ from scapy.all import *
 from gen_pcap_base import GenPkt as Base
 
 class GenPkt(Base):
+    def __init__(self, *args, **kw):
+        super(GenPkt, self).__init__(*args, **kw)
+        self.src_prefixes = None
+
+    def get_src_prefix(self, service_idx, backend_idx):
+        "Return the ip_src of a backend without its last byte, e.g., '10.0.0.'"
+        if self.src_prefixes is None:
+            self.src_prefixes = [
+                [b.ip_src[:b.ip_src.rindex('.') + 1] for b in service.backend]
+                for service in self.conf.service]
+        return self.src_prefixes[service_idx][backend_idx]
+
+    def get_flow_num(self):
+        # Packets go round-robin to the backends
+        return len(self.conf.service) * len(self.conf.service[0].backend)
 
     def get_auto_pkt_num(self):
         services = len(self.conf.service)
@@ -39,17 +54,17 @@ class GenPkt(Base):
 
         if backend.prefix_len > 24:
             raise Exception('prefix (%d) > 24' % backend.prefix_len)
-        ip_src = backend.ip_src.split('.')
-        ip_src[-1] = str(random.randint(1, 254))
-        ip_src = '.'.join(ip_src)
+        ip_src = self.get_src_prefix(service_idx, backend_idx)
+        ip_src += str(self.rng.randint(1, 254))
         udp_src = 22 + (pkt_idx % 1000)
 
-        pkt = (
-            Ether(dst=self.conf.gw.mac) /
-            IP(src=ip_src, dst=service.ip_dst) /
-            UDP(sport=udp_src, dport=int(service.udp_dst))
-        )
-
-        pkt = self.add_payload(pkt, self.args.pkt_size)
-        return pkt
+        return self.build_pkt(
+            'gwlb',
+            lambda: (
+                Ether(dst=self.conf.gw.mac) /
+                IP(src=ip_src, dst=service.ip_dst) /
+                UDP(sport=udp_src, dport=int(service.udp_dst))
+            ),
+            ['IP.src', 'IP.dst', 'UDP.sport', 'UDP.dport'],
+            [ip_src, service.ip_dst, udp_src, int(service.udp_dst)])
 
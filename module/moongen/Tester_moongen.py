@@ -25,7 +25,15 @@ class Tester(Base):
     def __init__(self, conf):
         super().__init__(conf)
         tester = conf.tester
-        if conf.traffic.dir == 'uplink':
+        # bidir: the uplink port sends the uplink packets
+        # (traffic.pcap), the downlink port the downlink packets
+        # (traffic-dl.pcap).  The ports cannot replay the interleaved
+        # trace, they would send the packets of the other direction too.
+        self.bidir = conf.traffic.dir == 'bidir'
+        if self.bidir and not conf.traffic.bidir_split:
+            raise Exception("traffic.dir bidir requires traffic.bidir-split "
+                            "for moongen")
+        if conf.traffic.dir in ('uplink', 'bidir'):
             self.txdev = tester.uplink_port
             self.rxdev = tester.downlink_port
         elif conf.traffic.dir == 'downlink':
@@ -35,6 +43,8 @@ class Tester(Base):
             raise Exception("unavailable traffic.dir: %s" % conf.traffic.dir)
         if tester.core != 1:
             self.txdev = "%s:%s" % (self.txdev, tester.core)
+        self.core = tester.core
+        self.rss_shard = tester.rss_shard and tester.core > 1
         self.mg_cmd = tester.moongen_cmd
         self.lua_dir = Path(__file__).parent
         self.script = self.lua_dir / 'mg-pcap.lua'
@@ -46,14 +56,39 @@ class Tester(Base):
         pcap = out_dir / 'traffic.pcap'
         pfix = out_dir / 'mg'
         hfile = out_dir / 'mg.histogram.csv'
-        cmd = ['sudo', self.mg_cmd, self.script, self.txdev, self.rxdev, pcap,
-               '-l', '-t', '-r', self.runtime, '-o', pfix, '--hfile', hfile]
+        pcaps = [pcap]
+        if self.rss_shard:
+            pcaps = self.shard_pcap(pcap)
+        cmd = ['sudo', self.mg_cmd, self.script, self.txdev, self.rxdev]
+        cmd += pcaps
+        if self.bidir:
+            cmd += ['--rev-file'] + self.get_rev_pcaps(out_dir)
+        cmd += ['-l', '-t', '-r', self.runtime, '-o', pfix, '--hfile', hfile]
         if self.rate_limit:
             cmd += ['--rate-limit', self.rate_limit]
         cmd = [ str(o) for o in cmd ]
         print(' '.join(cmd))
         subprocess.call(cmd)
 
+    def get_rev_pcaps(self, out_dir):
+        "Return the pcaps of the downlink packets sent by the rxdev in bidir"
+        pcap = out_dir / 'traffic-dl.pcap'
+        if self.rss_shard:
+            return self.shard_pcap(pcap, 'rss-shard-dl')
+        return [pcap]
+
+    def shard_pcap(self, pcap, result_key='rss-shard'):
+        """Split the pcap into one pcap per core by the user flows (the
+        innermost headers), return their paths"""
+        # NumPy is only needed for sharding
+        import rss
+        report = rss.shard(str(pcap), self.core, inner=True, split=True)
+        if 0 in report['packets']:
+            raise Exception("rss-shard: no packets for some of the cores: %s"
+                            % report['packets'])
+        self.result[result_key] = report
+        return [Path(f) for f in report['files']]
+
     def collect_results(self):
         with open('mg.latency.csv') as f:
             reader = csv.DictReader(f)
@@ -62,13 +97,18 @@ class Tester(Base):
         latency['unit'] = 'ns'
 
         throughput = {}
+        per_device = {}
         with open('mg.throughput.csv') as f:
             # The last rows describe for the overall performance
             reader = csv.DictReader(f)
             for row  in reader:
                 d = row.pop('Direction')
                 throughput[d] = row
+                per_device.setdefault(row.get('Device'), {})[d] = row
         self.result.update({
             'latency': latency,
             'throughput': throughput
         })
+        if self.bidir:
+            # Both ports send and receive
+            self.result['throughput-per-device'] = per_device
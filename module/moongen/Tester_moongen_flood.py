@@ -24,6 +24,9 @@ class Tester(Base):
     def __init__(self, conf):
         super().__init__(conf)
         self.script = self.lua_dir / 'mg-flood.lua'
+        if self.bidir:
+            raise Exception("unavailable traffic.dir for moongen-flood: %s"
+                            % conf.traffic.dir)
 
     def _run(self, out_dir):
         pcap = out_dir / 'traffic.pcap'
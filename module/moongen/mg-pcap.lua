@@ -55,7 +55,9 @@ function configure(parser)
    parser:description("Replay a PCAP file with rate control and measure latencies.")
    parser:argument("txDev", "txport[:numcores]"):default(0)
    parser:argument("rxDev", "rxport"):default(1):convert(tonumber)
-   parser:argument("file", "pcap file"):args(1)
+   parser:argument("file", "pcap file, or one pcap file per core"):args("+")
+   parser:option("--rev-file", "bidirectional traffic: pcap file, or one pcap file per core,\n"
+                 .. "replayed on rxDev (received by txDev)"):args("+"):target("revFile")
    parser:option("--rate-limit", "replay speed [Mbit/s]\ndefault, 0: replay as fast as possible\n(Relies on hw rate limiting of txDev: see test-setRate.lua)"):default(0):convert(tonumber):target("rateLimit")
    parser:option("-h --hfile", "latency histogram."):default("histogram.csv")
    parser:option("-r --runtime", "running time in seconds."):default(0):convert(tonumber)
@@ -75,9 +77,16 @@ function master(args)
       txport, cores = tonumber(args.txDev), 1
    end
    local txDev, rxDev, lastRxQue
+   local bidir = args.revFile ~= nil
+   if bidir and txport == args.rxDev then
+      log:fatal("bidirectional traffic requires two ports")
+   end
    if txport ~= args.rxDev then
+     -- The rxDev replays the reverse traffic on its first tx queues
+     local rxTxQueues = bidir and math.max(cores, 2) or 2
      txDev = device.config({port = txport, txQueues = cores+1, rxQueues = 2})
-     rxDev = device.config({port = args.rxDev, rxQueues = cores+1, txQueues = 2})
+     rxDev = device.config({port = args.rxDev, rxQueues = cores+1,
+                            txQueues = rxTxQueues})
      lastRxQue = cores
    else
       txDev = device.config({port = txport,
@@ -86,26 +95,42 @@ function master(args)
       lastRxQue = cores
    end
    device.waitForLinks()
+   if #args.file ~= 1 and #args.file ~= cores then
+      log:fatal("%d pcap files for %d cores", #args.file, cores)
+   end
+   if bidir and #args.revFile ~= 1 and #args.revFile ~= cores then
+      log:fatal("%d reverse pcap files for %d cores", #args.revFile, cores)
+   end
    for i = 1, cores do
       mg.startTask("replay_pcap", txDev:getTxQueue(i-1),
-                   args.file, args.loop)
+                   args.file[math.min(i, #args.file)], args.loop)
+   end
+   local txDevs, rxDevs = {txDev}, {rxDev}
+   if bidir then
+      for i = 1, cores do
+         mg.startTask("replay_pcap", rxDev:getTxQueue(i-1),
+                      args.revFile[math.min(i, #args.revFile)], args.loop)
+      end
+      txDevs, rxDevs = {txDev, rxDev}, {rxDev, txDev}
    end
    if args.ofile then
-      stats.startStatsTask{txDevices = {txDev}, rxDevices = {rxDev},
+      stats.startStatsTask{txDevices = txDevs, rxDevices = rxDevs,
                            format="csv", file=args.ofile .. ".throughput.csv"}
    else
-      stats.startStatsTask{txDevices = {txDev}, rxDevices = {rxDev},
+      stats.startStatsTask{txDevices = txDevs, rxDevices = rxDevs,
                            format="plain"}
    end
    if args.rateLimit > 0 then
       -- setting per que rate limit must come after startStatsTask
-      log:info('Set hw rate-limit of %s to %s Mbit/s', txDev, args.rateLimit)
-      setRate:setRate(txDev, args.rateLimit)
+      for _, dev in ipairs(txDevs) do
+         log:info('Set hw rate-limit of %s to %s Mbit/s', dev, args.rateLimit)
+         setRate:setRate(dev, args.rateLimit)
+      end
    end
    if args.timestamps then
       mg.startSharedTask("measure_latency", txDev:getTxQueue(cores),
                          rxDev:getRxQueue(lastRxQue), args.hfile,
-                         args.file, args.ofile)
+                         args.file[1], args.ofile)
    end
    if args.runtime > 0 then
       mg.setRuntime(args.runtime)
@@ -36,6 +36,6 @@ class GenPkt(Base):
         dmac = 'aa:cc:dd:cc:ac:dc'
         sip = byte_seq('2.2.%d.%d', (pkt_idx % 64516) + 1)
         dip = byte_seq('3.3.%d.%d', (pkt_idx % 64516) + 1)
-        p = Ether(dst=dmac, src=smac) / IP(src=sip, dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        return self.build_pkt(
+            'nat', lambda: Ether(dst=dmac, src=smac) / IP(src=sip, dst=dip),
+            ['IP.src', 'IP.dst'], [sip, dip])
@@ -45,6 +45,8 @@ from ryu.services.protocols.bgp.utils.evtlet import LoopingCall
 fdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(fdir, '..', '..', 'lib'))
 import find_mod
+from conf_tables import load_conf
+from run_time import iter_run_time
 
 CONF = cfg.CONF['tipsy']
 
@@ -78,7 +80,7 @@ class ObjectView(object):
     try:
       with open(fname, 'r') as f:
         conv_fn = lambda d: ObjectView(**d)
-        self.__dict__.update(json.load(f, object_hook=conv_fn).__dict__)
+        self.__dict__.update(load_conf(f, object_hook=conv_fn).__dict__)
     except IOError as e:
       eprint('Failed to load cfg file (%s): %s' % (fname, e))
       raise e
@@ -176,7 +178,7 @@ class RyuApp(app_manager.RyuApp):
       raise Exception('Previous handle_timer is still running')
     self.lock = True
 
-    for cmd in self.pl_conf.run_time:
+    for cmd in iter_run_time(self.pl_conf, lambda d: ObjectView(**d)):
       attr = getattr(self.pl, 'do_%s' % cmd.action, self.pl.do_unknown)
       attr(cmd)
 
@@ -88,7 +88,9 @@ class SUT_openflow(Base):
     match = {'eth_type': ETH_TYPE_IP, 'ipv4_dst': addr}
     out_group = gr_offset + entry.nhop
     action = parser.OFPActionGroup(out_group)
-    self.parent.mod_flow(table, match=match, actions=[action], cmd=cmd)
+    # Longest prefix match by priority
+    self.parent.mod_flow(table, match=match, actions=[action], cmd=cmd,
+                         priority=entry.prefix_len)
 
   def add_group_table_entry(self, direction, entry):
     parser = self.parent.dp.ofproto_parser
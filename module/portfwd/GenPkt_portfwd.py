@@ -31,9 +31,9 @@ class GenPkt(Base):
         return 1024
 
     def gen_pkt(self, pkt_idx):
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', random.randrange(1, 65023))
-        dip = byte_seq('3.3.%d.%d', random.randrange(1, 255))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', self.rng.randrange(1, 65023))
+        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', self.rng.randrange(1, 65023))
+        dip = byte_seq('3.3.%d.%d', self.rng.randrange(1, 255))
+        return self.build_pkt(
+            'portfwd', lambda: Ether(dst=dmac, src=smac) / IP(dst=dip),
+            ['Ether.dst', 'Ether.src', 'IP.dst'], [dmac, smac, dip])
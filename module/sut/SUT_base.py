@@ -64,6 +64,10 @@ class SUT(object):
 
         for fname in ['pipeline.json', 'benchmark.json']:
             self.upload_to_remote(src_dir / fname, dst_dir / fname)
+        # Columnar sidecar of pipeline.json (gen_conf.py --sidecar)
+        if (src_dir / 'pipeline.cols').exists():
+            self.upload_to_remote(src_dir / 'pipeline.cols',
+                                  dst_dir / 'pipeline.cols')
 
     def start(self, *args):
         self.run_setup_script()
@@ -18,8 +18,9 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import ipaddress
 import json
-import re
+import os
 import requests
 import signal
 import subprocess
@@ -27,6 +28,11 @@ import sys
 import time
 from tempfile import NamedTemporaryFile
 
+fdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(fdir, '..', 'lib'))
+from conf_tables import load_conf
+from run_time import iter_run_time
+
 
 class PL(object):
     def __init__(self, plconf, bmconf):
@@ -51,7 +57,8 @@ class PL(object):
     def _run(self):
         table_actions = ('mod_l3_table', 'mod_group_table')
         while self._running:
-            for task in self.plconf.run_time:
+            for task in iter_run_time(self.plconf,
+                                      lambda d: ObjectView(**d)):
                 if not self._running:
                     return
                 if task.action in table_actions:
@@ -102,7 +109,7 @@ class PL_l3fwd(PL):
             cmds.append('set int ip address %s %s' % params)
 
         for entry in self.plconf.upstream_l3_table:
-            ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+            ip = prefix_of(entry.ip, entry.prefix_len)
             route_params = (ip, entry.prefix_len, self.uplink_if)
             cmds.append('ip route add %s/%d via %s' % route_params)
             arp_params = (self.uplink_if, entry.ip,
@@ -110,7 +117,7 @@ class PL_l3fwd(PL):
             cmds.append('set ip arp %s %s %s' % arp_params)
 
         for entry in self.plconf.downstream_l3_table:
-            ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+            ip = prefix_of(entry.ip, entry.prefix_len)
             route_params = (ip, entry.prefix_len, self.downlink_if)
             cmds.append('ip route add %s/%d via %s' % route_params)
             arp_params = (self.downlink_if, entry.ip,
@@ -143,7 +150,7 @@ class PL_l3fwd(PL):
         arp_template = 'sudo vppctl set ip arp %s %s %s %s'
         interface = {'upstream': self.uplink_if,
                      'downstream': self.downlink_if}[table]
-        ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+        ip = prefix_of(entry.ip, entry.prefix_len)
         route_params = (cmd, ip, entry.prefix_len, interface)
         if cmd == 'add':
             cmd = ''
@@ -257,6 +264,12 @@ class ObjectView(object):
         return self.__dict__.__repr__()
 
 
+def prefix_of(ip, prefix_len):
+    "Return the network address of ip/prefix_len"
+    net = ipaddress.ip_network('%s/%d' % (ip, prefix_len), strict=False)
+    return str(net.network_address)
+
+
 def byte_seq(template, seq):
     return template % (int(seq / 254), (seq % 254) + 1)
 
@@ -282,7 +295,7 @@ if __name__ == '__main__':
 
     try:
         def conv_fn(d): return ObjectView(**d)
-        plconf = json.load(args.pl_conf, object_hook=conv_fn)
+        plconf = load_conf(args.pl_conf, object_hook=conv_fn)
         bmconf = json.load(args.bm_conf, object_hook=conv_fn)
     except:
         raise